@@ -0,0 +1,8 @@
+"""
+Benchmarks
+Synthetic save generator and timed suite for the parser and save handler
+
+Run from the stellaris_save_editor directory: python -m benchmarks --help
+Also python -m benchmarks.serialize (streaming vs joined serializer) and
+python -m benchmarks.tree_memory (dict vs compact tree memory)
+"""
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Run the benchmark suite
+
+Usage: python -m benchmarks [--sizes 1,10,100] [--cases parse_full,load]
+                            [--output results.json] [--baseline old.json]
+
+Generates (or reuses) a synthetic save per size, times every case and
+writes the results as JSON. With --baseline, cases that got slower than
+--threshold are flagged and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.suite import CASES, compare, run
+
+MAX_SIZE_MB = 500
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default='1,10,50',
+                        help=f"comma-separated gamestate sizes in MB, up to {MAX_SIZE_MB} (default: 1,10,50)")
+    parser.add_argument('--cases', help=f"comma-separated cases (default: all of {', '.join(CASES)})")
+    parser.add_argument('--repeat', type=int, default=3, help="timings per case; the best is kept")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic saves")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'stellaris_benchmarks'),
+                        help="where synthetic saves are generated and kept between runs")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="slowdown (fraction) that counts as a regression (default: 0.10)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the traced run for peak memory")
+    parser.add_argument('--phases', action='store_true',
+                        help="add a run per case recording the time and peak memory of each phase")
+    args = parser.parse_args(argv)
+    
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    if any(not 1 <= size <= MAX_SIZE_MB for size in args.sizes):
+        parser.error(f"sizes must be between 1 and {MAX_SIZE_MB} MB")
+    args.cases = args.cases.split(',') if args.cases else None
+    unknown = [name for name in args.cases or () if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = run(args.sizes, args.cases, args.data_dir, args.repeat, args.seed, not args.no_memory,
+                  args.phases)
+    
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+        print(f"Results written to {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(json.load(fp), results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark the streaming serializer against the old string-joining one
+
+Usage: python -m benchmarks.serialize [save.sav]
+
+Parses the gamestate of the given save (or a synthetic tree if there is
+none) and serializes the same tree with the old implementation,
+serialize() and serialize_to() into memory and into a zip entry, reporting
+time, throughput and peak traced memory for each.
+"""
+
+import argparse
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from parser import ClausewitzParser
+
+DEFAULT_SAVE = "liam_modified.sav"
+
+
+def legacy_serialize(parser: ClausewitzParser, data, indent: int = 0) -> str:
+    """The serializer before streaming: every level joins its children's strings"""
+    lines = []
+    indent_str = '\t' * indent
+    
+    for key, value in data.items():
+        if key == '':
+            for item in value:
+                if isinstance(item, dict):
+                    lines.append(f"{indent_str}{{")
+                    lines.append(legacy_serialize(parser, item, indent + 1))
+                    lines.append(f"{indent_str}}}")
+                else:
+                    lines.append(f"{indent_str}{parser._format_value(item)}")
+        elif isinstance(value, dict):
+            lines.append(f"{indent_str}{key}=")
+            lines.append(f"{indent_str}{{")
+            lines.append(legacy_serialize(parser, value, indent + 1))
+            lines.append(f"{indent_str}}}")
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    lines.append(f"{indent_str}{key}=")
+                    lines.append(f"{indent_str}{{")
+                    lines.append(legacy_serialize(parser, item, indent + 1))
+                    lines.append(f"{indent_str}}}")
+                else:
+                    lines.append(f"{indent_str}{key}={parser._format_value(item)}")
+        else:
+            lines.append(f"{indent_str}{key}={parser._format_value(value)}")
+    
+    return '\n'.join(lines)
+
+
+def synthetic_tree(countries: int = 2000):
+    """A nested tree shaped roughly like a gamestate country section"""
+    return {
+        'version': 'v3.10.4',
+        'country': {
+            str(i): {
+                'name': f'Empire {i}',
+                'modules': {
+                    'standard_economy_module': {
+                        'resources': {'energy': 1000.5 + i, 'minerals': 2000.25, 'food': 300},
+                    },
+                },
+                'owned_planets': {'': list(range(i, i + 20))},
+                'flags': {f'flag_{j}': j for j in range(10)},
+                'ai': {'enabled': i % 2 == 0, 'settings': {'': [{'x': 1}, {'y': 2}]}},
+            }
+            for i in range(countries)
+        },
+    }
+
+
+def load_tree(path: str):
+    """Fully parse a save's gamestate, or build a synthetic tree"""
+    if not os.path.exists(path):
+        print(f"{path} not found, using a synthetic tree")
+        return synthetic_tree()
+    
+    with zipfile.ZipFile(path) as zf:
+        content = zf.read('gamestate')
+    print(f"Parsing {path} ({len(content) / 1024 / 1024:.1f} MB)...")
+    return ClausewitzParser().parse(content, parse_all=True)
+
+
+def measure(label: str, func):
+    """Run func, printing its time, throughput and peak allocation
+    
+    Memory is traced in a second run so tracing does not skew the timing.
+    """
+    start = time.perf_counter()
+    size = func()
+    elapsed = time.perf_counter() - start
+    
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    print(f"{label:<28} {elapsed:8.2f} s  {size / 1024 / 1024 / elapsed:8.1f} MB/s  "
+          f"peak {peak / 1024 / 1024:8.1f} MB")
+    return size
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.serialize', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('save', nargs='?', default=DEFAULT_SAVE,
+                        help=f"save whose gamestate is serialized (default: {DEFAULT_SAVE}, "
+                             "or a synthetic tree if it is missing)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    data = load_tree(args.save)
+    parser = ClausewitzParser()
+    
+    # Both implementations must produce identical text
+    expected = legacy_serialize(parser, data)
+    assert parser.serialize(data) == expected, "serialize() output differs from the old serializer"
+    buffer = io.BytesIO()
+    parser.serialize_to(buffer, data)
+    assert buffer.getvalue() == expected.encode('utf-8'), "serialize_to() output differs"
+    del expected, buffer
+    
+    print(f"\n{'implementation':<28} {'time':>10}  {'throughput':>13}  {'memory':>13}")
+    measure("old serialize (join)", lambda: len(legacy_serialize(parser, data).encode('utf-8')))
+    measure("serialize()", lambda: len(parser.serialize(data).encode('utf-8')))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        def to_file():
+            with open(os.path.join(tmp, 'gamestate'), 'wb') as fp:
+                return parser.serialize_to(fp, data)
+        
+        def to_zip():
+            with zipfile.ZipFile(os.path.join(tmp, 'out.sav'), 'w', zipfile.ZIP_DEFLATED) as zf:
+                with zf.open('gamestate', 'w', force_zip64=True) as fp:
+                    return parser.serialize_to(fp, data)
+        
+        measure("serialize_to(file)", to_file)
+        measure("serialize_to(zip entry)", to_zip)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Benchmark Suite
+Timed parser and save handler operations over synthetic saves
+"""
+
+import gc
+import itertools
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import zipfile
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from benchmarks.synthetic import GENERATOR_VERSION, write_save
+from instrumentation import add_sink, remove_sink, set_memory_tracing
+from parser import ClausewitzParser
+from save_handler import StellarisSaveFile
+
+# Fast operations are repeated until one timing takes at least this long
+MIN_TIMING = 0.2
+
+# Result fields that identify a measurement across runs
+RESULT_KEY = ('case', 'size_mb')
+
+
+class Fixture:
+    """One synthetic save and what the cases derive from it, built on first use"""
+    
+    def __init__(self, path: str, size: int, work_dir: str):
+        self.path = path
+        self.size = size  # gamestate bytes
+        self.work_dir = work_dir
+        self._content = None
+        self._tree = None
+        self._save_file = None
+    
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            with zipfile.ZipFile(self.path) as zf:
+                self._content = zf.read('gamestate')
+        return self._content
+    
+    @property
+    def tree(self) -> Dict[str, Any]:
+        if self._tree is None:
+            self._tree = ClausewitzParser().parse(self.content, parse_all=True)
+        return self._tree
+    
+    @property
+    def save_file(self) -> StellarisSaveFile:
+        if self._save_file is None:
+            self._save_file = StellarisSaveFile(self.path)
+        return self._save_file
+    
+    def save_copy(self):
+        """Fully recompress the save into a scratch file
+        
+        Block reuse is off so every timing does the same work; the file is
+        removed first so no backup is made.
+        """
+        output = os.path.join(self.work_dir, 'benchmark_output.sav')
+        if os.path.exists(output):
+            os.remove(output)
+        self.save_file.save(output, reuse=False)
+
+
+def _parse(method: str = 'parse', **options):
+    """Case factory: a fresh parser's method over the gamestate"""
+    def make(fixture: Fixture):
+        content = fixture.content
+        return lambda: getattr(ClausewitzParser(), method)(content, **options)
+    return make
+
+
+def _serialize(fixture: Fixture):
+    tree = fixture.tree
+    return lambda: ClausewitzParser().serialize(tree)
+
+
+def _load(fixture: Fixture):
+    return lambda: StellarisSaveFile(fixture.path)
+
+
+def _handler(method: str, *args):
+    """Case factory: a StellarisSaveFile method on the loaded save"""
+    def make(fixture: Fixture):
+        return partial(getattr(fixture.save_file, method), *args)
+    return make
+
+
+def _get_technologies(fixture: Fixture):
+    """Rebuild the player's tech index each call, as after any other edit"""
+    save_file = fixture.save_file
+    def run():
+        save_file._techs = None
+        return save_file.get_technologies()
+    return run
+
+
+def _add_technology(fixture: Fixture):
+    """Add a new technology each call, so the splice is timed and not the duplicate check
+    
+    The calls pile up thousands of edits, so they go to a private copy of
+    the save rather than the one later cases share.
+    """
+    save_file = StellarisSaveFile(fixture.path)
+    numbers = itertools.count()
+    return lambda: save_file.add_technology(f'tech_benchmark_{next(numbers)}')
+
+
+def _save(fixture: Fixture):
+    fixture.save_file  # load outside the timing
+    return fixture.save_copy
+
+
+# name -> (build the timed call from a fixture, whether it processes the whole gamestate).
+# Building the call does any loading, so only the operation itself is timed.
+CASES: Dict[str, Tuple[Callable[[Fixture], Callable[[], Any]], bool]] = {
+    'parse': (_parse(), True),
+    'parse_full': (_parse(parse_all=True), True),
+    'parse_lazy_scalars': (_parse(parse_all=True, lazy_scalars=True), True),
+    'parse_compact': (_parse('parse_compact'), True),
+    'serialize': (_serialize, True),
+    'load': (_load, True),
+    'get_empire_name': (_handler('get_empire_name'), False),
+    'get_game_date': (_handler('get_game_date'), False),
+    'get_resources': (_handler('get_resources'), False),
+    'get_unity': (_handler('get_unity'), False),
+    'get_influence': (_handler('get_influence'), False),
+    'get_technologies': (_get_technologies, False),
+    'set_resource': (_handler('set_resource', 'energy', 12345.5), False),
+    'set_unity': (_handler('set_unity', 1000), False),
+    'set_influence': (_handler('set_influence', 500), False),
+    'add_technology': (_add_technology, False),
+    'save': (_save, True),
+}
+
+
+def _quiet(func: Callable[[], Any]) -> Callable[[], Any]:
+    """Silence anything a case prints while it runs"""
+    def run():
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            return func()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return run
+
+
+def time_call(func: Callable[[], Any], repeat: int) -> Tuple[float, int]:
+    """Best seconds per call over repeat timings, and the calls per timing"""
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIMING:
+            break
+        calls *= 10
+    
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / calls, calls
+
+
+def peak_memory(func: Callable[[], Any]) -> int:
+    """Peak bytes traced while func runs once"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def phase_breakdown(func: Callable[[], Any]) -> Dict[str, Dict[str, float]]:
+    """Seconds and peak traced memory of each instrumented phase of one traced run"""
+    events = []
+    sink = add_sink(events.append)
+    set_memory_tracing(True)
+    try:
+        func()
+    finally:
+        set_memory_tracing(False)
+        remove_sink(sink)
+    return {event.name: {'seconds': event.seconds, 'peak_mb': event.peak / 1024 / 1024}
+            for event in events if event.seconds is not None and event.peak is not None}
+
+
+def run(sizes_mb: Iterable[int], cases: Optional[List[str]] = None, data_dir: str = '.',
+        repeat: int = 3, seed: int = 0, memory: bool = True, phases: bool = False) -> Dict[str, Any]:
+    """Run cases against a synthetic save of each size and collect the results
+    
+    Saves are generated into data_dir once and reused by later runs. With
+    phases, one more run per case traces memory in every instrumentation
+    span (parse, serialize, deflate, ...) and records each phase.
+    """
+    cases = cases or list(CASES)
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+    
+    for size_mb in sizes_mb:
+        path = os.path.join(data_dir, f"synthetic_v{GENERATOR_VERSION}_{size_mb}mb_seed{seed}.sav")
+        print(f"Preparing {path}...")
+        path, size = write_save(path, size_mb * 1024 * 1024, seed)
+        fixture = Fixture(path, size, data_dir)
+        
+        for name in cases:
+            make, whole = CASES[name]
+            func = _quiet(make(fixture))
+            seconds, calls = time_call(func, repeat)
+            peak = peak_memory(func) if memory else None
+            result = {
+                'case': name,
+                'size_mb': size_mb,
+                'bytes': size,
+                'seconds': seconds,
+                'calls': calls,
+                'mb_per_s': size / 1024 / 1024 / seconds if whole else None,
+                'peak_mb': peak / 1024 / 1024 if peak is not None else None,
+            }
+            if phases:
+                result['phases'] = phase_breakdown(func)
+            results.append(result)
+            print(format_result(result))
+            for phase, measured in result.get('phases', {}).items():
+                print(f"    {phase:<16} {measured['seconds'] * 1000:12.3f} ms  peak {measured['peak_mb']:8.1f} MB")
+    
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': seed,
+        'repeat': repeat,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    """One table row for a result"""
+    throughput = f"{result['mb_per_s']:8.1f} MB/s" if result['mb_per_s'] is not None else ' ' * 13
+    memory = f"peak {result['peak_mb']:8.1f} MB" if result['peak_mb'] is not None else ''
+    return (f"{result['case']:<20} {result['size_mb']:>5} MB {result['seconds'] * 1000:12.3f} ms  "
+            f"{throughput}  {memory}")
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any],
+            threshold: float = 0.10) -> List[Dict[str, Any]]:
+    """Compare two runs, printing every shared case and returning the regressions
+    
+    A case regresses when its time per call grew by more than threshold
+    (a fraction) over the baseline.
+    """
+    before = {tuple(r[k] for k in RESULT_KEY): r for r in baseline['results']}
+    regressions = []
+    
+    print(f"\n{'case':<20} {'size':>8} {'baseline':>12} {'current':>12} {'change':>8}")
+    for result in current['results']:
+        old = before.get(tuple(result[k] for k in RESULT_KEY))
+        if old is None:
+            continue
+        change = result['seconds'] / old['seconds'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(dict(result, baseline_seconds=old['seconds'], change=change))
+        print(f"{result['case']:<20} {result['size_mb']:>5} MB {old['seconds'] * 1000:9.3f} ms "
+              f"{result['seconds'] * 1000:9.3f} ms {change:+7.1%}{flag}")
+    return regressions
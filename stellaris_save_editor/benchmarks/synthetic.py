@@ -0,0 +1,232 @@
+"""
+Synthetic Saves
+Deterministic gamestates of any size, shaped like a real save
+"""
+
+import io
+import os
+import random
+import re
+import zipfile
+from typing import Any, Dict, Iterator, Tuple
+
+from parser import ClausewitzParser
+
+# Bumped whenever the generated text changes, so saves cached by earlier
+# versions are not reused
+GENERATOR_VERSION = 2
+
+# Share of the gamestate given to each large section, in document order
+SECTION_SHARES = (
+    ('country', 0.15),
+    ('planets', 0.25),
+    ('fleet', 0.10),
+    ('ships', 0.30),
+    ('pop', 0.20),
+)
+
+RESOURCES = ('energy', 'minerals', 'food', 'physics_research', 'society_research',
+             'engineering_research', 'influence', 'unity', 'consumer_goods', 'alloys',
+             'volatile_motes', 'exotic_gases', 'rare_crystals')
+
+TECHNOLOGIES = tuple(f"tech_{area}_{level}" for area in (
+    'solar_panel_network', 'corvettes', 'starbase', 'ship_armor', 'thrusters', 'lasers',
+    'mass_drivers', 'shields', 'basic_industry', 'mechanized_mining', 'space_construction',
+    'colonization', 'genome_mapping', 'robotic_workers', 'hydroponics', 'databank_uplinks',
+) for level in range(1, 9))
+
+JOBS = ('miner', 'farmer', 'technician', 'clerk', 'researcher', 'metallurgist', 'artisan', 'entertainer')
+DESIGNS = ('corvette', 'destroyer', 'cruiser', 'battleship', 'titan', 'science', 'constructor')
+
+# serialize() quotes every string; the game writes these enum values bare
+_BARE_VALUES = re.compile(rb'^(\t*(?:type|planet_class|job|category|ship_design|design|slot|template)=)"(\w+)"$',
+                          re.MULTILINE)
+
+META = 'version="v3.10.4"\nversion_control_revision=1\nname="Synthetic Empire"\ndate="2300.01.01"\n'
+
+
+def _number(rng: random.Random, high: float) -> float:
+    return round(rng.uniform(0, high), 5)
+
+
+def _country(rng: random.Random, country_id: int) -> Dict[str, Any]:
+    """A country with budgets, an economy module and researched technologies"""
+    techs = rng.sample(TECHNOLOGIES, rng.randint(20, 100))
+    return {
+        'name': {'key': f"Empire {country_id}"},
+        'flag': {
+            'icon': {'category': 'pluses', 'file': f"flag_{country_id % 50}.dds"},
+            'colors': {'': ['red', 'black', 'null', 'null']},
+        },
+        'modules': {'standard_economy_module': {
+            'resources': {name: _number(rng, 60000) for name in RESOURCES},
+        }},
+        'budget': {'current_month': {
+            'income': {source: {name: _number(rng, 100) for name in RESOURCES[:8]}
+                       for source in ('country_base', 'planet_jobs', 'starbase_modules')},
+            'expenses': {source: {name: _number(rng, 50) for name in RESOURCES[:4]}
+                         for source in ('ship_components', 'pop_upkeep')},
+        }},
+        'tech_status': {
+            'technology': techs,
+            'level': [rng.randint(1, 3) for _ in techs],
+            'potential': {tech: 'weight' for tech in rng.sample(TECHNOLOGIES, 10)},
+        },
+        'owned_planets': {'': [rng.randrange(100000) for _ in range(rng.randint(1, 30))]},
+        'flags': {f"flag_{i}": rng.randrange(100000) for i in range(rng.randint(0, 15))},
+        'ai': {'enabled': country_id != 0, 'settings': {'': [{'aggression': _number(rng, 1)}]}},
+    }
+
+
+def _planet(rng: random.Random, planet_id: int) -> Dict[str, Any]:
+    """A planet with districts, buildings and per-job employment"""
+    return {
+        'name': {'key': f"Planet {planet_id}"},
+        'planet_class': rng.choice(('pc_desert', 'pc_ocean', 'pc_arctic', 'pc_gaia', 'pc_barren')),
+        'coordinate': {'x': _number(rng, 500), 'y': _number(rng, 500), 'origin': rng.randrange(1000)},
+        'planet_size': rng.randint(5, 30),
+        'stability': _number(rng, 100),
+        'amenities': _number(rng, 50),
+        'districts': {'': [rng.randrange(1000000) for _ in range(rng.randint(0, 20))]},
+        'buildings_cache': {'': [rng.randrange(1000000) for _ in range(rng.randint(0, 12))]},
+        'job_cache': {'': [{'job': job, 'count': rng.randint(0, 40), 'output': _number(rng, 200)}
+                           for job in rng.sample(JOBS, 4)]},
+        'produces': {name: _number(rng, 80) for name in RESOURCES[:6]},
+        'upkeep': {name: _number(rng, 20) for name in RESOURCES[:3]},
+    }
+
+
+def _fleet(rng: random.Random, fleet_id: int) -> Dict[str, Any]:
+    return {
+        'name': {'key': f"Fleet {fleet_id}"},
+        'ships': {'': [rng.randrange(10000000) for _ in range(rng.randint(1, 20))]},
+        'combat': {'coordinate': {'x': _number(rng, 500), 'y': _number(rng, 500)},
+                   'formation_pos': {'x': _number(rng, 10), 'y': _number(rng, 10)}},
+        'movement_manager': {'formation': {'scale': 1.0, 'angle': _number(rng, 6.28)},
+                             'path': {'': [{'node': rng.randrange(1000), 'speed': _number(rng, 5)}
+                                           for _ in range(rng.randint(0, 4))]}},
+        'mission': {'type': 'idle', 'target': rng.randrange(1000)},
+        'military_power': _number(rng, 100000),
+    }
+
+
+def _ship(rng: random.Random, ship_id: int) -> Dict[str, Any]:
+    """A ship with nested sections, weapons and utility slots"""
+    return {
+        'fleet': rng.randrange(100000),
+        'name': {'key': f"Ship {ship_id}"},
+        'ship_design': rng.choice(DESIGNS),
+        'section': [{
+            'design': f"{rng.choice(DESIGNS)}_section_{i}",
+            'slot': f"slot_{i}",
+            'weapon': [{'index': j, 'template': 'SMALL_LASER_1', 'component_slot': f"SMALL_GUN_0{j}"}
+                       for j in range(rng.randint(0, 3))],
+        } for i in range(rng.randint(1, 3))],
+        'hitpoints': _number(rng, 5000),
+        'shield_hitpoints': _number(rng, 2000),
+        'armor_hitpoints': _number(rng, 3000),
+        'experience': _number(rng, 1000),
+        'coordinate': {'x': _number(rng, 500), 'y': _number(rng, 500), 'origin': rng.randrange(1000)},
+    }
+
+
+def _pop(rng: random.Random, pop_id: int) -> Dict[str, Any]:
+    return {
+        'species': rng.randrange(200),
+        'planet': rng.randrange(100000),
+        'job': rng.choice(JOBS),
+        'category': 'worker',
+        'ethos': {'ethic': rng.choice(('ethic_militarist', 'ethic_pacifist', 'ethic_materialist'))},
+        'happiness': _number(rng, 1),
+        'power': _number(rng, 10),
+        'approval_modifier': {'': [{'type': 'living_standard', 'value': _number(rng, 0.5)}
+                                   for _ in range(rng.randint(0, 3))]},
+    }
+
+
+_SECTIONS = {
+    'country': _country,
+    'planets': _planet,
+    'fleet': _fleet,
+    'ships': _ship,
+    'pop': _pop,
+}
+
+
+def iter_gamestate(target_size: int, seed: int = 0) -> Iterator[bytes]:
+    """Yield the gamestate in chunks until it is about target_size bytes
+    
+    The same (target_size, seed) always gives the same text. Country 0 is
+    the player; its modules/standard_economy_module/resources block holds
+    the stockpile (unity and influence included), and its budget the
+    income entries with the same names that the handler must not touch.
+    """
+    rng = random.Random(seed)
+    parser = ClausewitzParser()
+    buffer = io.BytesIO()
+    
+    header = {
+        'version': 'v3.10.4',
+        'version_control_revision': 1,
+        'name': 'Synthetic Empire',
+        'date': '2300.01.01',
+        'required_dlcs': {'': ['Utopia', 'Federations', 'Nemesis']},
+        'player': {'': [{'name': 'benchmark', 'country': 0}]},
+        'tick': 8,
+    }
+    parser.serialize_to(buffer, header)
+    buffer.write(b'\n')
+    yield buffer.getvalue()
+    
+    for section, share in SECTION_SHARES:
+        budget = max(1, int(target_size * share))
+        make = _SECTIONS[section]
+        buffer = io.BytesIO()
+        written = buffer.write(f"{section}=\n{{\n".encode('ascii'))
+        
+        # planets nest their entries one level deeper, like the game does
+        indent = 2 if section == 'planets' else 1
+        if section == 'planets':
+            written += buffer.write(b"\tplanet=\n\t{\n")
+        
+        entity_id = 0
+        while written < budget or (section == 'country' and entity_id == 0):
+            text = parser.serialize({str(entity_id): make(rng, entity_id)}, indent).encode('utf-8')
+            written += buffer.write(_BARE_VALUES.sub(rb'\1\2', text))
+            written += buffer.write(b'\n')
+            entity_id += 1
+            if buffer.tell() >= 1 << 20:
+                yield buffer.getvalue()
+                buffer = io.BytesIO()
+        
+        if section == 'planets':
+            buffer.write(b"\t}\n")
+        buffer.write(b"}\n")
+        yield buffer.getvalue()
+
+
+def generate_gamestate(target_size: int, seed: int = 0) -> bytes:
+    """Build a whole synthetic gamestate in memory"""
+    return b''.join(iter_gamestate(target_size, seed))
+
+
+def write_save(path: str, target_size: int, seed: int = 0) -> Tuple[str, int]:
+    """Write a synthetic .sav (meta plus gamestate) and return (path, gamestate size)
+    
+    An existing file from an earlier run is reused, since generating a
+    large save takes longer than most of the benchmarks.
+    """
+    if os.path.exists(path):
+        with zipfile.ZipFile(path) as zf:
+            return path, zf.getinfo('gamestate').file_size
+    
+    tmp_path = path + '.tmp'
+    size = 0
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        zf.writestr('meta', META)
+        with zf.open('gamestate', 'w', force_zip64=True) as fp:
+            for chunk in iter_gamestate(target_size, seed):
+                fp.write(chunk)
+                size += len(chunk)
+    os.replace(tmp_path, path)
+    return path, size
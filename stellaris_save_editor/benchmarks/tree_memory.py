@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark parse memory of the dict and compact tree backends
+
+Usage: python -m benchmarks.tree_memory [save.sav]
+
+Each backend fully parses the same gamestate in a fresh interpreter, so
+the resident set growth it reports is not skewed by the other run. Falls
+back to a synthetic gamestate when the save is missing.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import zipfile
+
+from benchmarks.serialize import DEFAULT_SAVE, synthetic_tree
+from parser import ClausewitzParser
+
+BACKENDS = {
+    'dict': lambda parser, content: parser.parse(content, parse_all=True),
+    'compact': lambda parser, content: parser.parse_compact(content),
+}
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak rather than current, but each run is a fresh process
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def load_gamestate(path: str) -> bytes:
+    """Read a save's gamestate, or serialize a synthetic one"""
+    if not os.path.exists(path):
+        return ClausewitzParser().serialize(synthetic_tree(20000)).encode('utf-8')
+    with zipfile.ZipFile(path) as zf:
+        return zf.read('gamestate')
+
+
+def run_backend(name: str, path: str):
+    """Parse with one backend and print its measurements as JSON"""
+    content = load_gamestate(path)
+    parser = ClausewitzParser()
+    before = current_rss()
+    start = time.perf_counter()
+    tree = BACKENDS[name](parser, content)
+    elapsed = time.perf_counter() - start
+    after = current_rss()
+    print(json.dumps({'backend': name, 'size': len(content), 'seconds': elapsed,
+                      'rss': after - before, 'keys': len(tree)}))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.tree_memory', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('save', nargs='?', default=DEFAULT_SAVE,
+                        help=f"save whose gamestate is parsed (default: {DEFAULT_SAVE}, "
+                             "or a synthetic gamestate if it is missing)")
+    # Internal: measure one backend in this process (how main() runs each backend)
+    parser.add_argument('--backend', choices=list(BACKENDS), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.backend:
+        run_backend(args.backend, args.save)
+        return
+    
+    path = args.save
+    if not os.path.exists(path):
+        print(f"{path} not found, using a synthetic gamestate")
+    
+    # Each backend runs as this module again, from the directory holding the package
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for name in BACKENDS:
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.tree_memory', os.path.abspath(path),
+                                 '--backend', name],
+                                check=True, capture_output=True, text=True, cwd=root).stdout
+        results[name] = json.loads(output.strip().splitlines()[-1])
+    
+    size = results['dict']['size']
+    print(f"\ngamestate: {size / 1024 / 1024:.1f} MB")
+    print(f"{'backend':<10} {'parse':>9} {'RSS growth':>12} {'x file size':>12}")
+    for name, result in results.items():
+        print(f"{name:<10} {result['seconds']:8.2f}s {result['rss'] / 1024 / 1024:10.1f} MB "
+              f"{result['rss'] / size:11.2f}x")
+    print(f"\ncompact uses {results['dict']['rss'] / max(results['compact']['rss'], 1):.1f}x less memory")
+
+
+if __name__ == "__main__":
+    main()
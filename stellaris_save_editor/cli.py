@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Stellaris Save Editor - Command Line
+Inspect, query and edit many saves at once, one process per file
+
+Usage: python cli.py list SAVES...
+       python cli.py inspect SAVES...
+       python cli.py get SAVES... -q "country/{player}/modules/standard_economy_module/resources/energy"
+       python cli.py set SAVES... --resource energy=5000 --unity 1000 --in-place
+       python cli.py batch-apply EDITS.json SAVES... --output-dir edited/
+       python cli.py diff OLD.sav NEW.sav
+       python cli.py timeseries SAVE_DIR --store campaign.bin --csv campaign.csv
+
+SAVES are .sav files or directories searched recursively for them. Each
+file is handled by a worker process (--jobs, default one per CPU) and its
+result is printed as one JSON line as soon as it is ready; list only reads
+the meta entries, on threads, through the save metadata cache. The exit
+status is 1 if any file failed. diff prints one JSON line per change;
+timeseries extracts metrics from every save into columns by game date.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional
+
+from instrumentation import add_sink, remove_sink, set_memory_tracing
+from lazy_tree import LazyBlock
+from parse_cache import ParseCache
+from save_handler import StellarisSaveFile
+from save_diff import diff
+from save_library import SCAN_WORKERS, MetaCache, iter_save_paths, peek_many
+from timeseries import DEFAULT_METRICS, extract
+
+# Getters available to `get --field`
+FIELDS = {
+    'empire_name': StellarisSaveFile.get_empire_name,
+    'game_date': StellarisSaveFile.get_game_date,
+    'player_country': lambda save: save.player_country_id,
+    'resources': StellarisSaveFile.get_resources,
+    'unity': StellarisSaveFile.get_unity,
+    'influence': StellarisSaveFile.get_influence,
+    'technologies': StellarisSaveFile.get_technologies,
+}
+
+# Keys of an edit spec (the batch-apply file, or what set builds from its flags)
+EDIT_KEYS = ('resources', 'unity', 'influence', 'technologies')
+
+
+def find_saves(paths: List[str]) -> List[str]:
+    """Expand directories into the .sav files below them, keeping file arguments as given"""
+    saves = []
+    for path in paths:
+        if os.path.isdir(path):
+            saves.extend(iter_save_paths(path))
+        else:
+            saves.append(path)
+    return saves
+
+
+def _jsonable(value: Any) -> Any:
+    """Turn query results (lazy blocks, lists of them) into plain JSON values"""
+    if isinstance(value, LazyBlock):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_jsonable(item) for item in value]
+    return value
+
+
+def _inspect(save: StellarisSaveFile, options: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'empire_name': save.get_empire_name(),
+        'game_date': save.get_game_date(),
+        'player_country': save.player_country_id,
+        'gamestate_bytes': len(save.gamestate),
+        'countries': len(save.index.countries),
+        'sections': len(save.index.sections),
+    }
+
+
+def _get(save: StellarisSaveFile, options: Dict[str, Any]) -> Dict[str, Any]:
+    result = {name: FIELDS[name](save) for name in options['fields']}
+    if options['queries']:
+        result['queries'] = {path: _jsonable(save.query(path)) for path in options['queries']}
+    return result
+
+
+def _apply(save: StellarisSaveFile, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply an edit spec and write the save where the options say"""
+    edits = options['edits']
+    with save.batch() as batch:
+        for name, amount in edits.get('resources', {}).items():
+            batch.set_resource(name, amount)
+        if 'unity' in edits:
+            batch.set_unity(edits['unity'])
+        if 'influence' in edits:
+            batch.set_influence(edits['influence'])
+    applied = dict(batch.results)
+    tech_ids = edits.get('technologies', [])
+    added = set(save.add_technologies(tech_ids))
+    for tech_id in tech_ids:
+        applied[f'technology:{tech_id}'] = tech_id in added
+    
+    output = save.filepath
+    if options['output_dir']:
+        output = os.path.join(options['output_dir'], os.path.basename(save.filepath))
+    if options['dry_run']:
+        return {'applied': applied, 'output': None}
+    save.save(output, workers=options['threads'])
+    return {'applied': applied, 'output': output}
+
+
+COMMANDS = {
+    'inspect': _inspect,
+    'get': _get,
+    'set': _apply,
+    'batch-apply': _apply,
+}
+
+
+def run_file(command: str, path: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Load one save and run a command on it; runs in a worker process
+    
+    Never raises: a failure is reported as ok=False with the error, so one
+    bad save does not stop the rest of the batch.
+    """
+    events = []
+    sink = add_sink(events.append) if options['timings'] else None
+    set_memory_tracing(options['trace_memory'])
+    start = time.perf_counter()
+    result = {'path': path, 'ok': True}
+    try:
+        cache = ParseCache(options['cache_dir']) if options['cache_dir'] else None
+        save = StellarisSaveFile(path, cache=cache)
+        try:
+            result.update(COMMANDS[command](save, options))
+        finally:
+            save.close()
+    except Exception as e:
+        result['ok'] = False
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if sink is not None:
+            remove_sink(sink)
+    
+    result['seconds'] = round(time.perf_counter() - start, 4)
+    if sink is not None:
+        result['phases'] = {event.name: round(event.seconds, 4) for event in events if event.seconds is not None}
+        if options['trace_memory']:
+            result['phase_peak_mb'] = {event.name: round(event.peak / 1024 / 1024, 2)
+                                       for event in events if event.peak is not None}
+    return result
+
+
+def run_files(command: str, paths: List[str], options: Dict[str, Any], jobs: int) -> Iterator[Dict[str, Any]]:
+    """Yield each file's result as soon as it is ready (completion order with several jobs)"""
+    if jobs < 2 or len(paths) < 2:
+        for path in paths:
+            yield run_file(command, path, options)
+        return
+    
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_file, command, path, options) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _amount(text: str) -> float:
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def _resource(text: str):
+    name, sep, amount = text.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"expected NAME=AMOUNT, got {text!r}")
+    return name, _amount(amount)
+
+
+def _metric(text: str):
+    name, sep, query = text.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"expected NAME=QUERY, got {text!r}")
+    return name, query
+
+
+def _jobs(text: str) -> int:
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+
+def load_edits(path: str) -> Dict[str, Any]:
+    """Read and check a batch-apply edit spec
+    
+    The file is a JSON object such as
+    {"resources": {"energy": 5000}, "unity": 1000, "influence": 500,
+     "technologies": ["tech_battleships"]}; every key is optional.
+    """
+    with open(path, encoding='utf-8') as fp:
+        edits = json.load(fp)
+    if not isinstance(edits, dict):
+        raise ValueError(f"{path}: edit spec must be a JSON object")
+    unknown = [key for key in edits if key not in EDIT_KEYS]
+    if unknown:
+        raise ValueError(f"{path}: unknown edit keys {', '.join(unknown)} (expected {', '.join(EDIT_KEYS)})")
+    resources = edits.get('resources', {})
+    if not isinstance(resources, dict):
+        raise ValueError(f"{path}: resources must map names to amounts")
+    for name, amount in resources.items():
+        _check_amount(path, f"resources.{name}", amount)
+    for name in ('unity', 'influence'):
+        if name in edits:
+            _check_amount(path, name, edits[name])
+    technologies = edits.get('technologies', [])
+    if not isinstance(technologies, list):
+        raise ValueError(f"{path}: technologies must be a list")
+    for tech_id in technologies:
+        if not isinstance(tech_id, str):
+            raise ValueError(f"{path}: technologies must be strings, got {tech_id!r}")
+    return edits
+
+
+def _check_amount(path: str, name: str, amount: Any):
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount):
+        raise ValueError(f"{path}: {name} must be a number, got {amount!r}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='cli.py', description=__doc__.strip().split('\n')[1])
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--jobs', '-j', type=_jobs, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per CPU)")
+    common.add_argument('--cache-dir', help="parse cache directory shared by the workers (default: no cache)")
+    common.add_argument('--timings', action='store_true', help="add per-phase timings to each result")
+    common.add_argument('--trace-memory', action='store_true',
+                        help="add each phase's peak traced memory too (implies --timings; much slower)")
+    
+    writes = argparse.ArgumentParser(add_help=False)
+    target = writes.add_mutually_exclusive_group(required=True)
+    target.add_argument('--output-dir', help="write edited saves here under their own names")
+    target.add_argument('--in-place', action='store_true', help="overwrite each save (a .backup is kept)")
+    target.add_argument('--dry-run', action='store_true', help="apply the edits in memory only")
+    
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    list_ = commands.add_parser('list', help="name, date and version of saves, from their meta entries only")
+    list_.add_argument('saves', nargs='+')
+    list_.add_argument('--jobs', '-j', type=_jobs, default=SCAN_WORKERS, help="reader threads")
+    list_.add_argument('--no-cache', action='store_true', help="do not use or update the save metadata cache")
+    
+    inspect = commands.add_parser('inspect', parents=[common], help="summarize saves")
+    inspect.add_argument('saves', nargs='+')
+    
+    get = commands.add_parser('get', parents=[common], help="read fields and path queries")
+    get.add_argument('saves', nargs='+')
+    get.add_argument('--field', '-f', action='append', default=[], choices=list(FIELDS), dest='fields')
+    get.add_argument('--query', '-q', action='append', default=[], dest='queries',
+                     help="path query, e.g. country/{player}/modules/standard_economy_module/resources/energy")
+    
+    set_ = commands.add_parser('set', parents=[common, writes], help="edit values in saves")
+    set_.add_argument('saves', nargs='+')
+    set_.add_argument('--resource', action='append', default=[], type=_resource, metavar='NAME=AMOUNT')
+    set_.add_argument('--unity', type=_amount)
+    set_.add_argument('--influence', type=_amount)
+    set_.add_argument('--tech', action='append', default=[], dest='technologies', metavar='TECH_ID')
+    
+    batch = commands.add_parser('batch-apply', parents=[common, writes], help="apply an edit spec file to saves")
+    batch.add_argument('edits', help="JSON edit spec (see load_edits)")
+    batch.add_argument('saves', nargs='+')
+    
+    compare = commands.add_parser('diff', help="path-level changes between two saves")
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.add_argument('--cache-dir', help="parse cache directory for indexes and subtree hashes")
+    
+    series = commands.add_parser('timeseries', help="metrics across a directory of saves, by game date")
+    series.add_argument('directory')
+    series.add_argument('--metric', '-m', action='append', default=[], type=_metric, metavar='NAME=QUERY',
+                        help="column name and query path; {country} gives a column per country "
+                             f"(default: {', '.join(DEFAULT_METRICS)})")
+    series.add_argument('--store', help="binary store to update incrementally")
+    series.add_argument('--csv', help="write the columns as CSV here (default: standard output)")
+    series.add_argument('--jobs', '-j', type=_jobs, default=os.cpu_count() or 1, help="worker processes")
+    series.add_argument('--cache-dir', help="parse cache directory shared by the workers")
+    
+    args = parser.parse_args(argv)
+    if args.command in ('diff', 'timeseries'):
+        return args
+    if args.command == 'get' and not (args.fields or args.queries):
+        parser.error("get needs at least one --field or --query")
+    if args.command == 'set':
+        args.edits = {'resources': dict(args.resource), 'technologies': args.technologies}
+        if args.unity is not None:
+            args.edits['unity'] = args.unity
+        if args.influence is not None:
+            args.edits['influence'] = args.influence
+        if not (args.resource or args.technologies or args.unity is not None or args.influence is not None):
+            parser.error("set needs at least one edit")
+    elif args.command == 'batch-apply':
+        try:
+            args.edits = load_edits(args.edits)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    return args
+
+
+def list_saves(paths: List[str], jobs: int, use_cache: bool) -> int:
+    """Print each save's meta summary as a JSON line, in path order"""
+    failed = 0
+    for info in peek_many(paths, MetaCache() if use_cache else None, jobs):
+        failed += info.error is not None
+        print(json.dumps(info.to_dict()), flush=True)
+    return 1 if failed else 0
+
+
+def diff_saves(old: str, new: str, cache_dir: Optional[str]) -> int:
+    """Print the changes from one save to another as JSON lines"""
+    cache = ParseCache(cache_dir) if cache_dir else None
+    changes = diff(StellarisSaveFile(old, cache=cache), StellarisSaveFile(new, cache=cache), cache)
+    for change in changes:
+        print(json.dumps(change.to_dict(), default=str), flush=True)
+    print(f"{len(changes)} change(s)", file=sys.stderr)
+    return 0
+
+
+def time_series(args) -> int:
+    """Extract the campaign's metric columns and write them as CSV"""
+    metrics = dict(args.metric) if args.metric else None
+    campaign = extract(args.directory, metrics, args.store, args.jobs, args.cache_dir)
+    if args.csv:
+        campaign.to_csv(args.csv)
+    else:
+        campaign.write_csv(sys.stdout)
+    print(f"{len(campaign)} dates, {len(campaign.columns())} columns", file=sys.stderr)
+    return 0
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.command == 'diff':
+        return diff_saves(args.old, args.new, args.cache_dir)
+    if args.command == 'timeseries':
+        return time_series(args)
+    paths = find_saves(args.saves)
+    if not paths:
+        print("No save files found", file=sys.stderr)
+        return 1
+    if args.command == 'list':
+        return list_saves(paths, args.jobs, not args.no_cache)
+    
+    jobs = min(args.jobs, len(paths))
+    output_dir = getattr(args, 'output_dir', None)
+    if output_dir:
+        names = [os.path.basename(path) for path in paths]
+        if len(set(names)) < len(names):
+            print("Several saves share a file name; --output-dir would overwrite them", file=sys.stderr)
+            return 1
+        os.makedirs(output_dir, exist_ok=True)
+    options = {
+        'timings': args.timings or args.trace_memory,
+        'trace_memory': args.trace_memory,
+        'cache_dir': args.cache_dir,
+        'fields': getattr(args, 'fields', []),
+        'queries': getattr(args, 'queries', []),
+        'edits': getattr(args, 'edits', {}),
+        'output_dir': output_dir,
+        'dry_run': getattr(args, 'dry_run', False),
+        # Share the CPUs between processes instead of each deflating on all of them
+        'threads': max(1, (os.cpu_count() or 1) // jobs),
+    }
+    
+    start = time.perf_counter()
+    failed = 0
+    for result in run_files(args.command, paths, options, jobs):
+        failed += not result['ok']
+        print(json.dumps(result, default=str), flush=True)
+    
+    elapsed = time.perf_counter() - start
+    print(f"{len(paths)} file(s), {failed} failed, in {elapsed:.1f} s "
+          f"({len(paths) / elapsed * 60:.1f} files/min, {jobs} job(s))", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+Compact Clausewitz Tree
+Columnar parse tree: one row per node in a handful of typed arrays
+"""
+
+from array import array
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List
+
+from tokenizer import OPEN, TreeBuilder, build_tree
+
+# Node kinds reuse the token kinds: OPEN rows are blocks, others are scalars
+BLOCK = OPEN
+
+# Blocks with more children than this get a key -> rows lookup on first read
+_INDEX_THRESHOLD = 8
+
+# Buffers below this size store offsets as 4-byte unsigned ints
+_SMALL_OFFSETS = 1 << 32
+
+
+class CompactTree:
+    """A fully parsed document stored as parallel arrays
+    
+    Nodes are numbered in document order and row 0 is the document itself.
+    For node i: kinds[i] is its token kind, keys[i] the symbol id of its key
+    ('' is id 0), parents[i] the enclosing block, starts[i]/ends[i]
+    the span of its value in buffer (braces included for blocks) and
+    next_rows[i] the first row after its subtree, so a block's children
+    are found by hopping from i + 1 along next_rows. Scalars stay as spans
+    and are converted on read, so a node costs about 21 bytes instead of a
+    dict or list object. A stray '}' at the top level is skipped, as in the
+    fast parse.
+    """
+    
+    def __init__(self, buffer, parser):
+        self.buffer = buffer
+        self._parser = parser
+        self.symbols = parser.symbols
+        self.kinds = array('b')
+        self.keys = array('i')
+        self.parents = array('i')
+        offset_type = 'I' if len(buffer) < _SMALL_OFFSETS else 'q'
+        self.starts = array(offset_type)
+        self.ends = array(offset_type)
+        self.next_rows = array('i')
+        self._child_index: Dict[int, Dict[int, List[int]]] = {}
+    
+    @classmethod
+    def build(cls, buffer, parser) -> 'CompactTree':
+        """Tokenize the buffer once and fill the node arrays"""
+        tree = cls(buffer, parser)
+        # Row 0 is the whole document
+        tree.kinds.append(BLOCK)
+        tree.keys.append(0)
+        tree.parents.append(-1)
+        tree.starts.append(0)
+        tree.ends.append(len(buffer))
+        tree.next_rows.append(0)
+        
+        builder = _RowBuilder(tree)
+        build_tree(buffer, builder, parser.max_depth, stop_at_close=False)
+        tree.next_rows[0] = len(tree.kinds)
+        return tree
+    
+    def __len__(self) -> int:
+        return len(self.kinds)
+    
+    @property
+    def root(self) -> 'CompactNode':
+        """The document as a mapping"""
+        return CompactNode(self, 0)
+    
+    def children(self, row: int) -> Iterator[int]:
+        """Yield the rows of a block's direct children"""
+        child = row + 1
+        end = self.next_rows[row]
+        next_rows = self.next_rows
+        while child < end:
+            yield child
+            child = next_rows[child]
+    
+    def child_rows(self, row: int, key_id: int) -> List[int]:
+        """Get the rows of a block's children with one key id"""
+        index = self._child_index.get(row)
+        if index is not None:
+            return index.get(key_id, [])
+        
+        keys = self.keys
+        rows = list(self.children(row))
+        if len(rows) <= _INDEX_THRESHOLD:
+            return [child for child in rows if keys[child] == key_id]
+        
+        index = {}
+        for child in rows:
+            index.setdefault(keys[child], []).append(child)
+        self._child_index[row] = index
+        return index.get(key_id, [])
+    
+    def value(self, row: int) -> Any:
+        """Get a node's value: a CompactNode for blocks, else the converted scalar"""
+        kind = self.kinds[row]
+        if kind == BLOCK:
+            return CompactNode(self, row)
+        return self._parser.convert(self.buffer, (kind, self.starts[row], self.ends[row]))
+    
+    def memory_size(self) -> int:
+        """Approximate bytes held by the node arrays"""
+        return sum(column.itemsize * len(column) for column in
+                   (self.kinds, self.keys, self.parents, self.starts, self.ends, self.next_rows))
+
+
+class _RowBuilder(TreeBuilder):
+    """Appends a row per node to a CompactTree from build_tree() callbacks"""
+    
+    def __init__(self, tree: CompactTree):
+        self.key = tree.symbols.token_id
+        self._tree = tree
+        self._kinds = tree.kinds.append
+        self._keys = tree.keys.append
+        self._parents = tree.parents.append
+        self._starts = tree.starts.append
+        self._ends = tree.ends.append
+        self._next_rows = tree.next_rows.append
+        self._count = len(tree.kinds)
+        self._stack = [0]  # rows of the open blocks, the document first
+    
+    def scalar(self, key, token):
+        self._append(token[0], key, token[1], token[2])
+    
+    def open(self, key, start: int):
+        self._stack.append(self._append(BLOCK, key, start, start + 1))
+    
+    def close(self, end: int):
+        row = self._stack.pop()
+        self._tree.ends[row] = end
+        self._tree.next_rows[row] = self._count
+    
+    def _append(self, kind: int, key, start: int, end: int) -> int:
+        """Add a node under the innermost open block and return its row"""
+        row = self._count
+        self._kinds(kind)
+        self._keys(0 if key is None else key)
+        self._parents(self._stack[-1])
+        self._starts(start)
+        self._ends(end)
+        self._next_rows(row + 1)
+        self._count = row + 1
+        return row
+
+
+class CompactNode(Mapping):
+    """Read-only mapping view of one block row in a CompactTree
+    
+    Reads follow the dict tree: repeated keys give lists and bare values or
+    anonymous blocks are listed under ''. Views are created on access and
+    hold nothing but the tree and a row number.
+    """
+    
+    __slots__ = ('tree', 'row')
+    
+    def __init__(self, tree: CompactTree, row: int):
+        self.tree = tree
+        self.row = row
+    
+    @property
+    def span(self):
+        """The (start, end) of this block in the buffer, braces included"""
+        return self.tree.starts[self.row], self.tree.ends[self.row]
+    
+    @property
+    def raw(self):
+        """The unparsed source text of this block"""
+        start, end = self.span
+        return self.tree.buffer[start:end]
+    
+    @property
+    def parent(self):
+        """The enclosing block, or None for the document"""
+        parent = self.tree.parents[self.row]
+        return None if parent < 0 else CompactNode(self.tree, parent)
+    
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            key = str(key)
+        key_id = self.tree.symbols.lookup(key)
+        rows = self.tree.child_rows(self.row, key_id) if key_id is not None else []
+        if not rows:
+            raise KeyError(key)
+        if key == '' or len(rows) > 1:
+            return [self.tree.value(row) for row in rows]
+        return self.tree.value(rows[0])
+    
+    def __contains__(self, key) -> bool:
+        if not isinstance(key, str):
+            key = str(key)
+        key_id = self.tree.symbols.lookup(key)
+        return key_id is not None and bool(self.tree.child_rows(self.row, key_id))
+    
+    def __iter__(self) -> Iterator[str]:
+        names = self.tree.symbols.names
+        keys = self.tree.keys
+        seen = set()
+        for child in self.tree.children(self.row):
+            key_id = keys[child]
+            if key_id not in seen:
+                seen.add(key_id)
+                yield names[key_id]
+    
+    def __len__(self) -> int:
+        keys = self.tree.keys
+        return len({keys[child] for child in self.tree.children(self.row)})
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, CompactNode):
+            return self.tree is other.tree and self.row == other.row
+        return Mapping.__eq__(self, other)
+    
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.row))
+    
+    def __repr__(self) -> str:
+        return f"<CompactNode row {self.row}>"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert this block into plain dicts and lists"""
+        return {key: _materialize(value) for key, value in self.items()}
+
+
+def _materialize(value: Any) -> Any:
+    """Convert CompactNodes (possibly inside lists) to plain dicts"""
+    if isinstance(value, CompactNode):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_materialize(item) for item in value]
+    return value
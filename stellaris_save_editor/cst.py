@@ -0,0 +1,300 @@
+"""
+Lossless Clausewitz Tree
+Concrete syntax tree that remembers source spans and writes back only what changed
+"""
+
+import re
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from tokenizer import ATOM, OPEN, iter_entries
+
+# Largest slice of the source handed out by iter_chunks()
+CHUNK_SIZE = 1 << 20
+
+# Strings that can be written without quotes where the source had none
+_BARE_RE = re.compile(r'[^\s{}="#]+')
+
+Edit = Tuple[int, int, str]
+
+
+class CstEntry:
+    """One `key=value` (or bare value) inside a CstBlock
+    
+    start/end span the whole entry in the source and gap_start is where the
+    whitespace and comments before it begin; all three are None for an
+    entry added after parsing. kind is the token kind of the source value.
+    """
+    
+    __slots__ = ('key', 'start', 'end', 'gap_start', 'value_start', 'kind',
+                 'dirty', 'removed', '_value', '_block')
+    
+    def __init__(self, block: 'CstBlock', key: str, value: Any, kind: Optional[int] = None,
+                 start: Optional[int] = None, end: Optional[int] = None,
+                 gap_start: Optional[int] = None, value_start: Optional[int] = None):
+        self._block = block
+        self.key = key
+        self._value = value
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.gap_start = gap_start
+        self.value_start = value_start
+        self.dirty = start is None
+        self.removed = False
+    
+    @property
+    def value(self) -> Any:
+        """The value: a converted scalar, a CstBlock, or whatever was assigned"""
+        return self._value
+    
+    @value.setter
+    def value(self, value: Any):
+        self._value = value
+        self.dirty = True
+        self._block._mark()
+    
+    @property
+    def span(self) -> Optional[Tuple[int, int]]:
+        """The (start, end) of this entry in the source, or None if it is new"""
+        return None if self.start is None else (self.start, self.end)
+    
+    def __repr__(self) -> str:
+        state = 'removed' if self.removed else 'dirty' if self.dirty else 'clean'
+        return f"<CstEntry {self.key!r} {self.span} {state}>"
+
+
+class CstBlock(MutableMapping):
+    """A block (or the whole document) whose entries keep their source spans
+    
+    Reads follow the dict tree: repeated keys give lists and bare values or
+    anonymous blocks are listed under ''. Children are parsed one level at a
+    time on first access, like LazyBlock. Mutations mark the entry dirty and
+    every enclosing block modified; iter_edits() then yields replacements
+    for only the dirty entries, and everything else is copied verbatim.
+    """
+    
+    __slots__ = ('buffer', 'start', 'end', 'depth', '_parser', '_parent',
+                 '_entries', '_index', '_tail_start', '_modified')
+    
+    def __init__(self, buffer, start: int, end: int, parser,
+                 parent: Optional['CstBlock'] = None, depth: int = 0):
+        self.buffer = buffer
+        self.start = start  # offset of the opening '{' (0 for the document)
+        self.end = end  # offset just past the closing '}' (end of the document)
+        self.depth = depth  # indentation of this block's entries
+        self._parser = parser
+        self._parent = parent
+        self._entries: Optional[List[CstEntry]] = None
+        self._index: Optional[Dict[str, List[CstEntry]]] = None
+        self._tail_start = None
+        self._modified = False
+    
+    @classmethod
+    def root(cls, buffer, parser) -> 'CstBlock':
+        """Create the document node for a whole buffer"""
+        return cls(buffer, 0, len(buffer), parser)
+    
+    @property
+    def is_root(self) -> bool:
+        """Whether this node is the whole document rather than a { } block"""
+        return self._parent is None
+    
+    @property
+    def is_modified(self) -> bool:
+        """Whether this block or anything inside it was changed"""
+        return self._modified
+    
+    @property
+    def raw(self):
+        """The source text of this block, braces included"""
+        return self.buffer[self.start:self.end]
+    
+    def _load(self) -> List[CstEntry]:
+        """Parse the direct children of this block (once)"""
+        if self._entries is None:
+            entries = []
+            buffer = self.buffer
+            parser = self._parser
+            pos = self.start if self.is_root else self.start + 1
+            
+            for key_token, value_token in iter_entries(buffer, pos, self.end, stop_at_close=not self.is_root):
+                kind, value_start, value_end = value_token
+                if kind == OPEN:
+                    value = CstBlock(buffer, value_start, value_end, parser, self, self.depth + 1)
+                else:
+                    value = parser.convert(buffer, value_token)
+                if key_token is not None:
+                    key, start = parser.key_text(buffer, key_token), key_token[1]
+                else:
+                    key, start = '', value_start
+                entries.append(CstEntry(self, key, value, kind, start, value_end, pos, value_start))
+                pos = value_end
+            
+            self._tail_start = pos
+            self._entries = entries
+        return self._entries
+    
+    def _lookup(self) -> Dict[str, List[CstEntry]]:
+        """Live entries grouped by key, in document order"""
+        if self._index is None:
+            index = {}
+            for entry in self._load():
+                if not entry.removed:
+                    index.setdefault(entry.key, []).append(entry)
+            self._index = index
+        return self._index
+    
+    def _mark(self):
+        """Flag this block and its ancestors as modified"""
+        node = self
+        while node is not None and not node._modified:
+            node._modified = True
+            node = node._parent
+    
+    def entries(self, key: Optional[str] = None) -> List[CstEntry]:
+        """Get the live entries, optionally only those for one key"""
+        if key is not None:
+            return list(self._lookup().get(str(key), ()))
+        return [entry for entry in self._load() if not entry.removed]
+    
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            key = str(key)
+        entries = self._lookup()[key]
+        if key == '' or len(entries) > 1:
+            return [entry.value for entry in entries]
+        return entries[0].value
+    
+    def __setitem__(self, key, value):
+        """Change a value in place, or append a new entry for an unknown key
+        
+        A repeated key (and '') takes a list with one value per entry.
+        """
+        if not isinstance(key, str):
+            key = str(key)
+        entries = self._lookup().get(key)
+        if not entries:
+            self.append(key, value)
+        elif key == '' or len(entries) > 1:
+            if not isinstance(value, list) or len(value) != len(entries):
+                raise ValueError(f"{key!r} has {len(entries)} entries; assign a list of that length "
+                                 f"or edit entries() one at a time")
+            for entry, item in zip(entries, value):
+                entry.value = item
+        else:
+            entries[0].value = value
+    
+    def __delitem__(self, key):
+        if not isinstance(key, str):
+            key = str(key)
+        for entry in self._lookup()[key]:
+            self.remove(entry)
+    
+    def __contains__(self, key) -> bool:
+        if not isinstance(key, str):
+            key = str(key)
+        return key in self._lookup()
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._lookup())
+    
+    def __len__(self) -> int:
+        return len(self._lookup())
+    
+    def __repr__(self) -> str:
+        state = 'modified' if self._modified else 'clean'
+        return f"<CstBlock {self.start}:{self.end} {state}>"
+    
+    def append(self, key: str, value: Any) -> CstEntry:
+        """Add an entry at the end of this block, even if the key already exists"""
+        entry = CstEntry(self, key, value)
+        self._load().append(entry)
+        self._index = None
+        self._mark()
+        return entry
+    
+    def remove(self, entry: CstEntry):
+        """Remove one entry (with the whitespace before it)"""
+        entry.removed = True
+        self._index = None
+        self._mark()
+    
+    def iter_edits(self) -> Iterator[Edit]:
+        """Yield (start, end, text) replacements, in source order, that turn
+        the source into the current tree
+        
+        Nothing is yielded for an unchanged tree. Offsets are absolute
+        positions in the source buffer.
+        """
+        if not self._modified:
+            return
+        
+        for entry in self._entries:
+            if entry.start is None:
+                if not entry.removed:
+                    yield self._tail_start, self._tail_start, '\n' + self._render_entry(entry, indent=True)
+            elif entry.removed:
+                yield entry.gap_start, entry.end, ''
+            elif entry.dirty:
+                value = entry.value
+                if entry.kind != OPEN and not isinstance(value, (Mapping, list)):
+                    # Keep the source's key and '=' spacing; only the value changes
+                    yield entry.value_start, entry.end, self._format_scalar(value, entry.kind)
+                else:
+                    yield entry.start, entry.end, self._render_entry(entry)
+            elif isinstance(entry.value, CstBlock):
+                yield from entry.value.iter_edits()
+    
+    def _render_entry(self, entry: CstEntry, indent: bool = False) -> str:
+        """Render an entry in the game's own layout
+        
+        A replaced entry keeps the indentation already in the source, so its
+        first line is only indented when indent is set (for new entries).
+        """
+        data = {entry.key: entry.value} if entry.key else {'': [entry.value]}
+        text = self._parser.serialize(data, self.depth)
+        return text if indent else text[self.depth:]
+    
+    def _format_scalar(self, value: Any, kind: Optional[int]) -> str:
+        """Format a replacement scalar, leaving words unquoted if the source was"""
+        if isinstance(value, str) and kind == ATOM and _BARE_RE.fullmatch(value):
+            return value
+        return self._parser._format_value(value)
+    
+    def iter_chunks(self) -> Iterator:
+        """Yield the current text of this block as source slices and rendered edits
+        
+        Chunks have the buffer's type; edits to a bytes or mmap buffer are
+        encoded as UTF-8.
+        """
+        buffer = self.buffer
+        encode = not isinstance(buffer, str)
+        pos = self.start
+        
+        for start, end, text in self.iter_edits():
+            yield from self._slices(pos, start)
+            if text:
+                yield text.encode('utf-8') if encode else text
+            pos = end
+        yield from self._slices(pos, self.end)
+    
+    def _slices(self, start: int, end: int) -> Iterator:
+        """Copy buffer[start:end] out in bounded chunks"""
+        while start < end:
+            step = min(end, start + CHUNK_SIZE)
+            yield self.buffer[start:step]
+            start = step
+    
+    def dumps(self):
+        """Get the current text of this block (str for str buffers, else bytes)"""
+        empty = '' if isinstance(self.buffer, str) else b''
+        return empty.join(self.iter_chunks())
+    
+    def write_to(self, fp) -> int:
+        """Write the current text of this block into a file object, returning its length"""
+        written = 0
+        for chunk in self.iter_chunks():
+            fp.write(chunk)
+            written += len(chunk)
+        return written
@@ -0,0 +1,255 @@
+"""
+Instrumentation
+Named timing spans and status messages, delivered to pluggable sinks
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Optional
+
+# Phase names used by the parser and save handler
+ZIP_READ = 'zip_read'
+INFLATE = 'inflate'
+DECODE = 'decode'
+INDEX = 'index'
+PARSE = 'parse'
+SERIALIZE = 'serialize'
+DEFLATE = 'deflate'
+WRITE = 'write'
+
+# Name of events that carry only a message
+MESSAGE = 'message'
+
+# Set to 1 to trace memory in every span from startup (see set_memory_tracing)
+TRACE_MEMORY_ENV = 'STELLARIS_TRACE_MEMORY'
+
+
+class Event:
+    """A finished span (seconds set) or a message, as handed to sinks
+    
+    bytes is the amount of data the phase processed (0 if unknown) and
+    peak the highest traced allocation in bytes, for spans that asked to
+    trace memory.
+    """
+    
+    __slots__ = ('name', 'message', 'seconds', 'bytes', 'peak', 'time', 'thread')
+    
+    def __init__(self, name: str, message: Optional[str] = None, seconds: Optional[float] = None,
+                 nbytes: int = 0, peak: Optional[int] = None):
+        self.name = name
+        self.message = message
+        self.seconds = seconds
+        self.bytes = nbytes
+        self.peak = peak
+        self.time = time.time()
+        self.thread = threading.current_thread().name
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+    
+    def __str__(self) -> str:
+        if self.seconds is None:
+            return self.message or self.name
+        text = f"{self.name}: {self.seconds * 1000:.1f} ms"
+        if self.bytes:
+            text += f", {self.bytes / 1024 / 1024:.1f} MB"
+            if self.seconds > 0:
+                text += f" ({self.bytes / 1024 / 1024 / self.seconds:.1f} MB/s)"
+        if self.peak is not None:
+            text += f", peak {self.peak / 1024 / 1024:.1f} MB"
+        if self.message:
+            text += f" - {self.message}"
+        return text
+
+
+Sink = Callable[[Event], None]
+
+# Replaced, never mutated, so emitters can iterate without a lock
+_sinks = ()
+_sinks_lock = threading.Lock()
+
+
+def add_sink(sink: Sink) -> Sink:
+    """Start delivering events to sink (any callable taking an Event)"""
+    global _sinks
+    with _sinks_lock:
+        _sinks = _sinks + (sink,)
+    return sink
+
+
+def remove_sink(sink: Sink):
+    """Stop delivering events to sink"""
+    global _sinks
+    with _sinks_lock:
+        _sinks = tuple(s for s in _sinks if s is not sink)
+
+
+def enabled() -> bool:
+    """Whether any sink is listening"""
+    return bool(_sinks)
+
+
+_trace_memory = False
+_started_trace = False
+
+
+def set_memory_tracing(enabled: bool):
+    """Record the peak traced allocation of every span, not only those asking for it
+    
+    Tracing starts here and runs until switched off, so spans in several
+    threads share one trace instead of starting and stopping their own.
+    It slows allocation-heavy code down considerably.
+    """
+    global _trace_memory, _started_trace
+    _trace_memory = enabled
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_trace = True
+    elif not enabled and _started_trace:
+        tracemalloc.stop()
+        _started_trace = False
+
+
+def memory_tracing() -> bool:
+    """Whether every span records its memory peak"""
+    return _trace_memory
+
+
+def _emit(event: Event):
+    for sink in _sinks:
+        sink(event)
+
+
+def message(text: str, name: str = MESSAGE):
+    """Send a status message to the sinks"""
+    if _sinks:
+        _emit(Event(name, text))
+
+
+_local = threading.local()
+
+
+def _memory_spans() -> list:
+    """Open memory-tracing spans of this thread, innermost last"""
+    stack = getattr(_local, 'spans', None)
+    if stack is None:
+        stack = _local.spans = []
+    return stack
+
+
+class Span:
+    """Times a phase as a context manager and reports it on exit
+    
+    Set bytes (or message) inside the block once the amount is known.
+    With memory, tracemalloc runs for the span unless it is already
+    tracing. The peak counts from the span's start: the trace's peak is
+    reset on entry, and nested spans hand their peaks up to the span
+    enclosing them in the same thread.
+    """
+    
+    __slots__ = ('name', 'bytes', 'message', 'memory', '_start', '_owns_trace', '_traced', '_seen')
+    
+    def __init__(self, name: str, nbytes: int = 0, memory: bool = False):
+        self.name = name
+        self.bytes = nbytes
+        self.message = None
+        self.memory = memory
+    
+    def __enter__(self) -> 'Span':
+        if self.memory:
+            self._owns_trace = not tracemalloc.is_tracing()
+            if self._owns_trace:
+                tracemalloc.start()
+            stack = _memory_spans()
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]._seen = max(stack[-1]._seen, peak)
+            tracemalloc.reset_peak()
+            self._traced = self._seen = current
+            stack.append(self)
+        self._start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._start
+        peak = None
+        if self.memory:
+            self._seen = max(self._seen, tracemalloc.get_traced_memory()[1])
+            stack = _memory_spans()
+            stack.pop()
+            if stack:
+                stack[-1]._seen = max(stack[-1]._seen, self._seen)
+            peak = self._seen - self._traced
+            if self._owns_trace:
+                tracemalloc.stop()
+        if exc_type is not None:
+            self.message = f"failed: {exc_type.__name__}"
+        _emit(Event(self.name, self.message, seconds, self.bytes, peak))
+
+
+class _NullSpan:
+    """Stand-in returned while nothing listens; accepts and drops every update"""
+    
+    __slots__ = ()
+    
+    def __enter__(self) -> '_NullSpan':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+    
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, nbytes: int = 0, memory: bool = False):
+    """Time a phase: `with span(PARSE, len(content)) as s: ...`
+    
+    While no sink is attached this returns a shared do-nothing object, so
+    instrumented code costs one call and a tuple check. memory is implied
+    while set_memory_tracing() is on.
+    """
+    if not _sinks:
+        return _NULL_SPAN
+    return Span(name, nbytes, memory or _trace_memory)
+
+
+class LoggingSink:
+    """Write events to a logger"""
+    
+    def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.INFO):
+        self.logger = logger or logging.getLogger('stellaris_save_editor')
+        self.level = level
+    
+    def __call__(self, event: Event):
+        self.logger.log(self.level, "%s", event)
+
+
+class JsonLinesSink:
+    """Append events to a file, one JSON object per line"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fp = open(path, 'a', encoding='utf-8')
+    
+    def __call__(self, event: Event):
+        line = json.dumps(event.to_dict())
+        with self._lock:
+            self._fp.write(line + '\n')
+            self._fp.flush()
+    
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+
+if os.environ.get(TRACE_MEMORY_ENV, '') not in ('', '0'):
+    set_memory_tracing(True)
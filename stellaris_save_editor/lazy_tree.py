@@ -0,0 +1,165 @@
+"""
+Lazy Clausewitz Tree
+Blocks that keep offsets into the shared save buffer and parse on first access
+"""
+
+from array import array
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List
+
+from tokenizer import OPEN, STRING, iter_entries
+
+
+class LazyBlock(Mapping):
+    """A { ... } block that is parsed one level at a time, on demand
+    
+    Only the (start, end) offsets of the block are stored until a key is
+    read. The first read scans this block's direct children (nested blocks
+    are brace-matched and become LazyBlocks themselves) and memoizes them.
+    
+    With lazy_scalars, scalar children are kept as their (kind, start, end)
+    token and only converted (and cached) when read.
+    """
+    
+    __slots__ = ('buffer', 'start', 'end', '_parser', '_items', 'lazy_scalars')
+    
+    def __init__(self, buffer, start: int, end: int, parser, lazy_scalars: bool = False):
+        self.buffer = buffer
+        self.start = start  # offset of the opening '{'
+        self.end = end  # offset just past the closing '}'
+        self._parser = parser
+        self._items = None
+        self.lazy_scalars = lazy_scalars
+    
+    @classmethod
+    def parsed(cls, buffer, start: int, end: int, parser, items: Dict[str, Any]) -> 'LazyBlock':
+        """Wrap children that a full parse already collected, with scalars left as tokens"""
+        block = cls(buffer, start, end, parser, lazy_scalars=True)
+        block._items = items
+        return block
+    
+    @property
+    def is_parsed(self) -> bool:
+        """Whether this block's direct children have been parsed yet"""
+        return self._items is not None
+    
+    @property
+    def raw(self):
+        """The unparsed source text of this block, braces included"""
+        return self.buffer[self.start:self.end]
+    
+    def _load(self) -> Dict[str, Any]:
+        """Parse the direct children of this block (once)"""
+        if self._items is None:
+            items = {}
+            buffer = self.buffer
+            parser = self._parser
+            
+            for key_token, value_token in iter_entries(buffer, self.start + 1, self.end):
+                if value_token[0] == OPEN:
+                    value = LazyBlock(buffer, value_token[1], value_token[2], parser, self.lazy_scalars)
+                elif self.lazy_scalars:
+                    value = value_token
+                else:
+                    value = parser.convert(buffer, value_token)
+                key = parser.key_text(buffer, key_token) if key_token is not None else ''
+                parser.add_value(items, key, value)
+            
+            self._items = items
+        return self._items
+    
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            key = str(key)
+        items = self._load()
+        value = items[key]
+        
+        # Unconverted scalars are tokens; convert them once and keep the result
+        if type(value) is tuple:
+            value = items[key] = self._parser.convert(self.buffer, value)
+        elif type(value) is list and self.lazy_scalars:
+            for i, item in enumerate(value):
+                if type(item) is tuple:
+                    value[i] = self._parser.convert(self.buffer, item)
+        return value
+    
+    def __contains__(self, key) -> bool:
+        if not isinstance(key, str):
+            key = str(key)
+        return key in self._load()
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._load())
+    
+    def __len__(self) -> int:
+        return len(self._load())
+    
+    def __repr__(self) -> str:
+        state = 'parsed' if self.is_parsed else 'unparsed'
+        return f"<LazyBlock {self.start}:{self.end} {state}>"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Fully parse this block into plain dicts and lists"""
+        return {key: _materialize(value) for key, value in self.items()}
+    
+    def numbers(self, key: str, recursive: bool = False) -> array:
+        """Get every numeric value of key as an array('d'), converted in one step
+        
+        With recursive, matching values in all nested blocks are gathered
+        too (for example every `accumulated` field of a section). Unconverted
+        spans are turned into floats together, without caching each scalar;
+        strings and non-numeric words are skipped.
+        """
+        values: List[Any] = []
+        blocks = [self]
+        while blocks:
+            block = blocks.pop()
+            buffer = block.buffer
+            items = block._load()
+            
+            found = items.get(key)
+            for value in found if type(found) is list else (found,):
+                if type(value) is tuple:
+                    raw = buffer[value[1]:value[2]]
+                    if value[0] != STRING and (raw[:1].isdigit() or raw[:1] in ('-', b'-')):
+                        values.append(raw)
+                elif type(value) in (int, float):
+                    values.append(value)
+            
+            if recursive:
+                children = []
+                for value in items.values():
+                    for item in value if type(value) is list else (value,):
+                        if isinstance(item, LazyBlock):
+                            children.append(item)
+                blocks.extend(reversed(children))
+        
+        return _to_array(values)
+
+
+def _to_array(values: List[Any]) -> array:
+    """Convert numbers and raw numeric text to an array('d')
+    
+    float() accepts str, bytes and numbers alike, so the common case is a
+    single pass in C; only a list holding malformed text falls back to
+    converting item by item.
+    """
+    try:
+        return array('d', map(float, values))
+    except ValueError:
+        result = array('d')
+        for value in values:
+            try:
+                result.append(float(value))
+            except ValueError:
+                pass
+        return result
+
+
+def _materialize(value: Any) -> Any:
+    """Convert LazyBlocks (possibly inside lists) to plain dicts"""
+    if isinstance(value, LazyBlock):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_materialize(item) for item in value]
+    return value
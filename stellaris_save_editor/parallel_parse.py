@@ -0,0 +1,169 @@
+"""
+Parallel Clausewitz Parser
+Full parse of a gamestate with its top-level sections spread over worker processes
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple
+
+from instrumentation import PARSE, span
+from parser import ClausewitzParser, gc_paused
+from symbols import SymbolTable
+from tokenizer import OPEN, ParseError, iter_entries
+
+# Below this size a single process parses faster than the pool starts
+PARALLEL_MIN_SIZE = 4 * 1024 * 1024
+
+# Smallest piece handed to a worker; pieces aim for a few per worker
+MIN_PIECE_SIZE = 256 * 1024
+PIECES_PER_WORKER = 4
+
+# A unit of the plan: (key, spans). key is None for a run of whole top-level
+# entries, else the key of one large section whose children are split into spans
+Unit = Tuple[Optional[str], List[Tuple[int, int]]]
+
+
+def parse_parallel(content, workers: Optional[int] = None,
+                   parser: Optional[ClausewitzParser] = None) -> Dict[str, Any]:
+    """Fully parse content with several processes, giving the same tree as
+    parse(content, parse_all=True)
+    
+    The buffer is copied once into shared memory and workers receive only
+    (start, end) spans of it. Runs of small top-level entries are parsed
+    as one piece, and large sections (ships, planets, ...) are split at
+    their children's boundaries so every worker gets a similar share; the
+    parent merges the pieces back in document order.
+    
+    Args:
+        content: The text to parse (str, or UTF-8 bytes/mmap)
+        workers: Number of processes (default: one per CPU)
+        parser: Parser whose max_depth to use (default: a new one). Its data
+            and symbols are reset; keys are interned by each worker's own
+            parser, and those tables stay in the workers.
+    """
+    parser = parser or ClausewitzParser()
+    workers = workers or os.cpu_count() or 1
+    if workers < 2 or len(content) < PARALLEL_MIN_SIZE:
+        return parser.parse(content, parse_all=True)
+    
+    buffer = content.encode('utf-8') if isinstance(content, str) else content
+    piece_size = max(MIN_PIECE_SIZE, len(buffer) // (workers * PIECES_PER_WORKER))
+    parser.data = {}
+    parser.symbols = SymbolTable()
+    units = plan_units(buffer, piece_size, parser)
+    
+    shared = SharedMemory(create=True, size=len(buffer))
+    try:
+        with span(PARSE, len(buffer)) as parse_span:
+            parse_span.message = f"{workers} workers, {sum(len(spans) for _, spans in units)} pieces"
+            shared.buf[:len(buffer)] = buffer
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = [
+                    (key, [pool.submit(_parse_span, shared.name, start, end,
+                                       parser.max_depth, 0 if key is None else 1)
+                           for start, end in spans])
+                    for key, spans in units
+                ]
+                
+                result = parser.data
+                for key, futures in pending:
+                    if key is None:
+                        for future in futures:
+                            merge(result, future.result())
+                    else:
+                        section = {}
+                        for future in futures:
+                            merge(section, future.result())
+                        parser.add_value(result, key, section)
+    finally:
+        shared.close()
+        shared.unlink()
+    return result
+
+
+def plan_units(buffer, piece_size: int, parser: ClausewitzParser) -> List[Unit]:
+    """Split the top level of buffer into pieces of about piece_size bytes
+    
+    Consecutive small entries are grouped into one span. A section larger
+    than piece_size gets a unit of its own, with its children grouped into
+    spans the same way.
+    """
+    units: List[Unit] = []
+    run_start = run_end = 0
+    
+    # A stray '}' at the top level ends the document, as in the full parse
+    for key_token, value_token in iter_entries(buffer, stop_at_close=True):
+        kind, start, end = value_token
+        if kind == OPEN and end - start > piece_size:
+            if run_end > run_start:
+                units.append((None, [(run_start, run_end)]))
+            key = parser.key_text(buffer, key_token) if key_token is not None else ''
+            units.append((key, _child_spans(buffer, start, end, piece_size)))
+            run_start = end
+        elif end - run_start > piece_size:
+            units.append((None, [(run_start, end)]))
+            run_start = end
+        run_end = end
+    
+    if run_end > run_start:
+        units.append((None, [(run_start, run_end)]))
+    return units
+
+
+def _child_spans(buffer, start: int, end: int, piece_size: int) -> List[Tuple[int, int]]:
+    """Group the children of the block at buffer[start:end] into spans"""
+    spans = []
+    span_start = span_end = start + 1
+    for _, (_, _, child_end) in iter_entries(buffer, start + 1, end):
+        span_end = child_end
+        if span_end - span_start >= piece_size:
+            spans.append((span_start, span_end))
+            span_start = span_end
+    if span_end > span_start or not spans:
+        spans.append((span_start, span_end))
+    return spans
+
+
+def merge(target: Dict[str, Any], items: Dict[str, Any]):
+    """Append the entries of one piece to a block, as if parsed in one go
+    
+    Lists in the tree only ever hold repeated keys (or '' values), so a key
+    present in both becomes, or extends, a list.
+    """
+    for key, value in items.items():
+        if key not in target:
+            target[key] = value
+            continue
+        existing = target[key]
+        if not isinstance(existing, list):
+            existing = target[key] = [existing]
+        if isinstance(value, list):
+            existing.extend(value)
+        else:
+            existing.append(value)
+
+
+def _parse_span(name: str, start: int, end: int, max_depth: int, depth: int) -> Dict[str, Any]:
+    """Worker: parse buffer[start:end] of a shared segment as a block's entries
+    
+    depth is the nesting level of the span, so max_depth still counts from
+    the top of the document and errors report offsets into the whole buffer.
+    """
+    shared = SharedMemory(name=name)
+    try:
+        view = shared.buf[start:end]
+        data = bytes(view)
+        view.release()
+    finally:
+        # Detach right away: the parent unlinks the segment once the parse is done
+        shared.close()
+    
+    parser = ClausewitzParser()
+    parser.max_depth = max_depth
+    try:
+        with gc_paused():
+            return parser.parse_tree(data, depth=depth)
+    except ParseError as error:
+        raise ParseError(error.message, error.offset + start) from None
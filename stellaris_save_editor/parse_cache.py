@@ -0,0 +1,139 @@
+"""
+Parse Cache
+On-disk cache of section indexes and parse trees, keyed by the gamestate zip entry
+"""
+
+import marshal
+import os
+import tempfile
+import zipfile
+from typing import Any, Dict, List, Optional, Tuple
+
+from instrumentation import message
+from parser import ClausewitzParser, gc_paused
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                                 'stellaris_save_editor')
+
+# Total size of cached files before the least recently used are removed
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Stored with every value; bump when the layout of a cached kind changes
+CACHE_VERSION = 1
+
+# Kinds of cached values (also the file extension)
+INDEX_KIND = 'index'
+TREE_KIND = 'tree'
+HASH_KIND = 'hashes'
+
+
+def entry_key(info: zipfile.ZipInfo) -> str:
+    """Cache key of a zip entry: its CRC32, uncompressed size and timestamp"""
+    timestamp = '%04d%02d%02d%02d%02d%02d' % info.date_time
+    return f"{info.CRC:08x}-{info.file_size}-{timestamp}"
+
+
+class ParseCache:
+    """A directory of marshal files, one per (entry key, kind)
+    
+    Reading a value touches its file, so modification times give the
+    least-recently-used order; every write then evicts the oldest files
+    until the directory fits in max_bytes. Unreadable or outdated files
+    count as misses. Writes go through a temporary file and a rename, so
+    several processes can share one directory.
+    """
+    
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+    
+    def _path(self, key: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{key}.{kind}")
+    
+    def get(self, key: str, kind: str) -> Optional[Any]:
+        """Get a cached value, or None on a miss"""
+        path = self._path(key, kind)
+        try:
+            with open(path, 'rb') as fp, gc_paused():
+                version, value = marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if version != CACHE_VERSION:
+            return None
+        
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return value
+    
+    def put(self, key: str, kind: str, value: Any):
+        """Store a value (plain dicts, lists, tuples, strings and numbers)
+        
+        A cache that cannot be written is skipped silently; it only costs the
+        next load its speed-up.
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    marshal.dump((CACHE_VERSION, value), fp)
+                os.replace(tmp_path, self._path(key, kind))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except OSError as e:
+            message(f"Could not write parse cache: {e}")
+            return
+        self.evict()
+    
+    def parse(self, key: str, content, parser: Optional[ClausewitzParser] = None) -> Dict[str, Any]:
+        """Fully parse content, or load the tree cached for key"""
+        tree = self.get(key, TREE_KIND)
+        if tree is None:
+            tree = (parser or ClausewitzParser()).parse(content, parse_all=True)
+            self.put(key, TREE_KIND, tree)
+        return tree
+    
+    def size(self) -> int:
+        """Total bytes of the cached files"""
+        return sum(size for _, _, size in self._files())
+    
+    def evict(self):
+        """Remove least recently used files until the cache fits in max_bytes"""
+        files = sorted(self._files())
+        total = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+    
+    def clear(self):
+        """Remove every cached file"""
+        for _, path, _ in self._files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def _files(self) -> List[Tuple[int, str, int]]:
+        """(mtime, path, size) of each cached file"""
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return []
+        files = []
+        for entry in entries:
+            if entry.name.endswith('.tmp') or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        return files
@@ -3,230 +3,357 @@ Stellaris Save File Parser
 Handles parsing and writing of Clausewitz engine format files
 """
 
+import gc
 import re
+from contextlib import contextmanager
 from typing import Any, Dict, List, Union
 
+from compact_tree import CompactNode, CompactTree
+from cst import CstBlock
+from instrumentation import PARSE, SERIALIZE, message, span
+from lazy_tree import LazyBlock
+from symbols import MAX_SYMBOL_LENGTH, SymbolTable
+from tokenizer import OPEN, STRING, Token, TreeBuilder, build_tree, iter_entries, token_text
+
+# Lines collected before serialize_to() encodes and writes a chunk
+SERIALIZE_CHUNK_LINES = 4096
+
+# Values serialized as nested { } blocks. Matched by exact type first:
+# the lazy blocks are Mappings, and ABC isinstance checks are slow on every scalar.
+_BLOCK_TYPES = frozenset((dict, LazyBlock, CstBlock, CompactNode))
+
+# Keys written without quotes; anything else (such as "k k") is quoted
+_BARE_KEY = re.compile(r'[^\s{}="#]+')
+
+
+class _KeyText(dict):
+    """Key -> its text in the output, computed once per key and serialization"""
+    
+    def __missing__(self, key) -> str:
+        text = str(key)
+        if not _BARE_KEY.fullmatch(text):
+            text = f'"{text}"'
+        self[key] = text
+        return text
+
+
+@contextmanager
+def gc_paused():
+    """Suspend cyclic garbage collection while a parse builds its tree
+    
+    Wrap any bulk tree build in it (full parses, cache and library loads,
+    parallel sections). Every container and token tuple the parse creates
+    is tracked, so the collector would otherwise run again and again over a
+    tree that only grows.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _DictBuilder(TreeBuilder):
+    """Builds the tree parse() returns from build_tree() callbacks"""
+    
+    def __init__(self, parser: 'ClausewitzParser', content, lazy_scalars: bool):
+        self.key = parser.symbols.text
+        self.items = {}
+        self._stack = []  # (enclosing items, key of the open block, offset of its '{')
+        self._parser = parser
+        self._content = content
+        self._add_value = parser.add_value
+        self._convert = None if lazy_scalars else parser.convert
+        if lazy_scalars:
+            self.scalar = self._store  # tokens are kept as they are
+    
+    def scalar(self, key, token):
+        value = self._convert(self._content, token)
+        if key is None:
+            self.items.setdefault('', []).append(value)
+        else:
+            self._add_value(self.items, key, value)
+    
+    def _store(self, key, value):
+        """Add a value to the innermost block, under '' if it has no key"""
+        if key is None:
+            self.items.setdefault('', []).append(value)
+        else:
+            self._add_value(self.items, key, value)
+    
+    def open(self, key, start: int):
+        self._stack.append((self.items, key, start))
+        self.items = {}
+    
+    def close(self, end: int):
+        value = self.items
+        self.items, key, start = self._stack.pop()
+        if self._convert is None:
+            value = LazyBlock.parsed(self._content, start, end, self._parser, value)
+        # Anonymous blocks are collected as list items under ''
+        self._store(key, value)
+
 
 class ClausewitzParser:
     """Parser for Clausewitz engine format (used by Stellaris save files)"""
     
     def __init__(self):
         self.data = {}
-        self.max_depth = 50  # Prevent stack overflow on deeply nested structures
+        self.max_depth = 50  # Deepest block nesting a full parse accepts
+        self.symbols = SymbolTable()  # Keys and identifier values of the latest parse
     
-    def parse(self, content: str, parse_all: bool = False) -> Dict[str, Any]:
+    def parse(self, content: str, parse_all: bool = False, lazy_scalars: bool = False) -> Dict[str, Any]:
         """Parse Clausewitz format content into a dictionary
         
         Args:
-            content: The text content to parse
+            content: The text content to parse (str, or UTF-8 bytes/mmap)
             parse_all: If False, only parse top-level structure for large files
+            lazy_scalars: Keep values as source spans, converted (and cached)
+                only when read; blocks are then LazyBlocks instead of dicts,
+                and so is the result of a full parse
         """
         self.data = {}
+        self.symbols = SymbolTable()
         
-        # For very large files, only parse the top level to avoid hanging
-        if not parse_all and len(content) > 10000000:  # > 10MB
-            print("Large file detected, using fast parse mode...")
-            return self._fast_parse(content)
-        
-        self._parse_block(content, self.data)
+        with span(PARSE, len(content)) as parse_span:
+            # For very large files, only parse the top level to avoid hanging
+            if not parse_all and len(content) > 10000000:  # > 10MB
+                message("Large file detected, using fast parse mode...")
+                parse_span.message = "top level only"
+                return self._fast_parse(content, lazy_scalars)
+            
+            with gc_paused():
+                self.data = self.parse_tree(content, lazy_scalars)
         return self.data
     
-    def _fast_parse(self, content: str) -> Dict[str, Any]:
-        """Fast parse that only gets top-level keys and keeps raw content"""
+    def parse_cst(self, content) -> CstBlock:
+        """Parse content into a lossless concrete syntax tree
+        
+        The tree keeps every node's source span. After edits, its
+        dumps()/write_to() copy all unchanged text verbatim and re-render
+        only the changed entries, so an unedited tree writes back
+        byte-identical. Blocks are parsed lazily on first access.
+        """
+        self.symbols = SymbolTable()
+        return CstBlock.root(content, self)
+    
+    def parse_compact(self, content) -> CompactNode:
+        """Fully parse content into a columnar tree and return its root
+        
+        Same read API as parse(content, parse_all=True), but nodes are rows
+        in a few typed arrays instead of dicts and lists, which takes a
+        fraction of the memory for a whole gamestate.
+        """
+        self.symbols = SymbolTable()
+        with span(PARSE, len(content)) as parse_span:
+            parse_span.message = "compact"
+            return CompactTree.build(content, self).root
+    
+    def _fast_parse(self, content: str, lazy_scalars: bool = False) -> Dict[str, Any]:
+        """Fast parse that only gets top-level keys
+        
+        Top-level blocks become LazyBlocks holding offsets into content;
+        each one is parsed the first time it is read.
+        """
         result = {}
-        i = 0
         
-        while i < len(content):
-            # Skip whitespace
-            while i < len(content) and content[i].isspace():
-                i += 1
-            
-            if i >= len(content):
-                break
+        for key_token, (kind, start, end) in iter_entries(content, stop_at_close=False):
+            if key_token is None:
+                continue
+            key = self.key_text(content, key_token)
             
-            # Look for key=value or key={ patterns
-            match = re.match(r'([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*', content[i:])
-            if match:
-                key = match.group(1)
-                i += match.end()
-                
-                # Skip whitespace after =
-                while i < len(content) and content[i].isspace():
-                    i += 1
-                
-                if i < len(content) and content[i] == '{':
-                    # Find matching closing brace
-                    start = i
-                    depth = 0
-                    while i < len(content):
-                        if content[i] == '{':
-                            depth += 1
-                        elif content[i] == '}':
-                            depth -= 1
-                            if depth == 0:
-                                i += 1
-                                break
-                        i += 1
-                    
-                    # Store raw content for this block
-                    raw_content = content[start:i]
-                    result[key] = {'_raw': raw_content, '_parsed': False}
-                else:
-                    # Simple value
-                    value_match = re.match(r'("[^"]*"|[^\s\n]+)', content[i:])
-                    if value_match:
-                        result[key] = value_match.group(1).strip('"')
-                        i += value_match.end()
+            if kind == OPEN:
+                value = LazyBlock(content, start, end, self, lazy_scalars)
             else:
-                i += 1
+                value = self.convert(content, (kind, start, end))
+            self.add_value(result, key, value)
         
         return result
     
-    def _parse_block(self, content: str, parent: Dict[str, Any], start: int = 0) -> int:
-        """Recursively parse a block of Clausewitz format"""
-        i = start
-        key = None
+    def parse_tree(self, content, lazy_scalars: bool = False, depth: int = 0):
+        """Fully parse content in one flat loop over the token matches
         
-        while i < len(content):
-            char = content[i]
-            
-            # Skip whitespace and newlines
-            if char.isspace():
-                i += 1
-                continue
-            
-            # Handle comments
-            if char == '#':
-                while i < len(content) and content[i] != '\n':
-                    i += 1
-                continue
-            
-            # Handle block end
-            if char == '}':
-                return i + 1
-            
-            # Handle block start
-            if char == '{':
-                if key is not None:
-                    # Parse nested block
-                    sub_dict = {}
-                    i = self._parse_block(content, sub_dict, i + 1)
-                    
-                    # Handle multiple values for the same key
-                    if key in parent:
-                        if not isinstance(parent[key], list):
-                            parent[key] = [parent[key]]
-                        parent[key].append(sub_dict)
-                    else:
-                        parent[key] = sub_dict
-                    key = None
-                else:
-                    # Anonymous block (list item)
-                    sub_dict = {}
-                    i = self._parse_block(content, sub_dict, i + 1)
-                    
-                    # Add to parent as list item
-                    if isinstance(parent, dict) and '' not in parent:
-                        parent[''] = []
-                    if isinstance(parent, dict):
-                        parent[''].append(sub_dict)
-                continue
-            
-            # Parse key=value or key
-            match = re.match(r'([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*', content[i:])
-            if match:
-                key = match.group(1)
-                i += match.end()
-                continue
-            
-            # Parse quoted string value
-            if char == '"':
-                end_quote = i + 1
-                while end_quote < len(content) and content[end_quote] != '"':
-                    if content[end_quote] == '\\':
-                        end_quote += 2
-                    else:
-                        end_quote += 1
-                value = content[i + 1:end_quote]
-                i = end_quote + 1
-                
-                if key:
-                    if key in parent:
-                        if not isinstance(parent[key], list):
-                            parent[key] = [parent[key]]
-                        parent[key].append(value)
-                    else:
-                        parent[key] = value
-                    key = None
-                continue
-            
-            # Parse unquoted value (number or identifier)
-            match = re.match(r'(-?[0-9]+\.?[0-9]*|yes|no|[a-zA-Z_][a-zA-Z0-9_]*)', content[i:])
-            if match:
-                value_str = match.group(1)
-                i += match.end()
-                
-                # Try to convert to appropriate type
-                if value_str == 'yes':
-                    value = True
-                elif value_str == 'no':
-                    value = False
-                elif '.' in value_str:
-                    try:
-                        value = float(value_str)
-                    except ValueError:
-                        value = value_str
-                else:
-                    try:
-                        value = int(value_str)
-                    except ValueError:
-                        value = value_str
-                
-                if key:
-                    if key in parent:
-                        if not isinstance(parent[key], list):
-                            parent[key] = [parent[key]]
-                        parent[key].append(value)
-                    else:
-                        parent[key] = value
-                    key = None
-                continue
-            
-            # Skip unknown characters
-            i += 1
+        tokenizer.build_tree() keeps open blocks on an explicit stack, so
+        depth beyond max_depth raises ParseError instead of RecursionError.
+        Blocks become dicts, or with lazy_scalars LazyBlocks that already
+        hold their children, each scalar left as its (kind, start, end)
+        token until read. depth is the nesting level content sits at, for a
+        piece cut out of a larger document.
+        """
+        builder = _DictBuilder(self, content, lazy_scalars)
+        end = build_tree(content, builder, self.max_depth, depth)
+        if lazy_scalars:
+            return LazyBlock.parsed(content, 0, end, self, builder.items)
+        return builder.items
+    
+    def add_value(self, parent: Dict[str, Any], key: str, value: Any):
+        """Store a value under key in a parsed block, turning repeated keys into lists
         
-        return i
+        The '' key collects anonymous list items. Every tree that builds
+        dict children (lazy blocks, parallel sections, queries) goes
+        through this so they all agree on the layout parse() produces.
+        """
+        if key == '':
+            parent.setdefault('', []).append(value)
+        elif key in parent:
+            if not isinstance(parent[key], list):
+                parent[key] = [parent[key]]
+            parent[key].append(value)
+        else:
+            parent[key] = value
+    
+    def key_text(self, content: str, token: Token) -> str:
+        """Get the interned text of a key token without its quotes
+        
+        Keys are interned in this parser's symbol table, so equal keys
+        across a document share one str.
+        """
+        return self.symbols.text(content, token)
+    
+    def convert(self, content: str, token: Token) -> Any:
+        """Convert a (kind, start, end) value token to the appropriate Python type
+        
+        Numbers become int or float and yes/no become bools. Identifier-like values (enum words, quoted ids) are interned in the
+        symbol table; numbers and free text are not.
+        """
+        kind, start, end = token
+        if kind == STRING:
+            text = token_text(content, token)
+            if len(text) <= MAX_SYMBOL_LENGTH and text.isidentifier():
+                return self.symbols.intern(text)
+            return text
+        
+        head = content[start:start + 1]
+        if head.isdigit() or head in ('-', b'-'):
+            text = token_text(content, token)
+            try:
+                return int(text)
+            except ValueError:
+                pass
+            try:
+                return float(text)
+            except ValueError:
+                pass
+            return text
+        
+        text = self.symbols.text(content, token)
+        if text == 'yes':
+            return True
+        if text == 'no':
+            return False
+        return text
     
     def serialize(self, data: Dict[str, Any], indent: int = 0) -> str:
         """Serialize a dictionary back to Clausewitz format"""
+        chunks = []
         lines = []
+        
+        def flush():
+            chunks.append('\n'.join(lines))
+            lines.clear()
+        
+        # Joining bounded chunks keeps the line list short, which is faster
+        # and far smaller than one str per line of the whole document
+        with span(SERIALIZE) as serialize_span:
+            self._emit_lines(data, indent, lines, _KeyText(), flush)
+            if lines or not chunks:
+                flush()
+            text = '\n'.join(chunks)
+            serialize_span.bytes = len(text)
+        return text
+    
+    def serialize_to(self, fp, data: Dict[str, Any], indent: int = 0, encoding: str = 'utf-8') -> int:
+        """Serialize a dictionary straight into a binary stream
+        
+        Lines are encoded and written about SERIALIZE_CHUNK_LINES at a time,
+        so memory stays bounded by the chunk rather than the document. fp
+        can be any binary file object, including an entry from
+        zipfile.ZipFile.open(name, 'w') (pass force_zip64=True there if the
+        output may exceed 2 GB). Writes the same text as serialize() and
+        returns the number of bytes written.
+        """
+        lines = []
+        written = 0
+        separator = ''
+        
+        def flush():
+            nonlocal written, separator
+            chunk = (separator + '\n'.join(lines)).encode(encoding)
+            fp.write(chunk)
+            written += len(chunk)
+            lines.clear()
+            separator = '\n'
+        
+        with span(SERIALIZE) as serialize_span:
+            self._emit_lines(data, indent, lines, _KeyText(), flush)
+            if lines:
+                flush()
+            serialize_span.bytes = written
+        return written
+    
+    def _emit_lines(self, data: Dict[str, Any], indent: int, lines: List[str], keys: _KeyText,
+                    flush) -> bool:
+        """Append the lines of a block to one shared list, returning whether there were any
+        
+        Every level appends to the same list instead of joining its own
+        string, so deep content is never copied per level. flush() is called
+        to empty the list once a nested block leaves it holding
+        SERIALIZE_CHUNK_LINES lines or more; scalars are not checked, since
+        a single block's scalars are few. Blocks can be dicts or any of
+        the lazy, CST and compact tree nodes. Scalars are formatted inline,
+        as _format_value() would.
+        """
         indent_str = '\t' * indent
+        inner = indent + 1
+        append = lines.append
+        emitted = False
         
         for key, value in data.items():
-            if key == '':  # Anonymous list items
-                for item in value:
-                    lines.append(f"{indent_str}{{")
-                    if isinstance(item, dict):
-                        lines.append(self.serialize(item, indent + 1))
-                    lines.append(f"{indent_str}}}")
-            elif isinstance(value, dict):
-                lines.append(f"{indent_str}{key}=")
-                lines.append(f"{indent_str}{{")
-                lines.append(self.serialize(value, indent + 1))
-                lines.append(f"{indent_str}}}")
-            elif isinstance(value, list):
-                for item in value:
-                    if isinstance(item, dict):
-                        lines.append(f"{indent_str}{key}=")
-                        lines.append(f"{indent_str}{{")
-                        lines.append(self.serialize(item, indent + 1))
-                        lines.append(f"{indent_str}}}")
-                    else:
-                        lines.append(f"{indent_str}{key}={self._format_value(item)}")
+            cls = type(value)
+            if cls is str:
+                append(f'{indent_str}{keys[key]}="{value}"')
+            elif cls is int or cls is float:
+                append(f'{indent_str}{keys[key]}={value}')
+            elif cls is bool:
+                append(f'{indent_str}{keys[key]}={"yes" if value else "no"}')
             else:
-                lines.append(f"{indent_str}{key}={self._format_value(value)}")
+                if key == '':  # Anonymous list items
+                    for item in value:
+                        if type(item) in _BLOCK_TYPES or isinstance(item, dict):
+                            append(f"{indent_str}{{")
+                            if not self._emit_lines(item, inner, lines, keys, flush):
+                                append('')
+                            append(f"{indent_str}}}")
+                        else:
+                            append(f"{indent_str}{self._format_value(item)}")
+                elif cls in _BLOCK_TYPES or isinstance(value, dict):
+                    append(f"{indent_str}{keys[key]}=")
+                    append(f"{indent_str}{{")
+                    if not self._emit_lines(value, inner, lines, keys, flush):
+                        append('')
+                    append(f"{indent_str}}}")
+                elif isinstance(value, list):
+                    for item in value:
+                        if type(item) in _BLOCK_TYPES or isinstance(item, dict):
+                            append(f"{indent_str}{keys[key]}=")
+                            append(f"{indent_str}{{")
+                            if not self._emit_lines(item, inner, lines, keys, flush):
+                                append('')
+                            append(f"{indent_str}}}")
+                        else:
+                            append(f"{indent_str}{keys[key]}={self._format_value(item)}")
+                else:
+                    append(f"{indent_str}{keys[key]}={self._format_value(value)}")
+                
+                if (key == '' or isinstance(value, list)) and not value:
+                    continue
+                if len(lines) >= SERIALIZE_CHUNK_LINES:
+                    flush()
+            emitted = True
         
-        return '\n'.join(lines)
+        return emitted
     
     def _format_value(self, value: Any) -> str:
         """Format a value for serialization"""
@@ -0,0 +1,186 @@
+"""
+Piece Table Edit Buffer
+Holds the gamestate as the untouched original plus a list of edits
+"""
+
+from bisect import bisect_right
+from typing import Iterator, List, Optional, Tuple
+
+# Largest slice handed out by iter_chunks(), so streaming never copies a
+# whole original piece at once
+CHUNK_SIZE = 1 << 20
+
+
+class PieceTable:
+    """Edit buffer over an immutable original str or bytes
+    
+    The document is a sequence of pieces, each a (source, start, end) slice
+    of either the original buffer or an inserted text. Edits split pieces
+    instead of copying the document, so memory stays near one copy of the
+    original plus the edits.
+    """
+    
+    def __init__(self, original=''):
+        self.original = original
+        self._empty = original[:0]
+        self._pieces: List[Tuple[object, int, int]] = []
+        self._starts: List[int] = []
+        self._length = len(original)
+        self.edit_count = 0
+        if original:
+            self._pieces.append((original, 0, len(original)))
+            self._starts.append(0)
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    @property
+    def is_modified(self) -> bool:
+        """Whether any edit has been applied"""
+        return self.edit_count > 0
+    
+    def _locate(self, pos: int) -> int:
+        """Get the index of the piece containing document offset pos"""
+        return max(bisect_right(self._starts, pos) - 1, 0)
+    
+    def _split(self, pos: int) -> int:
+        """Make sure a piece boundary exists at pos, returning its index"""
+        if pos >= self._length:
+            return len(self._pieces)
+        idx = self._locate(pos)
+        offset = pos - self._starts[idx]
+        if offset == 0:
+            return idx
+        
+        source, start, end = self._pieces[idx]
+        self._pieces[idx:idx + 1] = [(source, start, start + offset), (source, start + offset, end)]
+        self._starts.insert(idx + 1, pos)
+        return idx + 1
+    
+    def replace(self, start: int, end: int, text):
+        """Replace document[start:end] with text"""
+        if not 0 <= start <= end <= self._length:
+            raise IndexError(f"Edit range {start}:{end} outside document of length {self._length}")
+        
+        first = self._split(start)
+        last = self._split(end)
+        new_pieces = [(text, 0, len(text))] if text else []
+        self._pieces[first:last] = new_pieces
+        
+        # Only the offsets from the edit onwards change
+        self._length += len(text) - (end - start)
+        self.edit_count += 1
+        del self._starts[first:]
+        pos = start
+        for source, piece_start, piece_end in self._pieces[first:]:
+            self._starts.append(pos)
+            pos += piece_end - piece_start
+    
+    def insert(self, pos: int, text):
+        """Insert text at document offset pos"""
+        self.replace(pos, pos, text)
+    
+    def iter_chunks(self, start: int = 0, end: Optional[int] = None,
+                    chunk_size: int = CHUNK_SIZE) -> Iterator:
+        """Yield the document (or document[start:end]) as a series of slices"""
+        if end is None or end > self._length:
+            end = self._length
+        if start >= end:
+            return
+        
+        idx = self._locate(start)
+        while idx < len(self._pieces) and self._starts[idx] < end:
+            source, piece_start, piece_end = self._pieces[idx]
+            doc_start = self._starts[idx]
+            lo = piece_start + max(start - doc_start, 0)
+            hi = piece_start + min(end - doc_start, piece_end - piece_start)
+            while lo < hi:
+                step = min(hi, lo + chunk_size)
+                yield source[lo:step]
+                lo = step
+            idx += 1
+    
+    def slice(self, start: int, end: int):
+        """Get document[start:end] as a single str/bytes"""
+        if len(self._pieces) == 1:
+            source, piece_start, _ = self._pieces[0]
+            return source[piece_start + start:piece_start + end]
+        return self._empty.join(self.iter_chunks(start, end, chunk_size=self._length or 1))
+    
+    def text(self):
+        """Get the whole document as a single str/bytes"""
+        if not self.is_modified:
+            return self.original
+        return self.slice(0, self._length)
+    
+    def view(self, start: int, end: int) -> Tuple[object, int]:
+        """Get (buffer, offset) such that document[start:end] is buffer[start - offset:end - offset]
+        
+        A range that lies inside one piece is served from that piece's
+        source without copying; otherwise only the range is materialized.
+        """
+        if self._pieces:
+            idx = self._locate(start)
+            source, piece_start, piece_end = self._pieces[idx]
+            doc_start = self._starts[idx]
+            if end - doc_start <= piece_end - piece_start:
+                return source, doc_start - piece_start
+        return self.slice(start, end), start
+    
+    def finditer(self, pattern, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[object, int]]:
+        """Yield (match, offset) for a compiled pattern over document[start:end]
+        
+        Add offset to a match position to get its document offset. A range
+        that lies inside one piece is searched in place with pos/endpos;
+        otherwise only the requested range is materialized.
+        """
+        if end is None or end > self._length:
+            end = self._length
+        if start >= end:
+            return
+        
+        buffer, offset = self.view(start, end)
+        for match in pattern.finditer(buffer, start - offset, end - offset):
+            yield match, offset
+    
+    def search(self, pattern, start: int = 0, end: Optional[int] = None) -> Optional[Tuple[object, int]]:
+        """Get the first (match, offset) for a compiled pattern, or None"""
+        for found in self.finditer(pattern, start, end):
+            return found
+        return None
+    
+    def snapshot(self) -> Tuple[Tuple[object, int, int], ...]:
+        """Capture the current pieces, to compare against after later edits"""
+        return tuple(self._pieces)
+    
+    def shared_runs(self, snapshot) -> List[Tuple[int, int, int]]:
+        """Find content that is unchanged since a snapshot
+        
+        Returns (snapshot_offset, document_offset, length) runs in order.
+        Pieces are immutable slices of immutable sources, so a source range
+        present in both means identical bytes. Adjacent runs are merged.
+        """
+        current = {}
+        for (source, start, end), doc_start in zip(self._pieces, self._starts):
+            current.setdefault(id(source), []).append((start, end, doc_start))
+        
+        runs = []
+        snap_pos = 0
+        for source, start, end in snapshot:
+            for cur_start, cur_end, doc_start in current.get(id(source), ()):
+                lo = max(start, cur_start)
+                hi = min(end, cur_end)
+                if lo >= hi:
+                    continue
+                run = (snap_pos + lo - start, doc_start + lo - cur_start, hi - lo)
+                if runs and runs[-1][0] + runs[-1][2] == run[0] and runs[-1][1] + runs[-1][2] == run[1]:
+                    last = runs.pop()
+                    run = (last[0], last[1], last[2] + run[2])
+                runs.append(run)
+            snap_pos += end - start
+        return runs
+    
+    def write_to(self, fp, encoding: Optional[str] = 'utf-8'):
+        """Stream the document into a binary file object, chunk by chunk"""
+        for chunk in self.iter_chunks():
+            fp.write(chunk.encode(encoding) if isinstance(chunk, str) else chunk)
@@ -0,0 +1,50 @@
+"""
+Progress Reporting
+Thread-safe progress and cancellation shared between a worker and the GUI
+"""
+
+import threading
+from typing import Tuple
+
+
+class OperationCancelled(Exception):
+    """Raised inside a long operation after its Progress was cancelled"""
+
+
+class Progress:
+    """Progress of one long-running operation (load, index or save)
+    
+    The worker calls update() as it goes; another thread reads snapshot()
+    and may call cancel(), which makes the worker's next update() raise
+    OperationCancelled.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self.stage = ""
+        self.done = 0
+        self.total = 0
+    
+    def update(self, stage: str, done: int, total: int):
+        """Record progress, raising OperationCancelled if a cancel was requested"""
+        with self._lock:
+            self.stage = stage
+            self.done = done
+            self.total = total
+        if self._cancelled.is_set():
+            raise OperationCancelled(f"{stage} cancelled")
+    
+    def snapshot(self) -> Tuple[str, int, int]:
+        """Get the latest (stage, done, total)"""
+        with self._lock:
+            return self.stage, self.done, self.total
+    
+    def cancel(self):
+        """Ask the worker to stop at its next update()"""
+        self._cancelled.set()
+    
+    @property
+    def cancelled(self) -> bool:
+        """Whether a cancel was requested"""
+        return self._cancelled.is_set()
@@ -0,0 +1,430 @@
+"""
+Path Queries
+Compiled path expressions over the gamestate, with results cached until an edit touches them
+"""
+
+import re
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from lazy_tree import LazyBlock
+from parser import ClausewitzParser
+from piece_table import PieceTable
+from section_index import SectionIndex, Span
+from tokenizer import ATOM, STRING, ParseError
+
+# Paths whose compiled form compile_query() keeps
+COMPILED_QUERIES = 256
+
+# Results a QueryCache keeps before dropping the least recently used
+CACHED_RESULTS = 1024
+
+# Step kinds
+KEY = 'key'
+VARIABLE = 'variable'
+ANY = 'any'
+SELF = 'self'
+
+# One token per match: punctuation or operator, {variable}, "quoted key",
+# bare word, or any other character (an error)
+_LEXER = re.compile(r'\s*(?:(!=|<=|>=|[=<>/\[\]*])|\{(\w+)\}|"([^"]*)"|([^\s/\[\]{}"=!<>*]+)|(\S))')
+_TOKEN_KINDS = (None, 'punct', VARIABLE, 'string', 'word', 'bad')
+
+_INDEX = re.compile(r'-?\d+')
+
+
+class Step:
+    """One path segment: a key, {variable}, '*' or '.', filtered by predicates"""
+    
+    __slots__ = ('kind', 'name', 'predicates')
+    
+    def __init__(self, kind: str, name: Optional[str] = None):
+        self.kind = kind
+        self.name = name
+        self.predicates: List['Predicate'] = []
+    
+    def key(self, variables: Dict[str, Any]) -> Optional[str]:
+        """The key this step selects, with a variable substituted"""
+        if self.kind == KEY:
+            return self.name
+        if self.name not in variables:
+            raise ValueError(f"No value given for query variable {{{self.name}}}")
+        value = variables[self.name]
+        return str(value) if value is not None else None
+    
+    def select(self, node: Any, variables: Dict[str, Any]) -> List[Any]:
+        """Values of node matched by this step, repeated keys expanded"""
+        if self.kind == SELF:
+            found = [node]
+        elif not isinstance(node, Mapping):
+            return []
+        elif self.kind == ANY:
+            found = []
+            for value in node.values():
+                _extend(found, value)
+        else:
+            key = self.key(variables)
+            found = []
+            if key is not None and key in node:
+                _extend(found, node[key])
+        
+        for predicate in self.predicates:
+            found = predicate.filter(found, variables)
+        return found
+
+
+class Predicate:
+    """A [...] filter: a list index, or a relative path with an optional comparison
+    
+    A path predicate keeps a value when any value the path reaches from it
+    satisfies the comparison (or, without one, when the path reaches
+    anything at all).
+    """
+    
+    __slots__ = ('index', 'path', 'op', 'value', 'variable')
+    
+    def __init__(self, index: Optional[int] = None, path: Tuple[Step, ...] = (),
+                 op: Optional[str] = None, value: Any = None, variable: Optional[str] = None):
+        self.index = index
+        self.path = path
+        self.op = op
+        self.value = value
+        self.variable = variable
+    
+    def filter(self, values: List[Any], variables: Dict[str, Any]) -> List[Any]:
+        if self.index is not None:
+            try:
+                return [values[self.index]]
+            except IndexError:
+                return []
+        
+        target = self.value
+        if self.variable is not None:
+            if self.variable not in variables:
+                raise ValueError(f"No value given for query variable {{{self.variable}}}")
+            target = variables[self.variable]
+        
+        kept = []
+        for value in values:
+            reached = walk([value], self.path, variables)
+            if self.op is None:
+                matched = bool(reached)
+            else:
+                matched = any(_compare(found, self.op, target) for found in reached)
+            if matched:
+                kept.append(value)
+        return kept
+
+
+def _extend(found: List[Any], value: Any):
+    """Add a value, or each value of a repeated key"""
+    if type(value) is list:
+        found.extend(value)
+    else:
+        found.append(value)
+
+
+def _number(value: Any) -> Optional[float]:
+    if type(value) in (int, float):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _text(value: Any) -> str:
+    if value is True:
+        return 'yes'
+    if value is False:
+        return 'no'
+    return str(value)
+
+
+def _compare(value: Any, op: str, target: Any) -> bool:
+    """Compare numerically when both sides are numbers, otherwise as text"""
+    if isinstance(value, Mapping):
+        return False
+    a, b = _number(value), _number(target)
+    if a is None or b is None:
+        a, b = _text(value), _text(target)
+    if op == '=':
+        return a == b
+    if op == '!=':
+        return a != b
+    if op == '<':
+        return a < b
+    if op == '<=':
+        return a <= b
+    if op == '>':
+        return a > b
+    return a >= b
+
+
+def _literal(text: str) -> Any:
+    """A bare predicate value: int, float or word"""
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def walk(nodes: List[Any], steps: Tuple[Step, ...], variables: Dict[str, Any]) -> List[Any]:
+    """Follow steps from each node, returning every value reached in order"""
+    for step in steps:
+        matched = []
+        for node in nodes:
+            matched.extend(step.select(node, variables))
+        nodes = matched
+        if not nodes:
+            break
+    return nodes
+
+
+class _PathParser:
+    """Recursive-descent parser for the path syntax (see Query)"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.tokens = []
+        for match in _LEXER.finditer(path):
+            kind = match.lastindex
+            if kind is not None:
+                self.tokens.append((_TOKEN_KINDS[kind], match.group(kind), match.start(kind)))
+        self.pos = 0
+    
+    def peek(self) -> Tuple[Optional[str], Optional[str], int]:
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None, None, len(self.path)
+    
+    def next(self) -> Tuple[Optional[str], Optional[str], int]:
+        token = self.peek()
+        self.pos += 1
+        return token
+    
+    def at(self, *texts: str) -> bool:
+        kind, text, _ = self.peek()
+        return kind == 'punct' and text in texts
+    
+    def fail(self, expected: str):
+        kind, text, offset = self.peek()
+        found = repr(text) if kind is not None else "end of query"
+        raise ParseError(f"Expected {expected} in query {self.path!r}, found {found}", offset)
+    
+    def parse(self) -> Tuple[Step, ...]:
+        steps = self.parse_path()
+        if self.peek()[0] is not None:
+            self.fail("'/' or '['")
+        return steps
+    
+    def parse_path(self) -> Tuple[Step, ...]:
+        steps = [self.parse_step()]
+        while self.at('/'):
+            self.next()
+            steps.append(self.parse_step())
+        return tuple(steps)
+    
+    def parse_step(self) -> Step:
+        kind, text, _ = self.peek()
+        if kind == 'punct' and text == '*':
+            step = Step(ANY)
+        elif kind == VARIABLE:
+            step = Step(VARIABLE, text)
+        elif kind == 'word' and text == '.':
+            step = Step(SELF)
+        elif kind in ('word', 'string'):
+            step = Step(KEY, text)
+        else:
+            self.fail("a key, '*', '.' or {variable}")
+        self.next()
+        
+        while self.at('['):
+            self.next()
+            step.predicates.append(self.parse_predicate())
+        return step
+    
+    def parse_predicate(self) -> Predicate:
+        kind, text, _ = self.peek()
+        if kind == 'word' and _INDEX.fullmatch(text) and self.pos + 1 < len(self.tokens) \
+                and self.tokens[self.pos + 1][:2] == ('punct', ']'):
+            self.pos += 2
+            return Predicate(index=int(text))
+        
+        predicate = Predicate(path=self.parse_path())
+        if self.at('=', '!=', '<', '<=', '>', '>='):
+            predicate.op = self.next()[1]
+            kind, text, _ = self.peek()
+            if kind == 'string':
+                predicate.value = text
+            elif kind == 'word':
+                predicate.value = _literal(text)
+            elif kind == VARIABLE:
+                predicate.variable = text
+            else:
+                self.fail("a value")
+            self.next()
+        
+        if not self.at(']'):
+            self.fail("']'")
+        self.next()
+        return predicate
+
+
+class Query:
+    """A path expression compiled once into steps
+    
+    Segments are separated by '/'. A segment is a key (quote it if it
+    contains special characters), {name} for a variable given at run time,
+    '*' for every child, or '.' for the current value. Repeated keys are
+    expanded, so every path yields a flat list. Each segment can be followed
+    by predicates:
+        
+        [2]                 the third match under each parent (negative counts from the end)
+        [type=default]      matches whose child compares equal (also !=, <, <=, >, >=)
+        [name/key={who}]    relative paths and variables work in predicates
+        [flags]             matches that have the child at all
+    
+    Numbers compare numerically and everything else as text, with booleans
+    as yes/no. For example:
+        
+        country/{player}/modules/standard_economy_module/resources/energy
+        planets/planet/*[owner={player}]/name/key
+        fleet/*[military_power>10000]/name/key
+    """
+    
+    __slots__ = ('path', 'steps')
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.steps = _PathParser(path).parse()
+    
+    def __repr__(self) -> str:
+        return f"<Query {self.path!r}>"
+    
+    def run(self, root: Any, variables: Optional[Dict[str, Any]] = None) -> List[Any]:
+        """Evaluate against a tree (dict or LazyBlock) whose top level is the first step"""
+        return walk([root], self.steps, variables or {})
+    
+    def run_gamestate(self, gamestate: PieceTable, index: SectionIndex, parser: ClausewitzParser,
+                      variables: Dict[str, Any]) -> Tuple[Optional[Span], List[Any]]:
+        """Evaluate against an indexed gamestate, parsing only the blocks on the path
+        
+        Returns (span, results), where span is the document range the
+        results were read from (None if they depend on nothing in it).
+        The section index locates the first step, or the country block
+        directly for country/<id>/...; below that, lazy blocks parse one
+        level each along the path.
+        """
+        steps = self.steps
+        first = steps[0]
+        sections = index.sections
+        if first.kind in (KEY, VARIABLE) and not first.predicates:
+            key = first.key(variables)
+            if key == 'country' and len(steps) > 1 and steps[1].kind in (KEY, VARIABLE) \
+                    and not steps[1].predicates:
+                country_id = steps[1].key(variables)
+                span = index.country_span(country_id) if country_id is not None else None
+                if span is None:
+                    return None, []
+                return span, walk([value_at(gamestate, span, parser)], steps[2:], variables)
+            sections = {key: sections[key]} if key in sections else {}
+        
+        # A top level holding just the sections the first step can match
+        root = {}
+        spans = []
+        for key, section in sections.items():
+            for span in section:
+                parser.add_value(root, key, value_at(gamestate, span, parser))
+                spans.append(span)
+        if not spans:
+            return None, []
+        covered = (min(start for start, _ in spans), max(end for _, end in spans))
+        return covered, walk([root], steps, variables)
+
+
+def value_at(gamestate: PieceTable, span: Span, parser: ClausewitzParser) -> Any:
+    """The value stored at a document span: a LazyBlock, or a converted scalar
+    
+    span is a value span from the section index or a query result, so
+    only the bytes it covers are read and nothing is parsed until used.
+    """
+    buffer, offset = gamestate.view(*span)
+    start, end = span[0] - offset, span[1] - offset
+    head = buffer[start:start + 1]
+    if head in (b'{', '{'):
+        return LazyBlock(buffer, start, end, parser)
+    kind = STRING if head in (b'"', '"') else ATOM
+    return parser.convert(buffer, (kind, start, end))
+
+
+@lru_cache(maxsize=COMPILED_QUERIES)
+def compile_query(path: str) -> Query:
+    """Compile a path, reusing the compiled form of recently used paths"""
+    return Query(path)
+
+
+class QueryCache:
+    """Results of recent queries against one gamestate, kept while still valid
+    
+    Every result remembers the document span it was read from. An edit
+    that lands inside a span drops that result; results elsewhere only
+    have their spans moved, like the section index.
+    """
+    
+    def __init__(self, max_entries: int = CACHED_RESULTS):
+        self.max_entries = max_entries
+        self._results: 'OrderedDict[tuple, Tuple[Optional[Span], List[Any]]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self) -> int:
+        return len(self._results)
+    
+    def run(self, path: str, gamestate: PieceTable, index: SectionIndex,
+            variables: Dict[str, Any]) -> List[Any]:
+        """Evaluate a path, from the cache when nothing it read has been edited
+        
+        Queries whose variables include an unhashable value, such as a
+        list, cannot be keyed and are always evaluated afresh.
+        """
+        query = compile_query(path)
+        key = (path, tuple(sorted(variables.items())))
+        try:
+            cached = self._results.get(key)
+        except TypeError:
+            self.misses += 1
+            return query.run_gamestate(gamestate, index, ClausewitzParser(), variables)[1]
+        if cached is not None:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return list(cached[1])
+        
+        self.misses += 1
+        # A parser per query: its symbols live only as long as the results that use them
+        span, results = query.run_gamestate(gamestate, index, ClausewitzParser(), variables)
+        self._results[key] = (span, results)
+        if len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        return list(results)
+    
+    def invalidate(self, start: int, end: int, delta: int):
+        """Account for gamestate[start:end] being replaced by delta more (or fewer) bytes"""
+        for key, (span, results) in list(self._results.items()):
+            if span is None:
+                continue
+            span_start, span_end = span
+            if start < span_end and end > span_start:
+                del self._results[key]
+            elif delta and span_start >= end:
+                self._results[key] = ((span_start + delta, span_end + delta), results)
+    
+    def clear(self):
+        """Forget every result, for when the whole gamestate is replaced"""
+        self._results.clear()
@@ -0,0 +1,219 @@
+"""
+Structural Save Diff
+Path-level changes between two saves, found by comparing subtree hashes
+"""
+
+import hashlib
+import re
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+from lazy_tree import LazyBlock
+from parse_cache import HASH_KIND, ParseCache
+from parser import ClausewitzParser
+from query import value_at
+from save_handler import StellarisSaveFile
+from tokenizer import OPEN, iter_entries, token_text
+
+# Listings of blocks up to this depth (0 is the document, 1 a top-level
+# section such as country) are kept in the parse cache
+CACHED_DEPTH = 1
+
+# Bytes of digest per subtree
+DIGEST_SIZE = 16
+
+# Change kinds
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+# Keys that can appear bare in a query path; others are quoted
+_BARE_KEY = re.compile(r'[^\s/\[\]{}"=!<>*]+')
+
+# One child of a block: key ('' for bare values), token kind, document span, digest
+Entry = Tuple[str, int, int, int, bytes]
+
+
+class Change:
+    """One difference: a value added, removed or changed at a query-style path
+    
+    Repeated keys are addressed by index, as in key[2]; old and new are
+    scalars or LazyBlocks (None on the side where the value is missing).
+    """
+    
+    __slots__ = ('kind', 'path', 'old', 'new')
+    
+    def __init__(self, kind: str, path: str, old: Any = None, new: Any = None):
+        self.kind = kind
+        self.path = path
+        self.old = old
+        self.new = new
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain values, with blocks fully parsed"""
+        return {
+            'kind': self.kind,
+            'path': self.path,
+            'old': self.old.to_dict() if isinstance(self.old, LazyBlock) else self.old,
+            'new': self.new.to_dict() if isinstance(self.new, LazyBlock) else self.new,
+        }
+    
+    def __repr__(self) -> str:
+        return f"<Change {self.kind} {self.path}>"
+    
+    def __str__(self) -> str:
+        if self.kind == ADDED:
+            return f"+ {self.path} = {_short(self.new)}"
+        if self.kind == REMOVED:
+            return f"- {self.path} = {_short(self.old)}"
+        return f"~ {self.path}: {_short(self.old)} -> {_short(self.new)}"
+
+
+def _short(value: Any) -> str:
+    return '{...}' if isinstance(value, LazyBlock) else repr(value)
+
+
+class SubtreeHashes:
+    """Child listings of a save's blocks, each child with the digest of its text
+    
+    Equal digests mean equal text, so identical subtrees are skipped without
+    being parsed. Listings of the document and of top-level sections can
+    be taken from and written back to a parse cache, as long as the save
+    is unedited (the listings hold document offsets).
+    """
+    
+    def __init__(self, save_file: StellarisSaveFile, cache: Optional[ParseCache] = None):
+        self.gamestate = save_file.gamestate
+        self.index = save_file.index
+        self.parser = ClausewitzParser()
+        self.cache = cache
+        self.key = None
+        if cache is not None and save_file.cache_key is not None and not self.gamestate.is_modified:
+            self.key = save_file.cache_key
+        self.listings: Dict[Tuple[int, int], List[Entry]] = {}
+        if self.key is not None:
+            self.listings = cache.get(self.key, HASH_KIND) or {}
+        self._added = False
+    
+    @property
+    def root(self) -> Tuple[int, int]:
+        return 0, len(self.gamestate)
+    
+    def listing(self, span: Tuple[int, int], depth: int) -> List[Entry]:
+        """The children of the block at span (the document itself at depth 0)"""
+        entries = self.listings.get(span)
+        if entries is not None:
+            return entries
+        
+        if depth == 0:
+            spans = sorted((start, end, key) for key, spans in self.index.sections.items()
+                           for start, end in spans)
+            entries = []
+            for start, end, key in spans:
+                buffer, offset = self.gamestate.view(start, end)
+                head = buffer[start - offset:start - offset + 1]
+                kind = OPEN if head in (b'{', '{') else 0
+                entries.append((key, kind, start, end, _digest(buffer[start - offset:end - offset])))
+        else:
+            buffer, offset = self.gamestate.view(*span)
+            entries = []
+            for key_token, (kind, start, end) in iter_entries(buffer, span[0] - offset + 1, span[1] - offset):
+                key = token_text(buffer, key_token) if key_token is not None else ''
+                entries.append((key, kind, start + offset, end + offset, _digest(buffer[start:end])))
+        
+        if depth <= CACHED_DEPTH:
+            self.listings[span] = entries
+            self._added = True
+        return entries
+    
+    def value(self, entry: Entry) -> Any:
+        """The value of a listed child: a scalar, or a LazyBlock"""
+        return value_at(self.gamestate, (entry[2], entry[3]), self.parser)
+    
+    def store(self):
+        """Write newly computed listings to the cache"""
+        if self.key is not None and self._added:
+            self.cache.put(self.key, HASH_KIND, self.listings)
+            self._added = False
+
+
+def _digest(data) -> bytes:
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def _segment(key: str, index: Optional[int] = None) -> str:
+    text = key if _BARE_KEY.fullmatch(key) and key != '.' else f'"{key}"'
+    return text if index is None else f"{text}[{index}]"
+
+
+def _group(entries: List[Entry]) -> Dict[str, List[Entry]]:
+    groups: Dict[str, List[Entry]] = {}
+    for entry in entries:
+        groups.setdefault(entry[0], []).append(entry)
+    return groups
+
+
+def _diff_block(a: SubtreeHashes, span_a, b: SubtreeHashes, span_b, depth: int, prefix: str,
+                changes: List[Change]):
+    """Compare two blocks' children key by key, recursing into those whose digests differ"""
+    groups_a = _group(a.listing(span_a, depth))
+    groups_b = _group(b.listing(span_b, depth))
+    
+    for key in list(groups_a) + [key for key in groups_b if key not in groups_a]:
+        old = groups_a.get(key, [])
+        new = groups_b.get(key, [])
+        if key != '' and len(old) <= 1 and len(new) <= 1:
+            _diff_pair(a, old[0] if old else None, b, new[0] if new else None, depth,
+                       prefix + _segment(key), changes)
+            continue
+        
+        # Repeated keys and bare values: align the sequences by digest
+        matcher = SequenceMatcher(None, [entry[4] for entry in old], [entry[4] for entry in new], autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                continue
+            paired = min(i2 - i1, j2 - j1)
+            for i in range(paired):
+                _diff_pair(a, old[i1 + i], b, new[j1 + i], depth, prefix + _segment(key, j1 + i), changes)
+            for i in range(i1 + paired, i2):
+                _diff_pair(a, old[i], b, None, depth, prefix + _segment(key, i), changes)
+            for j in range(j1 + paired, j2):
+                _diff_pair(a, None, b, new[j], depth, prefix + _segment(key, j), changes)
+
+
+def _diff_pair(a: SubtreeHashes, old: Optional[Entry], b: SubtreeHashes, new: Optional[Entry],
+               depth: int, path: str, changes: List[Change]):
+    if old is None:
+        changes.append(Change(ADDED, path, new=b.value(new)))
+    elif new is None:
+        changes.append(Change(REMOVED, path, old=a.value(old)))
+    elif old[4] == new[4]:
+        return
+    elif old[1] == OPEN and new[1] == OPEN:
+        _diff_block(a, (old[2], old[3]), b, (new[2], new[3]), depth + 1, path + '/', changes)
+    else:
+        old_value, new_value = a.value(old), b.value(new)
+        if old_value != new_value:
+            changes.append(Change(CHANGED, path, old_value, new_value))
+
+
+def diff(save_a: StellarisSaveFile, save_b: StellarisSaveFile,
+         cache: Optional[ParseCache] = None) -> List[Change]:
+    """List the changes that turn save_a's gamestate into save_b's
+    
+    Top-level sections are compared by digest first and only differing
+    blocks are opened, level by level, so saves that differ in a few
+    countries cost little more than hashing their text. Lists of repeated
+    keys are aligned by digest, so an inserted entry shows as one addition.
+    A value that only changed formatting is not reported. With a cache,
+    the hashes of unedited saves are reused across runs.
+    """
+    a = SubtreeHashes(save_a, cache)
+    b = SubtreeHashes(save_b, cache)
+    changes: List[Change] = []
+    _diff_block(a, a.root, b, b.root, 0, '', changes)
+    a.store()
+    b.store()
+    return changes
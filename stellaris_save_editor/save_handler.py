@@ -5,70 +5,398 @@ Uses regex-based editing for large files instead of full parsing
 """
 
 import zipfile
+import math
+import mmap
 import os
 import shutil
 import re
-from typing import Dict, Any, Optional
+import tempfile
+from bisect import bisect_right
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from cst import CstBlock
+from instrumentation import DECODE, DEFLATE, INDEX, INFLATE, WRITE, ZIP_READ, message, span
+from parse_cache import INDEX_KIND, ParseCache, entry_key
+from parser import ClausewitzParser
+from piece_table import PieceTable
+from progress import Progress
+from query import QueryCache
+from section_index import SectionIndex
+from tech_index import TechIndex
+from tokenizer import OPEN, iter_entries, token_text
+from zip_writer import DEFAULT_BLOCK_SIZE, DEFAULT_LEVEL, WINDOW_SIZE, ZIP_DEFLATED, EntryInfo, ZipWriter, read_entries
+
+# The gamestate is kept as raw UTF-8 bytes, so all patterns are bytes patterns.
+# Amounts can be negative (a stockpile in debt) or, from other tools, use an exponent.
+NUMBER = rb'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?'
+RESOURCE_PATTERN = re.compile(rb'^\s*(\w+)=(' + NUMBER + rb')', re.MULTILINE)
+UNITY_PATTERN = re.compile(rb'^\s*unity=(' + NUMBER + rb')', re.MULTILINE)
+INFLUENCE_PATTERN = re.compile(rb'^\s*influence=(' + NUMBER + rb')', re.MULTILINE)
+# Technology ids are written quoted, so they may not contain quotes or whitespace
+TECH_ID_PATTERN = re.compile(r'[^\s"{}=#]+')
+DATE_PATTERN = re.compile(rb'date="([^"]+)"')
+
+# Batched edit targets: group 1 is the entry name, group 2 the value. All
+# names share a single alternation so the regex engine keeps its
+# literal-prefix scan no matter how many edits are queued.
+EDIT_PATTERN = rb'^\s*(%(names)s)=(' + NUMBER + rb')'
+
+# Block under the player country holding the stockpile of every resource,
+# unity and influence included, as name=amount entries; the first unity=
+# line of the country itself is budget income
+STOCKPILE_PATH = ('modules', 'standard_economy_module', 'resources')
+
+# Read size when inflating gamestate into a temporary file
+INFLATE_CHUNK_SIZE = 1 << 20
+
+
+def format_amount(value: float) -> str:
+    """Write an amount the way the game does: fixed-point, at most 5 decimals"""
+    text = f'{value:.5f}'.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+
+class EditBatch:
+    """Pending edits to the player country, applied together in one pass
+    
+    Use through StellarisSaveFile.batch():
+    
+        with save.batch() as batch:
+            batch.set_resource('energy', 5000)
+            batch.set_unity(1000)
+        batch.results  # {'resource:energy': True, 'unity': True}
+    """
+    
+    def __init__(self, save_file: 'StellarisSaveFile'):
+        self._save_file = save_file
+        self._edits: Dict[str, Tuple[str, str]] = {}
+        self.results: Dict[str, bool] = {}
+    
+    def __enter__(self) -> 'EditBatch':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.apply()
+        else:
+            self._edits.clear()
+    
+    def __len__(self) -> int:
+        return len(self._edits)
+    
+    def _add(self, label: str, name: str, amount: float) -> str:
+        """Queue an edit; a later edit to the same target replaces an earlier one
+        
+        Raises ValueError (or TypeError) for an amount that is not a finite
+        number, so it is never spliced into the gamestate.
+        """
+        value = float(amount)
+        if not math.isfinite(value):
+            raise ValueError(f"{label}: amount must be finite, got {amount!r}")
+        self._edits.pop(label, None)
+        self._edits[label] = (name, format_amount(value))
+        return label
+    
+    def set_resource(self, resource_type: str, amount: float) -> str:
+        """Queue a resource change, returning its key in results"""
+        return self._add(f'resource:{resource_type}', resource_type, amount)
+    
+    def set_unity(self, amount: float) -> str:
+        """Queue a unity change, returning its key in results"""
+        return self._add('unity', 'unity', amount)
+    
+    def set_influence(self, amount: float) -> str:
+        """Queue an influence change, returning its key in results"""
+        return self._add('influence', 'influence', amount)
+    
+    def apply(self) -> Dict[str, bool]:
+        """Apply all pending edits and report which of them matched"""
+        edits = dict(self._edits)
+        self._edits.clear()
+        self.results.update(self._save_file._apply_edits(edits))
+        return self.results
 
 
 class StellarisSaveFile:
     """Handler for Stellaris save files"""
     
-    def __init__(self, filepath: Optional[str] = None):
+    def __init__(self, filepath: Optional[str] = None, use_mmap: bool = False,
+                 cache: Optional[ParseCache] = None):
         self.filepath = filepath
         self.meta_content = ""
-        self.gamestate_content = ""
+        self.gamestate = PieceTable(b"")
         self.empire_name = ""
         self.game_date = ""
+        self.index = SectionIndex()
+        self.player_country_id = None
+        self._mmap = None
+        self._mmap_file = None
+        self._source_path = None
+        self._tree = None
+        self._techs = None
+        self.cache_key = None
+        self.queries = QueryCache()
         
         if filepath:
-            self.load(filepath)
+            self.load(filepath, use_mmap=use_mmap, cache=cache)
     
-    def load(self, filepath: str):
-        """Load a Stellaris save file"""
+    def load(self, filepath: str, use_mmap: bool = False, progress: Optional[Progress] = None,
+             cache: Optional[ParseCache] = None):
+        """Load a Stellaris save file
+        
+        Args:
+            filepath: Path to the .sav file
+            use_mmap: Inflate gamestate in chunks into a temporary file and
+                memory-map it instead of reading it into memory, for saves
+                larger than comfortable RAM
+            progress: Receives inflate and index progress and can cancel the
+                load, which leaves this object half-loaded (discard it)
+            cache: Parse cache to take the section index from, skipping the
+                scan when this gamestate entry was indexed before
+        """
         self.filepath = filepath
         
         if not os.path.exists(filepath):
             raise FileNotFoundError(f"Save file not found: {filepath}")
         
-        print(f"Loading save file: {filepath}")
+        message(f"Loading save file: {filepath}")
         
         # Extract the zip file
         with zipfile.ZipFile(filepath, 'r') as zf:
             # Read meta file
-            self.meta_content = zf.read('meta').decode('utf-8', errors='ignore')
+            with span(ZIP_READ) as read_span:
+                meta = zf.read('meta')
+                self.cache_key = entry_key(zf.getinfo('gamestate'))
+                read_span.bytes = len(meta)
             
-            # Read gamestate file
-            self.gamestate_content = zf.read('gamestate').decode('utf-8', errors='ignore')
-            print(f"Loaded gamestate ({len(self.gamestate_content) / 1024 / 1024:.1f} MB)")
+            # Read gamestate file as raw bytes; decoding would cost another
+            # full copy and could drop bytes that must round-trip
+            self.close()
+            with span(INFLATE) as inflate_span:
+                if use_mmap:
+                    content = self._inflate_to_mmap(zf, 'gamestate', progress)
+                elif progress is not None:
+                    chunks = []
+                    self._inflate(zf, 'gamestate', chunks.append, progress)
+                    content = b"".join(chunks)
+                else:
+                    content = zf.read('gamestate')
+                inflate_span.bytes = len(content)
+            message(f"Loaded gamestate ({len(content) / 1024 / 1024:.1f} MB)")
         
         # Extract basic info
-        name_match = re.search(r'name="([^"]+)"', self.meta_content)
-        self.empire_name = name_match.group(1) if name_match else "Unknown"
+        with span(DECODE, len(meta)):
+            self.meta_content = meta.decode('utf-8', errors='ignore')
+            name_match = re.search(r'name="([^"]+)"', self.meta_content)
+            self.empire_name = name_match.group(1) if name_match else "Unknown"
+            
+            date_match = DATE_PATTERN.search(content)
+            self.game_date = date_match.group(1).decode('utf-8', errors='replace') if date_match else "Unknown"
+        
+        # Edits are recorded as pieces over the original text
+        self.gamestate = PieceTable(content)
+        self.queries.clear()
         
-        date_match = re.search(r'date="([^"]+)"', self.gamestate_content)
-        self.game_date = date_match.group(1) if date_match else "Unknown"
+        # Index sections once so lookups only touch the exact country block
+        with span(INDEX, len(content)) as index_span:
+            cached = cache.get(self.cache_key, INDEX_KIND) if cache is not None else None
+            if cached is not None:
+                self.index = SectionIndex.from_dict(cached)
+                index_span.message = "from cache"
+            else:
+                index_progress = None
+                if progress is not None:
+                    index_progress = lambda pos: progress.update("Indexing", pos, len(content))
+                self.index = SectionIndex.build(content, index_progress)
+                if cache is not None:
+                    cache.put(self.cache_key, INDEX_KIND, self.index.to_dict())
+        self.player_country_id = self.index.player_country
         
-        print("Save file loaded successfully!")
+        self._set_source(filepath)
+        message("Save file loaded successfully!")
+    
+    def _inflate(self, zf: zipfile.ZipFile, name: str, write, progress: Optional[Progress] = None):
+        """Inflate a zip entry chunk by chunk into write(), reporting progress"""
+        total = zf.getinfo(name).file_size
+        done = 0
+        with zf.open(name) as src:
+            while True:
+                chunk = src.read(INFLATE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                write(chunk)
+                done += len(chunk)
+                if progress is not None:
+                    progress.update("Inflating", done, total)
+    
+    def _inflate_to_mmap(self, zf: zipfile.ZipFile, name: str, progress: Optional[Progress] = None):
+        """Inflate a zip entry into a temporary file and memory-map it"""
+        self._mmap_file = tempfile.TemporaryFile(prefix='stellaris_', suffix='.gamestate')
+        self._inflate(zf, name, self._mmap_file.write, progress)
+        self._mmap_file.flush()
+        
+        if self._mmap_file.tell() == 0:
+            # Empty files cannot be mapped
+            return b""
+        self._mmap = mmap.mmap(self._mmap_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+    
+    def close(self):
+        """Release the memory map and temporary file of a use_mmap load"""
+        if self._mmap is not None:
+            self.gamestate = PieceTable(b"")
+            self.index = SectionIndex()
+            self.queries.clear()
+            self._mmap.close()
+            self._mmap = None
+        if self._mmap_file is not None:
+            self._mmap_file.close()
+            self._mmap_file = None
     
-    def save(self, output_path: Optional[str] = None):
-        """Save the modified save file"""
+    @property
+    def gamestate_content(self) -> str:
+        """The full gamestate text (joins and decodes the edit buffer, so avoid on hot paths)"""
+        return self.gamestate.slice(0, len(self.gamestate)).decode('utf-8', errors='replace')
+    
+    @gamestate_content.setter
+    def gamestate_content(self, content: str):
+        self.close()
+        content = content.encode('utf-8')
+        self.gamestate = PieceTable(content)
+        self.index = SectionIndex.build(content)
+        self.player_country_id = self.index.player_country
+        self.queries.clear()
+    
+    def _set_source(self, filepath: str):
+        """Remember the archive whose compressed data matches the current state"""
+        self._source_path = filepath
+        self._source_stat = os.stat(filepath)
+        self._source_entries = read_entries(filepath)
+        self._source_snapshot = self.gamestate.snapshot()
+        self._source_meta = self.meta_content
+    
+    def _source_unchanged(self) -> bool:
+        """Whether the source archive is still the file the state came from"""
+        if self._source_path is None or not os.path.exists(self._source_path):
+            return False
+        stat = os.stat(self._source_path)
+        return (stat.st_size, stat.st_mtime_ns) == (self._source_stat.st_size, self._source_stat.st_mtime_ns)
+    
+    def save(self, output_path: Optional[str] = None, compression_level: int = DEFAULT_LEVEL,
+             store: bool = False, workers: Optional[int] = None, reuse: bool = True,
+             progress: Optional[Progress] = None):
+        """Save the modified save file
+        
+        Args:
+            output_path: Where to write (default: the loaded file)
+            compression_level: zlib level used for the deflated entries
+            store: Write entries uncompressed, a fast mode for scratch saves
+            workers: Threads used to deflate gamestate (default: CPU count)
+            reuse: Copy unchanged entries and clean gamestate blocks from the
+                source archive instead of recompressing them
+            progress: Receives compression progress and can cancel the save,
+                which leaves the existing file untouched
+        """
         if output_path is None:
             output_path = self.filepath
         
+        reuse = reuse and not store and self._source_unchanged()
+        
         # Create a backup
         if os.path.exists(output_path):
             backup_path = output_path + '.backup'
             shutil.copy2(output_path, backup_path)
-            print(f"Backup created: {backup_path}")
+            message(f"Backup created: {backup_path}")
+        
+        total = len(self.gamestate) + len(self.meta_content.encode('utf-8'))
+        write_progress = None
+        if progress is not None:
+            write_progress = lambda done: progress.update("Compressing", done, total)
+        
+        # Write next to the target and swap it in at the end, so neither a
+        # failed or cancelled save nor block reuse can clobber the old file
+        write_path = output_path + '.tmp'
+        message(f"Writing save file: {output_path}")
+        try:
+            with span(WRITE) as write_span:
+                with ZipWriter(write_path, write_progress) as zw:
+                    source_fp = open(self._source_path, 'rb') if reuse else None
+                    try:
+                        with span(DEFLATE, total) as deflate_span:
+                            deflate_span.message = "reusing source blocks" if reuse else None
+                            self._write_meta(zw, source_fp, compression_level, store)
+                            self._write_gamestate(zw, source_fp, compression_level, store, workers)
+                    finally:
+                        if source_fp is not None:
+                            source_fp.close()
+                write_span.bytes = os.path.getsize(write_path)
+        except BaseException:
+            if os.path.exists(write_path):
+                os.remove(write_path)
+            raise
         
-        # Create the zip file
-        print(f"Writing save file: {output_path}")
-        with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-            zf.writestr('meta', self.meta_content.encode('utf-8'))
-            zf.writestr('gamestate', self.gamestate_content.encode('utf-8'))
+        os.replace(write_path, output_path)
+        self._set_source(output_path)
         
-        print("Save complete!")
+        message("Save complete!")
+    
+    def _write_meta(self, zw: ZipWriter, source_fp, level: int, store: bool):
+        """Write meta, copying it verbatim when it is untouched"""
+        source = self._source_entries.get('meta') if source_fp else None
+        if source is not None and self.meta_content == self._source_meta:
+            zw.copy_entry(source_fp, source)
+        else:
+            zw.write_entry('meta', [self.meta_content.encode('utf-8')],
+                           level=level, store=store, workers=1)
+    
+    def _write_gamestate(self, zw: ZipWriter, source_fp, level: int, store: bool, workers: Optional[int]):
+        """Write gamestate, re-encoding only the regions changed since the source archive"""
+        source = self._source_entries.get('gamestate') if source_fp else None
+        if source is not None:
+            runs = self.gamestate.shared_runs(self._source_snapshot)
+            if runs == [(0, 0, source.file_size)] and len(self.gamestate) == source.file_size:
+                zw.copy_entry(source_fp, source)
+                return
+            if source.blocks and source.method == ZIP_DEFLATED:
+                zw.write_blocks('gamestate', self._reuse_parts(source_fp, source, runs), level, workers)
+                return
+        
+        # Stream the pieces straight into the parallel deflater
+        zw.write_entry('gamestate', self.gamestate.iter_chunks(),
+                       level=level, store=store, workers=workers)
+    
+    def _reuse_parts(self, source_fp, source: EntryInfo, runs: List[Tuple[int, int, int]]) -> Iterator[tuple]:
+        """Build the gamestate from clean source blocks plus freshly compressed gaps
+        
+        A source block can be copied if it and the 32 KB before it (its
+        deflate history) are still one contiguous run of unchanged data.
+        """
+        run_starts = [run[0] for run in runs]
+        pos = 0
+        source_pos = 0
+        offset = source.data_offset
+        
+        for block in source.blocks:
+            need_start = source_pos - min(source_pos, WINDOW_SIZE)
+            i = bisect_right(run_starts, need_start) - 1
+            if i >= 0:
+                run_start, doc_start, length = runs[i]
+                if run_start + length >= source_pos + block.raw_size:
+                    block_pos = doc_start + source_pos - run_start
+                    yield from self._fresh_parts(pos, block_pos)
+                    yield 'copy', source_fp, offset, block
+                    pos = block_pos + block.raw_size
+            source_pos += block.raw_size
+            offset += block.compress_size
+        
+        yield from self._fresh_parts(pos, len(self.gamestate))
+    
+    def _fresh_parts(self, start: int, end: int) -> Iterator[tuple]:
+        """Split gamestate[start:end] into blocks to compress"""
+        for block_start in range(start, end, DEFAULT_BLOCK_SIZE):
+            block_end = min(end, block_start + DEFAULT_BLOCK_SIZE)
+            dictionary = self.gamestate.slice(max(0, block_start - WINDOW_SIZE), block_start)
+            yield 'data', self.gamestate.slice(block_start, block_end), dictionary
     
     def get_empire_name(self) -> str:
         """Get the empire name"""
@@ -78,124 +406,221 @@ class StellarisSaveFile:
         """Get the current game date"""
         return self.game_date
     
+    def _player_span(self):
+        """Get the (start, end) span of the player country's block"""
+        return self.index.player_span()
+    
+    def _replace(self, start: int, end: int, text: str):
+        """Replace gamestate[start:end] and keep the index in sync"""
+        data = text.encode('utf-8')
+        self.gamestate.replace(start, end, data)
+        self.index.shift(start, len(data) - (end - start))
+        self.queries.invalidate(start, end, len(data) - (end - start))
+    
+    def query(self, path: str, **variables) -> list:
+        """Get every value a path query reaches, e.g.
+        
+            save.query("country/{player}/modules/standard_economy_module/resources/energy")
+        
+        {player} is the player's country id unless given; other {name}
+        variables come from keyword arguments. Block values are LazyBlocks and
+        only the blocks along the path get parsed. Results are
+        cached until an edit lands inside what the query read. See
+        query.Query for the syntax.
+        """
+        variables.setdefault('player', self.player_country_id)
+        return self.queries.run(path, self.gamestate, self.index, variables)
+    
     def get_resources(self) -> Dict[str, float]:
         """Get the player's current resources"""
         resources = {}
         
-        # Find the player section and country
-        player_match = re.search(r'player=\s*\{\s*\{\s*name="[^"]*"\s*country=(\d+)', self.gamestate_content)
-        if not player_match:
+        span = self._stockpile_span()
+        if span is None:
             return resources
         
-        country_id = player_match.group(1)
-        
-        # Find resources for this country - look for patterns like:
-        # resource={ type=energy accumulated=12345.0 }
-        country_pattern = rf'country=\s*\{{\s*{country_id}='
-        country_pos = re.search(country_pattern, self.gamestate_content)
-        
-        if country_pos:
-            # Search in a reasonable range after the country definition
-            search_start = country_pos.start()
-            search_end = min(search_start + 500000, len(self.gamestate_content))
-            country_section = self.gamestate_content[search_start:search_end]
-            
-            # Find resource entries
-            resource_pattern = r'type=(\w+)\s+accumulated=([\d.]+)'
-            for match in re.finditer(resource_pattern, country_section):
-                resource_type = match.group(1)
-                amount = float(match.group(2))
-                resources[resource_type] = amount
+        # The stockpile is a flat block of entries like energy=12345.0
+        for match, _ in self.gamestate.finditer(RESOURCE_PATTERN, *span):
+            resource_type = match.group(1).decode('utf-8')
+            amount = float(match.group(2))
+            resources[resource_type] = amount
         
         return resources
     
-    def set_resource(self, resource_type: str, amount: float) -> bool:
-        """Set a specific resource amount"""
-        # Find the player's country
-        player_match = re.search(r'player=\s*\{\s*\{\s*name="[^"]*"\s*country=(\d+)', self.gamestate_content)
-        if not player_match:
-            return False
+    def batch(self) -> EditBatch:
+        """Start a batch of edits that is applied in a single pass"""
+        return EditBatch(self)
+    
+    def _tree_is_current(self) -> bool:
+        """Whether the cached tree still matches the gamestate"""
+        return (self._tree is not None and self._tree[1] is self.gamestate
+                and self._tree[2] == self.gamestate.edit_count)
+    
+    def tree(self) -> CstBlock:
+        """Get the gamestate as a lossless tree for structural edits
         
-        country_id = player_match.group(1)
+        Blocks are parsed on first access. The tree stays valid until some
+        other edit changes the gamestate; hand it to apply_tree() to write
+        its changes back.
+        """
+        if not self._tree_is_current():
+            tree = ClausewitzParser().parse_cst(self.gamestate.text())
+            self._tree = (tree, self.gamestate, self.gamestate.edit_count)
+        return self._tree[0]
+    
+    def apply_tree(self, tree: CstBlock) -> int:
+        """Splice the changes made through tree() into the gamestate
         
-        # Find the resource entry and replace it
-        # Pattern: type=resource_name accumulated=12345.0
-        pattern = rf'(type={resource_type}\s+accumulated=)([\d.]+)'
+        Only dirty entries are re-rendered; everything else (and the
+        compressed blocks holding it) is left alone. Returns the number of
+        replacements made.
+        """
+        if not self._tree_is_current() or tree is not self._tree[0]:
+            raise ValueError("Tree is out of date; get a fresh one from tree() after other edits")
+        
+        edits = list(tree.iter_edits())
+        for start, end, text in reversed(edits):
+            self._replace(start, end, text)
+        self._tree = None
+        return len(edits)
+    
+    def _apply_edits(self, edits: Dict[str, Tuple[str, str]]) -> Dict[str, bool]:
+        """Find every edit target in one scan of the player's stockpile and splice them in
         
-        def replace_func(match):
-            return f'{match.group(1)}{amount}'
+        edits maps a result label to (name, text). Only the first match of
+        each name counts; labels naming the same entry all get the text of
+        the last one queued.
+        """
+        results = {label: False for label in edits}
+        span = self._stockpile_span() if edits else None
+        if span is None:
+            return results
         
-        new_content, count = re.subn(pattern, replace_func, self.gamestate_content, count=1)
+        labels: Dict[bytes, List[str]] = {}
+        texts: Dict[bytes, str] = {}
+        for label, (name, text) in edits.items():
+            name = name.encode('utf-8')
+            labels.setdefault(name, []).append(label)
+            texts[name] = text
+        names = b'|'.join(re.escape(name) for name in labels)
+        pattern = re.compile(EDIT_PATTERN % {b'names': names}, re.MULTILINE)
         
-        if count > 0:
-            self.gamestate_content = new_content
-            return True
+        targets = []
+        for match, offset in self.gamestate.finditer(pattern, *span):
+            name = match.group(1)
+            if name not in texts:
+                continue
+            for label in labels[name]:
+                results[label] = True
+            targets.append((match.start(2) + offset, match.end(2) + offset, texts.pop(name)))
+            if not texts:
+                break
         
-        return False
+        # Splice back to front so earlier offsets stay valid
+        for start, end, text in sorted(targets, reverse=True):
+            self._replace(start, end, text)
+        
+        return results
+    
+    def set_resource(self, resource_type: str, amount: float) -> bool:
+        """Set a resource in the player's stockpile, returning whether it was found"""
+        with self.batch() as batch:
+            label = batch.set_resource(resource_type, amount)
+        return batch.results[label]
+    
+    def _block_span(self, span: Tuple[int, int], keys: Tuple[str, ...]) -> Optional[Tuple[int, int]]:
+        """Get the span of the block reached by following keys down from the block at span"""
+        for key in keys:
+            buffer, offset = self.gamestate.view(*span)
+            for key_token, (kind, start, end) in iter_entries(buffer, span[0] - offset + 1, span[1] - offset):
+                if kind == OPEN and key_token is not None and token_text(buffer, key_token) == key:
+                    span = (start + offset, end + offset)
+                    break
+            else:
+                return None
+        return span
+    
+    def _stockpile_span(self) -> Optional[Tuple[int, int]]:
+        """Get the span of the player's resource stockpile, where unity and influence are kept"""
+        span = self._player_span()
+        return self._block_span(span, STOCKPILE_PATH) if span is not None else None
+    
+    def _get_stat(self, pattern) -> float:
+        """Get a stat value from the player's stockpile"""
+        span = self._stockpile_span()
+        if span is None:
+            return 0
+        found = self.gamestate.search(pattern, *span)
+        return float(found[0].group(1)) if found else 0
     
     def get_unity(self) -> float:
         """Get unity points"""
-        match = re.search(r'^\s*unity=([\d.]+)', self.gamestate_content, re.MULTILINE)
-        return float(match.group(1)) if match else 0
+        return self._get_stat(UNITY_PATTERN)
     
     def set_unity(self, amount: float) -> bool:
         """Set unity points"""
-        pattern = r'(^\s*unity=)([\d.]+)'
-        new_content, count = re.subn(pattern, f'\\g<1>{amount}', self.gamestate_content, count=1, flags=re.MULTILINE)
-        
-        if count > 0:
-            self.gamestate_content = new_content
-            return True
-        return False
+        with self.batch() as batch:
+            label = batch.set_unity(amount)
+        return batch.results[label]
     
     def get_influence(self) -> float:
         """Get influence points"""
-        match = re.search(r'^\s*influence=([\d.]+)', self.gamestate_content, re.MULTILINE)
-        return float(match.group(1)) if match else 0
+        return self._get_stat(INFLUENCE_PATTERN)
     
     def set_influence(self, amount: float) -> bool:
         """Set influence points"""
-        pattern = r'(^\s*influence=)([\d.]+)'
-        new_content, count = re.subn(pattern, f'\\g<1>{amount}', self.gamestate_content, count=1, flags=re.MULTILINE)
-        
-        if count > 0:
-            self.gamestate_content = new_content
-            return True
-        return False
+        with self.batch() as batch:
+            label = batch.set_influence(amount)
+        return batch.results[label]
+    
+    def _tech_index(self) -> Optional[TechIndex]:
+        """Get the player's tech index, rebuilt only when other edits moved the gamestate"""
+        if (self._techs is None or self._techs[1] is not self.gamestate
+                or self._techs[2] != self.gamestate.edit_count):
+            span = self._player_span()
+            techs = TechIndex.build(self.gamestate, span) if span is not None else None
+            self._techs = (techs, self.gamestate, self.gamestate.edit_count)
+        return self._techs[0]
     
-    def get_technologies(self) -> list:
-        """Get unlocked technologies"""
-        techs = []
+    def get_technologies(self) -> List[str]:
+        """Get the player's researched technologies, in save order"""
+        techs = self._tech_index()
+        return list(techs) if techs is not None else []
+    
+    def has_technology(self, tech_id: str) -> bool:
+        """Check whether the player has researched a technology"""
+        techs = self._tech_index()
+        return techs is not None and tech_id in techs
+    
+    def add_technologies(self, tech_ids: List[str]) -> List[str]:
+        """Add technologies to the player's country in a single splice
         
-        # Find technology entries
-        tech_pattern = r'technology="([^"]+)"'
-        for match in re.finditer(tech_pattern, self.gamestate_content):
-            tech = match.group(1)
-            if tech not in techs:
-                techs.append(tech)
+        Ids the player already has, or that repeat an earlier id, are
+        skipped. Returns the ids that were added, in order (empty when the
+        player has no tech_status). Raises ValueError for an id that would
+        not survive being written quoted into the save.
+        """
+        for tech_id in tech_ids:
+            if not TECH_ID_PATTERN.fullmatch(tech_id):
+                raise ValueError(f"Invalid technology id: {tech_id!r}")
         
-        return techs[:50]  # Return first 50 to avoid overwhelming
+        techs = self._tech_index()
+        if techs is None:
+            return []
+        new_ids = [tech_id for tech_id in dict.fromkeys(tech_ids) if tech_id not in techs]
+        if not new_ids:
+            return []
+        
+        text = techs.entries_text(new_ids)
+        self._replace(techs.insert_at, techs.insert_at, text)
+        techs.added(new_ids, len(text.encode('utf-8')))
+        self._techs = (techs, self.gamestate, self.gamestate.edit_count)
+        return new_ids
     
     def add_technology(self, tech_id: str) -> bool:
-        """Add a technology to the player's country"""
-        # Find the player's country tech_status section
-        player_match = re.search(r'player=\s*\{\s*\{\s*name="[^"]*"\s*country=(\d+)', self.gamestate_content)
-        if not player_match:
-            return False
+        """Add a technology to the player's country
         
-        # Find tech_status section and add the technology
-        tech_status_pattern = r'(tech_status=\s*\{\s*technology=\s*\{)'
-        match = re.search(tech_status_pattern, self.gamestate_content)
-        
-        if match:
-            # Insert the new technology after the opening brace
-            insert_pos = match.end()
-            new_tech_entry = f'\n\t\t\ttechnology="{tech_id}"'
-            self.gamestate_content = (
-                self.gamestate_content[:insert_pos] +
-                new_tech_entry +
-                self.gamestate_content[insert_pos:]
-            )
-            return True
-        
-        return False
+        Returns False if the player already has it or has no tech_status.
+        Raises ValueError for an invalid id, as add_technologies() does.
+        """
+        return bool(self.add_technologies([tech_id]))
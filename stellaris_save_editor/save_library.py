@@ -0,0 +1,210 @@
+"""
+Save Library
+Fast save listings from the meta entry alone, cached by path, size and mtime
+"""
+
+import marshal
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from instrumentation import message
+from parse_cache import CACHE_VERSION, DEFAULT_CACHE_DIR
+from parser import ClausewitzParser, gc_paused
+
+DEFAULT_META_CACHE = os.path.join(DEFAULT_CACHE_DIR, 'save_meta.cache')
+
+# Saves a MetaCache remembers before dropping the least recently used
+MAX_CACHED_SAVES = 50000
+
+# Threads reading meta entries during a scan
+SCAN_WORKERS = 8
+
+# meta keys copied into a SaveInfo (see test_data/meta)
+META_FIELDS = ('name', 'date', 'version', 'version_control_revision', 'required_dlcs',
+               'player_portrait', 'meta_fleets', 'meta_planets')
+
+
+class SaveInfo:
+    """What a save's meta entry says, plus the file's size and mtime
+    
+    error is set instead of the meta fields when the file could not be read.
+    """
+    
+    __slots__ = ('path', 'size', 'mtime_ns', 'error') + META_FIELDS
+    
+    def __init__(self, path: str, size: int = 0, mtime_ns: int = 0, error: Optional[str] = None,
+                 **meta):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.error = error
+        for field in META_FIELDS:
+            setattr(self, field, meta.get(field))
+    
+    @classmethod
+    def from_meta(cls, path: str, stat: os.stat_result, meta: Dict[str, Any]) -> 'SaveInfo':
+        """Build from a parsed meta entry"""
+        values = {field: meta.get(field) for field in META_FIELDS}
+        dlcs = values['required_dlcs']
+        if isinstance(dlcs, dict):
+            values['required_dlcs'] = list(dlcs.get('', []))
+        return cls(path, stat.st_size, stat.st_mtime_ns, **values)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+    
+    def __repr__(self) -> str:
+        if self.error:
+            return f"<SaveInfo {self.path!r} error={self.error!r}>"
+        return f"<SaveInfo {self.path!r} {self.name!r} {self.date}>"
+
+
+class MetaCache:
+    """SaveInfos kept in one marshal file, valid while a save's size and mtime are unchanged
+    
+    Lookups are served from memory once the file has been read; call
+    save() to write new entries back. Safe to share between threads.
+    """
+    
+    def __init__(self, path: str = DEFAULT_META_CACHE, max_entries: int = MAX_CACHED_SAVES):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = None
+        self._dirty = False
+        self._lock = threading.Lock()
+    
+    def _load(self) -> 'OrderedDict[str, Dict[str, Any]]':
+        if self._entries is None:
+            entries = {}
+            try:
+                with open(self.path, 'rb') as fp, gc_paused():
+                    version, entries = marshal.load(fp)
+                if version != CACHE_VERSION or not isinstance(entries, dict):
+                    entries = {}
+            except (OSError, EOFError, ValueError, TypeError):
+                entries = {}
+            self._entries = OrderedDict(entries)
+        return self._entries
+    
+    def get(self, path: str, stat: os.stat_result) -> Optional[SaveInfo]:
+        """The cached info for path, or None if missing or the file has changed"""
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(path)
+            if entry is None or (entry['size'], entry['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+                return None
+            entries.move_to_end(path)
+            return SaveInfo(**entry)
+    
+    def put(self, info: SaveInfo):
+        """Remember an info (not written to disk until save())"""
+        with self._lock:
+            entries = self._load()
+            entries[info.path] = info.to_dict()
+            entries.move_to_end(info.path)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._dirty = True
+    
+    def save(self):
+        """Write the cache file if anything changed; failures are reported, not raised"""
+        with self._lock:
+            if not self._dirty:
+                return
+            directory = os.path.dirname(self.path) or '.'
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as fp:
+                        marshal.dump((CACHE_VERSION, dict(self._entries)), fp)
+                    os.replace(tmp_path, self.path)
+                except BaseException:
+                    os.remove(tmp_path)
+                    raise
+            except OSError as e:
+                message(f"Could not write save metadata cache: {e}")
+                return
+            self._dirty = False
+    
+    def clear(self):
+        """Forget every entry, on disk too"""
+        with self._lock:
+            self._entries = OrderedDict()
+            self._dirty = False
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def peek(filepath: str, cache: Optional[MetaCache] = None) -> SaveInfo:
+    """Read a save's empire name, date, version and counts without touching gamestate
+    
+    Only the small meta entry is inflated. With a cache, an unchanged file
+    is answered from it without opening the archive at all. Raises
+    OSError or zipfile.BadZipFile for unreadable files and KeyError when
+    the archive has no meta entry.
+    """
+    path = os.path.abspath(filepath)
+    stat = os.stat(path)
+    if cache is not None:
+        info = cache.get(path, stat)
+        if info is not None:
+            return info
+    
+    with zipfile.ZipFile(path) as zf:
+        meta = zf.read('meta')
+    info = SaveInfo.from_meta(path, stat, ClausewitzParser().parse(meta, parse_all=True))
+    if cache is not None:
+        cache.put(info)
+    return info
+
+
+def _peek_or_error(path: str, cache: Optional[MetaCache]) -> SaveInfo:
+    try:
+        return peek(path, cache)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        return SaveInfo(os.path.abspath(path), error=f"{type(e).__name__}: {e}")
+
+
+def iter_save_paths(directory: str) -> Iterator[str]:
+    """Yield every .sav file below directory, in sorted order"""
+    try:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir():
+            yield from iter_save_paths(entry.path)
+        elif entry.name.endswith('.sav') and entry.is_file():
+            yield entry.path
+
+
+def peek_many(paths: Iterable[str], cache: Optional[MetaCache] = None,
+              workers: int = SCAN_WORKERS) -> Iterator[SaveInfo]:
+    """Peek at several saves at a time, yielding their infos in the order given
+    
+    Files that cannot be read get an info with error set. New entries are
+    written to the cache once every path has been yielded.
+    """
+    paths = list(paths)
+    if workers > 1 and len(paths) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(lambda path: _peek_or_error(path, cache), paths)
+    else:
+        for path in paths:
+            yield _peek_or_error(path, cache)
+    
+    if cache is not None:
+        cache.save()
+
+
+def scan(directory: str, cache: Optional[MetaCache] = None, workers: int = SCAN_WORKERS) -> List[SaveInfo]:
+    """Peek at every save below directory, in path order"""
+    return list(peek_many(iter_save_paths(directory), cache, workers))
@@ -0,0 +1,115 @@
+"""
+Gamestate Section Index
+Offsets of top-level sections and country blocks, built once per load
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from lazy_tree import LazyBlock
+from parser import ClausewitzParser
+from tokenizer import OPEN, iter_entries, token_text
+
+Span = Tuple[int, int]
+
+
+class SectionIndex:
+    """Offset index into a gamestate buffer
+    
+    sections maps every top-level key to the spans of its values (blocks
+    include their braces), countries maps a country id to the exact span of
+    its block, and player_country is the resolved id of the first player.
+    """
+    
+    def __init__(self):
+        self.sections: Dict[str, List[Span]] = {}
+        self.countries: Dict[str, Span] = {}
+        self.player_country: Optional[str] = None
+    
+    @classmethod
+    def build(cls, content, progress: Optional[Callable[[int], None]] = None) -> 'SectionIndex':
+        """Scan the buffer once and index its sections
+        
+        Args:
+            content: The gamestate buffer
+            progress: Called with the offset reached after each section and
+                country; it may raise to abort the scan
+        """
+        index = cls()
+        parser = ClausewitzParser()
+        
+        for key_token, (kind, start, end) in iter_entries(content, stop_at_close=False):
+            if progress is not None:
+                progress(end)
+            if key_token is None:
+                continue
+            key = token_text(content, key_token)
+            index.sections.setdefault(key, []).append((start, end))
+            
+            if key == 'country' and kind == OPEN:
+                for id_token, (child_kind, child_start, child_end) in iter_entries(content, start + 1, end):
+                    if id_token is not None and child_kind == OPEN:
+                        index.countries[token_text(content, id_token)] = (child_start, child_end)
+                    if progress is not None:
+                        progress(child_end)
+            elif key == 'player' and kind == OPEN and index.player_country is None:
+                players = LazyBlock(content, start, end, parser).get('', [])
+                for player in players:
+                    if isinstance(player, LazyBlock) and 'country' in player:
+                        index.player_country = str(player['country'])
+                        break
+        
+        return index
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the index as plain values, for the parse cache"""
+        return {
+            'sections': self.sections,
+            'countries': self.countries,
+            'player_country': self.player_country,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'SectionIndex':
+        """Restore an index saved with to_dict()"""
+        index = cls()
+        index.sections = {key: [tuple(span) for span in spans] for key, spans in data['sections'].items()}
+        index.countries = {key: tuple(span) for key, span in data['countries'].items()}
+        index.player_country = data['player_country']
+        return index
+    
+    def section(self, key: str) -> Optional[Span]:
+        """Get the span of the first top-level value for key"""
+        spans = self.sections.get(key)
+        return spans[0] if spans else None
+    
+    def country_span(self, country_id) -> Optional[Span]:
+        """Get the span of a country's block"""
+        return self.countries.get(str(country_id))
+    
+    def player_span(self) -> Optional[Span]:
+        """Get the span of the player country's block"""
+        if self.player_country is None:
+            return None
+        return self.countries.get(self.player_country)
+    
+    def shift(self, pos: int, delta: int):
+        """Adjust offsets after an edit at pos changed the length by delta
+        
+        Spans starting at or after pos move; spans containing pos grow or
+        shrink. This keeps the index valid without rescanning.
+        """
+        if delta == 0:
+            return
+        
+        def moved(span: Span) -> Span:
+            start, end = span
+            if start >= pos:
+                start += delta
+            if end > pos:
+                end += delta
+            return start, end
+        
+        for key, spans in self.sections.items():
+            self.sections[key] = [moved(span) for span in spans]
+        for country_id, span in self.countries.items():
+            self.countries[country_id] = moved(span)
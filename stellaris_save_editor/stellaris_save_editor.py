@@ -6,8 +6,18 @@ A graphical interface for editing Stellaris save files
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import os
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import add_sink
+from parse_cache import ParseCache
+from progress import OperationCancelled, Progress
 from save_handler import StellarisSaveFile
 
+# How often the UI checks on background work
+POLL_INTERVAL_MS = 100
+
+# Worker threads: one load/save plus the concurrent tab loaders
+WORKER_THREADS = 3
+
 
 class StellarisSaveEditor:
     """Main GUI application for the Stellaris Save Editor"""
@@ -20,7 +30,19 @@ class StellarisSaveEditor:
         self.save_file = None
         self.current_file_path = None
         
+        # Long operations run here so the Tk main loop never blocks
+        self.executor = ThreadPoolExecutor(max_workers=WORKER_THREADS)
+        self.task_progress = None
+        
+        # Phase timings reported while a task runs, shown when it finishes
+        self.task_events = []
+        add_sink(self.record_event)
+        
+        # Reopening a save the cache has seen skips the indexing scan
+        self.parse_cache = ParseCache()
+        
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.exit_app)
     
     def setup_ui(self):
         """Setup the user interface"""
@@ -34,7 +56,7 @@ class StellarisSaveEditor:
         file_menu.add_command(label="Save", command=self.save_file_cmd)
         file_menu.add_command(label="Save As...", command=self.save_as_file)
         file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.root.quit)
+        file_menu.add_command(label="Exit", command=self.exit_app)
         
         help_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Help", menu=help_menu)
@@ -97,6 +119,16 @@ class StellarisSaveEditor:
         # Status bar
         self.status_bar = ttk.Label(self.root, text="Ready", relief=tk.SUNKEN, anchor=tk.W)
         self.status_bar.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        
+        # Progress of background work, shown only while a task runs
+        self.progress_frame = ttk.Frame(self.root, padding=(10, 5))
+        self.progress_frame.grid(row=2, column=0, sticky=(tk.W, tk.E))
+        self.progress_frame.columnconfigure(0, weight=1)
+        self.progress_bar = ttk.Progressbar(self.progress_frame, mode='determinate', maximum=100)
+        self.progress_bar.grid(row=0, column=0, sticky=(tk.W, tk.E), padx=(0, 10))
+        self.cancel_button = ttk.Button(self.progress_frame, text="Cancel", command=self.cancel_task)
+        self.cancel_button.grid(row=0, column=1)
+        self.progress_frame.grid_remove()
     
     def setup_resources_tab(self):
         """Setup the resources editing tab"""
@@ -191,6 +223,80 @@ class StellarisSaveEditor:
         ttk.Label(self.tech_frame, text="Example: tech_battleships, tech_jump_drive, tech_mega_engineering", 
                  foreground="gray", font=('TkDefaultFont', 8)).grid(row=3, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
     
+    def start_task(self, message: str):
+        """Show the progress bar for a background task, or return None if one is running"""
+        if self.task_progress is not None:
+            messagebox.showwarning("Warning", "Please wait for the current operation to finish!")
+            return None
+        
+        self.task_progress = Progress()
+        self.task_events = []
+        self.progress_bar.config(value=0)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.progress_frame.grid()
+        self.status_bar.config(text=message)
+        self.poll_progress(self.task_progress)
+        return self.task_progress
+    
+    def finish_task(self):
+        """Hide the progress bar once a background task is over"""
+        self.task_progress = None
+        self.progress_frame.grid_remove()
+    
+    def record_event(self, event):
+        """Instrumentation sink; called on whichever thread finished the phase"""
+        if event.seconds is not None and self.task_progress is not None:
+            self.task_events.append(event)  # list.append is atomic
+    
+    def task_timings(self) -> str:
+        """The finished task's phases, e.g. ' (inflate 0.4 s, index 0.1 s)'"""
+        if not self.task_events:
+            return ""
+        return " (" + ", ".join(f"{event.name} {event.seconds:.1f} s" for event in self.task_events) + ")"
+    
+    def cancel_task(self):
+        """Ask the running background task to stop"""
+        if self.task_progress is not None:
+            self.task_progress.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.status_bar.config(text="Cancelling...")
+    
+    def poll_progress(self, progress):
+        """Mirror a task's progress into the progress bar until it finishes"""
+        if progress is not self.task_progress:
+            return
+        
+        stage, done, total = progress.snapshot()
+        if total and not progress.cancelled:
+            self.progress_bar.config(value=100 * done / total)
+            self.status_bar.config(text=f"{stage}: {done / 1024 / 1024:.1f} of {total / 1024 / 1024:.1f} MB")
+        self.root.after(POLL_INTERVAL_MS, self.poll_progress, progress)
+    
+    def run_in_background(self, func, on_success, on_error):
+        """Run func on the worker pool and hand its result to the Tk thread
+        
+        The future is checked with root.after, so callbacks always run on the
+        main thread and the UI keeps responding meanwhile.
+        """
+        future = self.executor.submit(func)
+        
+        def check():
+            if not future.done():
+                self.root.after(POLL_INTERVAL_MS, check)
+            elif future.exception() is not None:
+                on_error(future.exception())
+            else:
+                on_success(future.result())
+        
+        self.root.after(POLL_INTERVAL_MS, check)
+    
+    def require_idle(self) -> bool:
+        """Check no background task is using the save file before editing it"""
+        if self.task_progress is not None:
+            messagebox.showwarning("Warning", "Please wait for the current operation to finish!")
+            return False
+        return True
+    
     def open_file(self):
         """Open a save file"""
         filename = filedialog.askopenfilename(
@@ -199,74 +305,127 @@ class StellarisSaveEditor:
         )
         
         if filename:
-            try:
-                self.status_bar.config(text="Loading save file...")
-                self.root.update()
-                
-                self.save_file = StellarisSaveFile(filename)
-                self.current_file_path = filename
-                
-                # Update UI
-                self.file_label.config(text=os.path.basename(filename), foreground="black")
-                self.empire_label.config(text=self.save_file.get_empire_name(), foreground="black")
-                self.date_label.config(text=self.save_file.get_game_date(), foreground="black")
-                
-                # Load resources
-                self.load_resources()
-                self.load_empire_stats()
-                self.load_technologies()
-                
-                self.status_bar.config(text=f"Loaded: {os.path.basename(filename)}")
-                messagebox.showinfo("Success", "Save file loaded successfully!")
-                
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to load save file:\n{str(e)}")
-                self.status_bar.config(text="Error loading file")
+            self.load_file(filename, "Save file loaded successfully!")
+    
+    def load_file(self, filename, success_message):
+        """Load, inflate and index a save file on a worker thread, then fill the tabs"""
+        progress = self.start_task("Loading save file...")
+        if progress is None:
+            return
+        
+        def load():
+            save_file = StellarisSaveFile()
+            save_file.load(filename, progress=progress, cache=self.parse_cache)
+            return save_file
+        
+        def loaded(save_file):
+            if progress.cancelled:
+                failed(OperationCancelled("Loading cancelled"))
+                return
+            self.save_file = save_file
+            self.current_file_path = filename
+            
+            # Update UI
+            self.file_label.config(text=os.path.basename(filename), foreground="black")
+            self.empire_label.config(text=self.save_file.get_empire_name(), foreground="black")
+            self.date_label.config(text=self.save_file.get_game_date(), foreground="black")
+            
+            # The index is ready, so the tabs can be filled concurrently
+            progress.update("Reading empire data", 0, 0)
+            self.cancel_button.config(state=tk.DISABLED)
+            self.progress_bar.config(mode='indeterminate')
+            self.progress_bar.start()
+            self.status_bar.config(text="Reading empire data...")
+            self.refresh_views(finished)
+        
+        def finished():
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate')
+            timings = self.task_timings()
+            self.finish_task()
+            self.status_bar.config(text=f"Loaded: {os.path.basename(filename)}{timings}")
+            messagebox.showinfo("Success", success_message)
+        
+        def failed(error):
+            self.finish_task()
+            if isinstance(error, OperationCancelled):
+                self.status_bar.config(text="Loading cancelled")
+                return
+            messagebox.showerror("Error", f"Failed to load save file:\n{str(error)}")
+            self.status_bar.config(text="Error loading file")
+        
+        self.run_in_background(load, loaded, failed)
     
     def reload_file(self):
         """Reload the current file"""
         if self.current_file_path:
-            try:
-                self.save_file.load(self.current_file_path)
-                self.load_resources()
-                self.load_empire_stats()
-                self.load_technologies()
-                self.status_bar.config(text="File reloaded")
-                messagebox.showinfo("Success", "Save file reloaded!")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to reload file:\n{str(e)}")
-    
-    def load_resources(self):
-        """Load resources into the UI"""
+            self.load_file(self.current_file_path, "Save file reloaded!")
+    
+    def refresh_views(self, on_done=None):
+        """Read resources, empire stats and technologies concurrently into the tabs"""
+        loaders = [self.load_resources, self.load_empire_stats, self.load_technologies]
+        remaining = [len(loaders)]
+        
+        def one_done():
+            remaining[0] -= 1
+            if remaining[0] == 0 and on_done is not None:
+                on_done()
+        
+        for loader in loaders:
+            loader(one_done)
+    
+    def _load_view(self, read, show, on_done=None):
+        """Run read() in the background and pass its result to show()"""
         if not self.save_file:
             return
         
-        resources = self.save_file.get_resources()
+        def shown(result):
+            show(result)
+            if on_done is not None:
+                on_done()
+        
+        def failed(error):
+            messagebox.showerror("Error", f"Failed to read save file:\n{str(error)}")
+            if on_done is not None:
+                on_done()
+        
+        self.run_in_background(read, shown, failed)
+    
+    def load_resources(self, on_done=None):
+        """Load resources into the UI"""
+        save_file = self.save_file
+        self._load_view(lambda: save_file.get_resources(), self.show_resources, on_done)
+    
+    def show_resources(self, resources):
+        """Fill the resource entries"""
         for res_id, entry in self.resource_entries.items():
             value = resources.get(res_id, 0)
             entry.delete(0, tk.END)
             entry.insert(0, str(int(value)))
     
-    def load_empire_stats(self):
+    def load_empire_stats(self, on_done=None):
         """Load empire statistics into the UI"""
-        if not self.save_file:
-            return
-        
-        unity = self.save_file.get_unity()
+        save_file = self.save_file
+        self._load_view(lambda: (save_file.get_unity(), save_file.get_influence()),
+                        self.show_empire_stats, on_done)
+    
+    def show_empire_stats(self, stats):
+        """Fill the unity and influence entries"""
+        unity, influence = stats
         self.unity_entry.delete(0, tk.END)
         self.unity_entry.insert(0, str(int(unity)))
         
-        influence = self.save_file.get_influence()
         self.influence_entry.delete(0, tk.END)
         self.influence_entry.insert(0, str(int(influence)))
     
-    def load_technologies(self):
+    def load_technologies(self, on_done=None):
         """Load technologies into the UI"""
-        if not self.save_file:
-            return
-        
+        save_file = self.save_file
+        self._load_view(lambda: save_file.get_technologies(), self.show_technologies, on_done)
+    
+    def show_technologies(self, techs):
+        """Fill the technology list"""
         self.tech_listbox.delete(0, tk.END)
-        techs = self.save_file.get_technologies()
         for tech in techs:
             self.tech_listbox.insert(tk.END, tech)
     
@@ -276,11 +435,16 @@ class StellarisSaveEditor:
             messagebox.showwarning("Warning", "Please load a save file first!")
             return
         
+        if not self.require_idle():
+            return
+        
         entry = self.resource_entries[resource_id]
         try:
             value = float(entry.get())
-            self.save_file.set_resource(resource_id, value)
-            self.status_bar.config(text=f"Updated {resource_id} to {value}")
+            if self.save_file.set_resource(resource_id, value):
+                self.status_bar.config(text=f"Updated {resource_id} to {value}")
+            else:
+                messagebox.showerror("Error", f"{resource_id} was not found in the empire's stockpile!")
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid number!")
     
@@ -290,13 +454,26 @@ class StellarisSaveEditor:
             messagebox.showwarning("Warning", "Please load a save file first!")
             return
         
+        if not self.require_idle():
+            return
+        
         try:
-            for res_id, entry in self.resource_entries.items():
-                value = float(entry.get())
-                self.save_file.set_resource(res_id, value)
+            values = {res_id: float(entry.get()) for res_id, entry in self.resource_entries.items()}
             
-            self.status_bar.config(text="All resources updated")
-            messagebox.showinfo("Success", "All resources have been updated!")
+            with self.save_file.batch() as batch:
+                for res_id, value in values.items():
+                    batch.set_resource(res_id, value)
+            
+            missing = [res_id for res_id in values if not batch.results[f'resource:{res_id}']]
+            updated = len(values) - len(missing)
+            self.status_bar.config(text=f"Updated {updated} of {len(values)} resources")
+            if not updated:
+                messagebox.showerror("Error", "No resources were updated; none were found in the empire's stockpile!")
+            elif missing:
+                messagebox.showwarning("Warning", f"Updated {updated} of {len(values)} resources.\n\n"
+                                       f"Not in the empire's stockpile: {', '.join(missing)}")
+            else:
+                messagebox.showinfo("Success", "All resources have been updated!")
         except ValueError:
             messagebox.showerror("Error", "Please enter valid numbers for all resources!")
     
@@ -306,6 +483,9 @@ class StellarisSaveEditor:
             messagebox.showwarning("Warning", "Please load a save file first!")
             return
         
+        if not self.require_idle():
+            return
+        
         try:
             value = float(self.unity_entry.get())
             self.save_file.set_unity(value)
@@ -319,6 +499,9 @@ class StellarisSaveEditor:
             messagebox.showwarning("Warning", "Please load a save file first!")
             return
         
+        if not self.require_idle():
+            return
+        
         try:
             value = float(self.influence_entry.get())
             self.save_file.set_influence(value)
@@ -332,12 +515,16 @@ class StellarisSaveEditor:
             messagebox.showwarning("Warning", "Please load a save file first!")
             return
         
+        if not self.require_idle():
+            return
+        
         try:
             unity = float(self.unity_entry.get())
             influence = float(self.influence_entry.get())
             
-            self.save_file.set_unity(unity)
-            self.save_file.set_influence(influence)
+            with self.save_file.batch() as batch:
+                batch.set_unity(unity)
+                batch.set_influence(influence)
             
             self.status_bar.config(text="Empire statistics updated")
             messagebox.showinfo("Success", "Empire statistics have been updated!")
@@ -350,12 +537,21 @@ class StellarisSaveEditor:
             messagebox.showwarning("Warning", "Please load a save file first!")
             return
         
+        if not self.require_idle():
+            return
+        
         tech_id = self.tech_entry.get().strip()
         if not tech_id:
             messagebox.showwarning("Warning", "Please enter a technology ID!")
             return
         
-        if self.save_file.add_technology(tech_id):
+        try:
+            added = self.save_file.add_technology(tech_id)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        if added:
             self.tech_listbox.insert(tk.END, tech_id)
             self.tech_entry.delete(0, tk.END)
             self.status_bar.config(text=f"Added technology: {tech_id}")
@@ -368,12 +564,7 @@ class StellarisSaveEditor:
             messagebox.showwarning("Warning", "Please load a save file first!")
             return
         
-        try:
-            self.save_file.save()
-            self.status_bar.config(text="Save file saved successfully")
-            messagebox.showinfo("Success", "Save file has been saved!\n\nA backup was created with .backup extension.")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to save file:\n{str(e)}")
+        self.save_in_background(None, "Save file has been saved!\n\nA backup was created with .backup extension.")
     
     def save_as_file(self):
         """Save as a new file"""
@@ -388,14 +579,42 @@ class StellarisSaveEditor:
         )
         
         if filename:
-            try:
-                self.save_file.save(filename)
+            self.save_in_background(filename, "Save file has been saved!")
+    
+    def save_in_background(self, filename, success_message):
+        """Compress and write the save on a worker thread"""
+        progress = self.start_task("Saving...")
+        if progress is None:
+            return
+        
+        save_file = self.save_file
+        
+        def saved(_):
+            timings = self.task_timings()
+            self.finish_task()
+            if filename:
                 self.current_file_path = filename
                 self.file_label.config(text=os.path.basename(filename))
-                self.status_bar.config(text=f"Saved as: {os.path.basename(filename)}")
-                messagebox.showinfo("Success", "Save file has been saved!")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to save file:\n{str(e)}")
+                self.status_bar.config(text=f"Saved as: {os.path.basename(filename)}{timings}")
+            else:
+                self.status_bar.config(text=f"Save file saved successfully{timings}")
+            messagebox.showinfo("Success", success_message)
+        
+        def failed(error):
+            self.finish_task()
+            if isinstance(error, OperationCancelled):
+                self.status_bar.config(text="Save cancelled, existing file left unchanged")
+                return
+            messagebox.showerror("Error", f"Failed to save file:\n{str(error)}")
+        
+        self.run_in_background(lambda: save_file.save(filename, progress=progress), saved, failed)
+    
+    def exit_app(self):
+        """Cancel any background task and close the window"""
+        if self.task_progress is not None:
+            self.task_progress.cancel()
+        self.executor.shutdown(wait=False)
+        self.root.quit()
     
     def show_about(self):
         """Show about dialog"""
@@ -0,0 +1,79 @@
+"""
+Symbol Table
+Interned keys and identifier values, each with a small integer id
+"""
+
+import sys
+from typing import Dict, Iterator, List, Optional
+
+from tokenizer import Token, token_text
+
+# Quoted values longer than this are treated as free text, not identifiers
+MAX_SYMBOL_LENGTH = 64
+
+
+class SymbolTable:
+    """Per-parse table of interned names
+    
+    Every key (and every identifier-like value) is stored once, as the same
+    object Python uses for an identical string literal, so trees share one
+    str per distinct key and dict lookups hit the identity fast path. Each
+    name also gets a small integer id (in order of first appearance, ''
+    is 0) that indexes can compare instead of strings.
+    """
+    
+    def __init__(self):
+        self.names: List[str] = ['']
+        self._ids: Dict[str, int] = {'': 0}
+        self._raw: Dict[object, str] = {}
+    
+    def __len__(self) -> int:
+        return len(self.names)
+    
+    def __contains__(self, name) -> bool:
+        return name in self._ids
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+    
+    def intern(self, name: str) -> str:
+        """Get the shared copy of name, adding it to the table if needed"""
+        symbol_id = self._ids.get(name)
+        if symbol_id is not None:
+            return self.names[symbol_id]
+        name = sys.intern(name)
+        self._ids[name] = len(self.names)
+        self.names.append(name)
+        return name
+    
+    def id_of(self, name: str) -> int:
+        """Get the id of name, adding it to the table if needed"""
+        symbol_id = self._ids.get(name)
+        if symbol_id is None:
+            self.intern(name)
+            symbol_id = len(self.names) - 1
+        return symbol_id
+    
+    def lookup(self, name: str) -> Optional[int]:
+        """Get the id of name, or None if it never appeared"""
+        return self._ids.get(name)
+    
+    def name(self, symbol_id: int) -> str:
+        """Get the name for an id"""
+        return self.names[symbol_id]
+    
+    def text(self, buffer, token: Token) -> str:
+        """Get the interned text of a token
+        
+        The raw source slice is remembered, so repeats skip decoding and
+        quote stripping entirely.
+        """
+        raw = buffer[token[1]:token[2]]
+        name = self._raw.get(raw)
+        if name is None:
+            name = self._raw[raw] = self.intern(token_text(buffer, token))
+        return name
+    
+    def token_id(self, buffer, token: Token) -> int:
+        """Get the id of a token's text, adding it if needed"""
+        return self._ids[self.text(buffer, token)]
@@ -0,0 +1,88 @@
+"""
+Technology Index
+A country's researched technologies, read from its tech_status block
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from piece_table import PieceTable
+from tokenizer import OPEN, iter_entries, token_text
+
+Span = Tuple[int, int]
+
+# Indentation of tech_status entries in a country block of a saved game
+DEFAULT_INDENT = '\t\t\t'
+
+
+class TechIndex:
+    """Ordered set of the technologies in one country's tech_status
+    
+    Only direct technology= entries count; the research queues and
+    potential techs nested deeper are not researched. insert_at is the
+    offset just after the last technology or level entry, so a new
+    technology="..." level=1 pair keeps both lists paired by position.
+    Offsets are document offsets into the gamestate the index was built from.
+    """
+    
+    def __init__(self, span: Span, insert_at: int, indent: str = DEFAULT_INDENT):
+        self.span = span
+        self.insert_at = insert_at
+        self.indent = indent
+        self.techs: Dict[str, None] = {}
+    
+    def __contains__(self, tech_id: str) -> bool:
+        return tech_id in self.techs
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.techs)
+    
+    def __len__(self) -> int:
+        return len(self.techs)
+    
+    @classmethod
+    def build(cls, gamestate: PieceTable, country_span: Span) -> Optional['TechIndex']:
+        """Index the tech_status of the country block at country_span, or None if it has none"""
+        buffer, offset = gamestate.view(*country_span)
+        start, end = country_span[0] - offset, country_span[1] - offset
+        for key_token, (kind, block_start, block_end) in iter_entries(buffer, start + 1, end):
+            if kind == OPEN and key_token is not None and token_text(buffer, key_token) == 'tech_status':
+                return cls._from_block(buffer, block_start, block_end, offset)
+        return None
+    
+    @classmethod
+    def _from_block(cls, buffer, start: int, end: int, offset: int) -> 'TechIndex':
+        index = cls((start + offset, end + offset), start + 1 + offset)
+        indent = None
+        for key_token, value in iter_entries(buffer, start + 1, end):
+            key = token_text(buffer, key_token) if key_token is not None else ''
+            if key == 'technology' and value[0] != OPEN:
+                index.techs[token_text(buffer, value)] = None
+                if indent is None:
+                    indent = _indent(buffer, key_token[1])
+            elif key != 'level':
+                continue
+            index.insert_at = value[2] + offset
+        if indent:
+            index.indent = indent
+        return index
+    
+    def entries_text(self, tech_ids: Iterable[str]) -> str:
+        """The technology="..." level=1 lines that add tech_ids at insert_at"""
+        return ''.join(f'\n{self.indent}technology="{tech_id}"\n{self.indent}level=1'
+                       for tech_id in tech_ids)
+    
+    def added(self, tech_ids: List[str], nbytes: int):
+        """Record that nbytes of entries for tech_ids were inserted at insert_at"""
+        self.techs.update(dict.fromkeys(tech_ids))
+        self.insert_at += nbytes
+        self.span = (self.span[0], self.span[1] + nbytes)
+
+
+def _indent(buffer, pos: int) -> Optional[str]:
+    """The whitespace between the start of pos's line and pos, if nothing else is there"""
+    newline = '\n' if isinstance(buffer, str) else b'\n'
+    line_start = buffer.rfind(newline, 0, pos) + 1
+    text = buffer[line_start:pos]
+    if not isinstance(text, str):
+        text = text.decode('utf-8', errors='replace')
+    return text if not text.strip() else None
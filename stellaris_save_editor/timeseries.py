@@ -0,0 +1,247 @@
+"""
+Campaign Time Series
+Metrics extracted from a campaign's saves into columns indexed by game date
+"""
+
+import csv
+import json
+import math
+import os
+import struct
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from instrumentation import message
+from parse_cache import ParseCache
+from save_handler import StellarisSaveFile
+from save_library import iter_save_paths
+
+# name -> query path. {country} expands to one column per country, named
+# like military_power[3]; several numeric results are summed.
+ECONOMY = 'country/{player}/modules/standard_economy_module/resources/'
+DEFAULT_METRICS = {
+    'energy': ECONOMY + 'energy',
+    'minerals': ECONOMY + 'minerals',
+    'food': ECONOMY + 'food',
+    'alloys': ECONOMY + 'alloys',
+    'consumer_goods': ECONOMY + 'consumer_goods',
+    'unity': ECONOMY + 'unity',
+    'influence': ECONOMY + 'influence',
+    'military_power': 'country/{country}/military_power',
+    'economy_power': 'country/{country}/economy_power',
+}
+
+# Start of a binary store; a little-endian uint32 header length follows
+STORE_MAGIC = b'STLTS1\n'
+
+Source = Tuple[int, int, str]  # size, mtime_ns, game date
+
+
+def extract_save(path: str, metrics: Dict[str, str], cache_dir: Optional[str] = None) -> Tuple[str, Dict[str, float]]:
+    """Read one save's game date and metric values; runs in a worker process"""
+    cache = ParseCache(cache_dir) if cache_dir else None
+    save = StellarisSaveFile(path, cache=cache)
+    try:
+        values = {}
+        for name, query in metrics.items():
+            if '{country}' in query:
+                for country_id in save.index.countries:
+                    value = _total(save.query(query, country=country_id))
+                    if not math.isnan(value):
+                        values[f"{name}[{country_id}]"] = value
+            else:
+                values[name] = _total(save.query(query))
+        return save.get_game_date(), values
+    finally:
+        save.close()
+
+
+def _total(results: List[Any]) -> float:
+    """Sum of the numeric results, or NaN if there are none"""
+    numbers = [value for value in results if type(value) in (int, float)]
+    return float(sum(numbers)) if numbers else math.nan
+
+
+def _extract_job(path: str, metrics: Dict[str, str], cache_dir: Optional[str]):
+    """extract_save() that reports failures instead of raising"""
+    try:
+        stat = os.stat(path)
+        date, values = extract_save(path, metrics, cache_dir)
+        return path, (stat.st_size, stat.st_mtime_ns, date), values, None
+    except Exception as e:
+        return path, None, None, f"{type(e).__name__}: {e}"
+
+
+class Campaign:
+    """Metric columns over game dates, built up one save at a time
+    
+    Each save contributes the row for its game date (the newest file wins
+    when two share a date). columns() gives one array('d') per metric,
+    aligned with dates(), with NaN where a save had no value; array('d')
+    supports the buffer protocol, so numpy.frombuffer() can wrap a column
+    without copying. sources remembers each file's size and mtime so
+    update() only reads new or changed saves.
+    """
+    
+    def __init__(self, metrics: Optional[Dict[str, str]] = None):
+        self.metrics = dict(metrics if metrics is not None else DEFAULT_METRICS)
+        self.sources: Dict[str, Source] = {}
+        self._rows: Dict[str, Dict[str, float]] = {}
+        self._row_mtime: Dict[str, int] = {}
+        self._columns = None
+    
+    def __len__(self) -> int:
+        return len(self._rows)
+    
+    def add(self, path: str, source: Source, values: Dict[str, float]):
+        """Record a save's values as the row for its date"""
+        size, mtime_ns, date = source
+        self.sources[path] = source
+        if self._row_mtime.get(date, -1) <= mtime_ns:
+            self._rows[date] = values
+            self._row_mtime[date] = mtime_ns
+            self._columns = None
+    
+    def pending(self, paths: Iterable[str]) -> List[str]:
+        """The paths not yet read, or changed since they were"""
+        todo = []
+        for path in map(os.path.abspath, paths):
+            known = self.sources.get(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known is None or known[:2] != (stat.st_size, stat.st_mtime_ns):
+                todo.append(path)
+        return todo
+    
+    def update(self, paths: Iterable[str], jobs: Optional[int] = None, cache_dir: Optional[str] = None) -> int:
+        """Read the new or changed saves among paths, several processes at once
+        
+        Saves that fail to load are reported and left out, so the next
+        update tries them again. Returns the number of saves added.
+        """
+        todo = self.pending(paths)
+        jobs = min(jobs or os.cpu_count() or 1, len(todo))
+        if jobs < 2:
+            results = (_extract_job(path, self.metrics, cache_dir) for path in todo)
+            return self._collect(results)
+        
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_extract_job, path, self.metrics, cache_dir) for path in todo]
+            return self._collect(future.result() for future in as_completed(futures))
+    
+    def _collect(self, results) -> int:
+        added = 0
+        for path, source, values, error in results:
+            if error is not None:
+                message(f"Skipped {path}: {error}")
+                continue
+            self.add(path, source, values)
+            added += 1
+        return added
+    
+    def dates(self) -> List[str]:
+        """Game dates of the rows, in order"""
+        return sorted(self._rows)
+    
+    def columns(self) -> Dict[str, array]:
+        """One array('d') per metric column, aligned with dates()"""
+        if self._columns is None:
+            dates = self.dates()
+            # Metric order, then countries as they first appear
+            names = list(dict.fromkeys(name for date in dates for name in self._rows[date]))
+            self._columns = {
+                name: array('d', (self._rows[date].get(name, math.nan) for date in dates))
+                for name in names
+            }
+        return self._columns
+    
+    def write_csv(self, fp):
+        """Write a date column plus one column per metric to a text stream; missing values are empty"""
+        columns = self.columns()
+        writer = csv.writer(fp)
+        writer.writerow(['date'] + list(columns))
+        for i, date in enumerate(self.dates()):
+            writer.writerow([date] + ['' if math.isnan(column[i]) else repr(column[i])
+                                      for column in columns.values()])
+    
+    def to_csv(self, path: str):
+        """Write the columns to a CSV file"""
+        with open(path, 'w', newline='', encoding='utf-8') as fp:
+            self.write_csv(fp)
+    
+    def save(self, path: str):
+        """Write a binary store: a JSON header, then each column as little-endian float64"""
+        columns = self.columns()
+        header = json.dumps({
+            'metrics': self.metrics,
+            'dates': self.dates(),
+            'columns': list(columns),
+            'row_mtime': [self._row_mtime[date] for date in self.dates()],
+            'sources': self.sources,
+        }).encode('utf-8')
+        
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(STORE_MAGIC)
+            fp.write(struct.pack('<I', len(header)))
+            fp.write(header)
+            for column in columns.values():
+                if sys.byteorder == 'big':
+                    column = array('d', column)
+                    column.byteswap()
+                column.tofile(fp)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str) -> 'Campaign':
+        """Read a store written by save()"""
+        with open(path, 'rb') as fp:
+            if fp.read(len(STORE_MAGIC)) != STORE_MAGIC:
+                raise ValueError(f"{path} is not a campaign time series store")
+            (length,) = struct.unpack('<I', fp.read(4))
+            header = json.loads(fp.read(length))
+            campaign = cls(header['metrics'])
+            campaign.sources = {path: tuple(source) for path, source in header['sources'].items()}
+            
+            dates = header['dates']
+            rows = {date: {} for date in dates}
+            for name in header['columns']:
+                column = array('d')
+                column.fromfile(fp, len(dates))
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                for date, value in zip(dates, column):
+                    if not math.isnan(value):
+                        rows[date][name] = value
+        
+        campaign._rows = rows
+        campaign._row_mtime = dict(zip(dates, header['row_mtime']))
+        return campaign
+
+
+def extract(directory: str, metrics: Optional[Dict[str, str]] = None, store: Optional[str] = None,
+            jobs: Optional[int] = None, cache_dir: Optional[str] = None) -> Campaign:
+    """Build (or bring up to date) the time series of every save below directory
+    
+    With store, earlier results are loaded from it when they were taken
+    with the same metrics, only saves added or changed since are read, and
+    the store is rewritten.
+    """
+    campaign = None
+    if store is not None and os.path.exists(store):
+        campaign = Campaign.load(store)
+        if metrics is not None and campaign.metrics != metrics:
+            message(f"Metrics differ from {store}; extracting every save again")
+            campaign = None
+    if campaign is None:
+        campaign = Campaign(metrics)
+    
+    added = campaign.update(iter_save_paths(directory), jobs, cache_dir)
+    message(f"Read {added} new save(s); {len(campaign)} dates in total")
+    if store is not None and added:
+        campaign.save(store)
+    return campaign
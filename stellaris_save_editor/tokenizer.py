@@ -0,0 +1,257 @@
+"""
+Clausewitz Tokenizer
+Single-pass scanner for Clausewitz engine text (str or bytes buffers)
+"""
+
+import re
+from typing import Iterator, Optional, Tuple
+
+# Token kinds - each is the index of its group in the master pattern
+OPEN = 1
+CLOSE = 2
+EQUALS = 3
+STRING = 4
+COMMENT = 5
+ATOM = 6
+
+Token = Tuple[int, int, int]
+
+# Master alternation, one group per token kind. Leading whitespace is
+# consumed inside the match so the engine never retries the alternation at
+# every blank position; token offsets come from the group span.
+_TOKEN_PATTERN = (
+    r'\s*(?:'
+    r'(\{)'
+    r'|(\})'
+    r'|(=)'
+    r'|("[^"\\]*(?:\\.[^"\\]*)*"?)'
+    r'|(#[^\n]*)'
+    r'|([^\s{}="#]+)'
+    r'|\Z'
+    r')'
+)
+
+# Only the tokens that affect brace depth; everything else is skipped by a
+# single character-class run. The trailing \Z alternatives stop the engine
+# from backtracking through a final run that holds no token.
+_STRUCTURE_PATTERN = r'[^{}"#]*(?:(\{)|(\})|"[^"\\]*(?:\\.[^"\\]*)*"?|#[^\n]*|\Z)'
+
+_TOKEN_RE = re.compile(_TOKEN_PATTERN, re.DOTALL)
+_TOKEN_RE_BYTES = re.compile(_TOKEN_PATTERN.encode('ascii'), re.DOTALL)
+_STRUCTURE_RE = re.compile(_STRUCTURE_PATTERN, re.DOTALL)
+_STRUCTURE_RE_BYTES = re.compile(_STRUCTURE_PATTERN.encode('ascii'), re.DOTALL)
+
+
+class ParseError(ValueError):
+    """Malformed input that a tree cannot be built from"""
+    
+    def __init__(self, message: str, offset: int):
+        super().__init__(message, offset)
+        self.message = message
+        self.offset = offset
+    
+    def __str__(self) -> str:
+        return f"{self.message} (at offset {self.offset})"
+
+
+def token_pattern(buffer) -> 're.Pattern':
+    """Get the compiled token pattern for a buffer's type
+    
+    For hot loops that read match objects directly: lastindex is the token
+    kind (None at the end of the buffer) and match.start(kind) its start.
+    """
+    return _TOKEN_RE if isinstance(buffer, str) else _TOKEN_RE_BYTES
+
+
+def tokenize(buffer, start: int = 0, end: Optional[int] = None,
+             comments: bool = False) -> Iterator[Token]:
+    """Yield (kind, start, end) tokens from buffer[start:end]
+    
+    The buffer is never sliced; offsets are absolute positions in it.
+    """
+    if end is None:
+        end = len(buffer)
+    
+    for match in token_pattern(buffer).finditer(buffer, start, end):
+        kind = match.lastindex
+        if kind is None or (kind == COMMENT and not comments):
+            continue
+        yield kind, match.start(kind), match.end()
+
+
+def token_text(buffer, token: Token) -> str:
+    """Get the text of a token as str, without the quotes of a STRING
+    
+    Tokens from bytes or mmap buffers are decoded as UTF-8.
+    """
+    kind, start, end = token
+    if kind == STRING:
+        start += 1
+        if end > start and buffer[end - 1:end] in ('"', b'"'):
+            end -= 1
+    text = buffer[start:end]
+    if not isinstance(text, str):
+        text = text.decode('utf-8', errors='replace')
+    return text
+
+
+def find_block_end(buffer, open_pos: int, end: Optional[int] = None) -> int:
+    """Return the offset just past the '}' matching the '{' at open_pos
+    
+    An unterminated block runs to the end of the buffer.
+    """
+    if end is None:
+        end = len(buffer)
+    pattern = _STRUCTURE_RE if isinstance(buffer, str) else _STRUCTURE_RE_BYTES
+    
+    depth = 0
+    for match in pattern.finditer(buffer, open_pos, end):
+        kind = match.lastindex
+        if kind == OPEN:
+            depth += 1
+        elif kind == CLOSE:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return end
+
+
+def iter_entries(buffer, start: int = 0, end: Optional[int] = None,
+                 stop_at_close: bool = True) -> Iterator[Tuple[Optional[Token], Token]]:
+    """Yield (key_token, value_token) pairs for one nesting level
+    
+    Nested blocks are skipped with find_block_end() and reported as a single
+    OPEN token spanning the whole block. key_token is None for bare values
+    and anonymous blocks. Scanning stops at the '}' closing the level unless
+    stop_at_close is False (top level of a file, where a stray '}' is skipped).
+    """
+    if end is None:
+        end = len(buffer)
+    pattern = token_pattern(buffer)
+    
+    pending = None
+    key = None
+    pos = start
+    while True:
+        match = pattern.match(buffer, pos, end)
+        if match is None or match.lastindex is None:
+            break
+        kind = match.lastindex
+        pos = match.end()
+        
+        if kind == CLOSE:
+            if stop_at_close:
+                break
+            continue
+        
+        if kind == COMMENT:
+            continue
+        if kind == EQUALS:
+            if pending is not None:
+                key, pending = pending, None
+            continue
+        
+        if pending is not None:
+            yield None, pending
+            pending = None
+        
+        if kind == OPEN:
+            block_start = match.start(kind)
+            pos = find_block_end(buffer, block_start, end)
+            yield key, (OPEN, block_start, pos)
+            key = None
+        elif key is not None:
+            yield key, (kind, match.start(kind), pos)
+            key = None
+        else:
+            pending = (kind, match.start(kind), pos)
+    
+    if pending is not None:
+        yield None, pending
+
+
+class TreeBuilder:
+    """Callbacks that build_tree() drives to assemble a parse tree
+    
+    key(buffer, token) returns what a key token is stored as (a plain
+    attribute is fine, e.g. a symbol table's bound method). scalar(key,
+    token) adds a value token, with key None for bare list values;
+    open(key, start) begins a block whose '{' is at start, and close(end)
+    ends the innermost open block just past end.
+    """
+    
+    def key(self, buffer, token: Token):
+        raise NotImplementedError
+    
+    def scalar(self, key, token: Token):
+        raise NotImplementedError
+    
+    def open(self, key, start: int):
+        raise NotImplementedError
+    
+    def close(self, end: int):
+        raise NotImplementedError
+
+
+def build_tree(buffer, builder: TreeBuilder, max_depth: int, depth: int = 0,
+               stop_at_close: bool = True) -> int:
+    """Walk every token of buffer once, reporting entries to builder
+    
+    A value followed by '=' becomes the key of the next value; any other
+    value is a bare list value. depth is the nesting level buffer sits at,
+    for a piece cut out of a larger document, and opening a block beyond
+    max_depth raises ParseError. A stray '}' ends the document, or with
+    stop_at_close False is skipped; unterminated blocks are closed at the
+    end of the buffer. Returns where the document ends.
+    """
+    key_of = builder.key
+    scalar = builder.scalar
+    open_block = builder.open
+    close_block = builder.close
+    level = depth
+    key = None
+    pending = None  # value token that becomes a key if '=' follows
+    end = len(buffer)
+    
+    for match in token_pattern(buffer).finditer(buffer):
+        kind = match.lastindex
+        if kind is None or kind == COMMENT:
+            continue
+        if kind == EQUALS:
+            if pending is not None:
+                key = key_of(buffer, pending)
+                pending = None
+            continue
+        
+        # Anything else means the pending token was a bare list value
+        if pending is not None:
+            scalar(None, pending)
+            pending = None
+        
+        if kind == OPEN:
+            if level >= max_depth:
+                raise ParseError(f"Blocks nested deeper than {max_depth} levels", match.start(kind))
+            open_block(key, match.start(kind))
+            level += 1
+            key = None
+        elif kind == CLOSE:
+            key = None  # a key left without a value inside the block is dropped
+            if level > depth:
+                close_block(match.end())
+                level -= 1
+            elif stop_at_close:
+                end = match.start(kind)
+                break
+        elif key is not None:
+            scalar(key, (kind, match.start(kind), match.end()))
+            key = None
+        else:
+            pending = (kind, match.start(kind), match.end())
+    
+    if pending is not None:
+        scalar(None, pending)
+    
+    # Unterminated blocks run to the end of the buffer
+    for _ in range(level - depth):
+        close_block(len(buffer))
+    return end
@@ -0,0 +1,348 @@
+"""
+Save Archive Writer
+Writes .sav zip archives, deflating large entries in parallel blocks and
+reusing compressed blocks of unchanged data from the previous archive
+"""
+
+import os
+import struct
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+DEFAULT_LEVEL = 6
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+# Deflate back-references reach at most 32 KB, so that much of the previous
+# block primes each block's compressor and keeps the ratio close to serial
+WINDOW_SIZE = 32 * 1024
+
+ZIP32_LIMIT = 0xFFFFFFFF
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+
+# Central directory extra field holding the block map of a deflated entry:
+# one (raw size, compressed size, crc32) record per sync-flushed block
+BLOCK_MAP_ID = 0x4253
+_EXTRA_HEADER = struct.Struct('<HH')
+_BLOCK_RECORD = struct.Struct('<III')
+_MAX_EXTRA = 0xFFFF
+
+# Empty final deflate block that terminates a stream of sync-flushed blocks
+_FINAL_BLOCK = zlib.compressobj(DEFAULT_LEVEL, zlib.DEFLATED, -15).flush(zlib.Z_FINISH)
+
+_CRC_POLY = 0xedb88320
+
+
+class BlockInfo(NamedTuple):
+    """One independently decodable block of a deflated entry"""
+    raw_size: int
+    compress_size: int
+    crc: int
+
+
+class EntryInfo(NamedTuple):
+    """Location and checksums of an entry's data in an existing archive"""
+    name: str
+    method: int
+    crc: int
+    compress_size: int
+    file_size: int
+    data_offset: int
+    blocks: Optional[List[BlockInfo]]
+
+
+def _multmodp(a: int, b: int) -> int:
+    """Multiply two polynomials modulo the CRC-32 polynomial"""
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if (a & (m - 1)) == 0:
+                break
+        m >>= 1
+        b = (b >> 1) ^ _CRC_POLY if b & 1 else b >> 1
+    return p
+
+
+def _x2n_table() -> List[int]:
+    """Precompute x^(2^n) modulo the CRC-32 polynomial"""
+    table = [1 << 30]
+    for _ in range(31):
+        table.append(_multmodp(table[-1], table[-1]))
+    return table
+
+
+_X2N = _x2n_table()
+
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """Get the CRC-32 of A+B from crc32(A), crc32(B) and len(B)
+    
+    Port of zlib's crc32_combine, which the zlib module does not expose.
+    Runs in O(log len2), so block CRCs can be reused without rereading data.
+    """
+    p = 1 << 31
+    k = 3
+    while len2:
+        if len2 & 1:
+            p = _multmodp(_X2N[k & 31], p)
+        len2 >>= 1
+        k += 1
+    return _multmodp(p, crc1) ^ crc2
+
+
+def _encode_block_map(blocks: List[BlockInfo]) -> bytes:
+    """Encode a block map as a zip extra field (empty if it doesn't fit)"""
+    size = len(blocks) * _BLOCK_RECORD.size
+    if not blocks or size + _EXTRA_HEADER.size > _MAX_EXTRA:
+        return b''
+    return _EXTRA_HEADER.pack(BLOCK_MAP_ID, size) + b''.join(_BLOCK_RECORD.pack(*block) for block in blocks)
+
+
+def _decode_block_map(extra: bytes) -> Optional[List[BlockInfo]]:
+    """Find and decode the block map in a zip extra field"""
+    pos = 0
+    while pos + _EXTRA_HEADER.size <= len(extra):
+        header_id, size = _EXTRA_HEADER.unpack_from(extra, pos)
+        pos += _EXTRA_HEADER.size
+        if header_id == BLOCK_MAP_ID:
+            return [BlockInfo(*record) for record in _BLOCK_RECORD.iter_unpack(extra[pos:pos + size])]
+        pos += size
+    return None
+
+
+def read_entries(path: str) -> Dict[str, EntryInfo]:
+    """Read where each entry's compressed data lives in an archive"""
+    entries = {}
+    with zipfile.ZipFile(path, 'r') as zf, open(path, 'rb') as fp:
+        for zinfo in zf.infolist():
+            # The local header's name and extra lengths can differ from the
+            # central directory's, so read them to find the data
+            fp.seek(zinfo.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', fp.read(4))
+            data_offset = zinfo.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+            entries[zinfo.filename] = EntryInfo(zinfo.filename, zinfo.compress_type, zinfo.CRC,
+                                                zinfo.compress_size, zinfo.file_size, data_offset,
+                                                _decode_block_map(zinfo.extra))
+    return entries
+
+
+def iter_blocks(chunks: Iterable[bytes], block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[bytes]:
+    """Regroup a stream of byte chunks into blocks of block_size (the last may be short)"""
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= block_size:
+            yield bytes(pending[:block_size])
+            del pending[:block_size]
+    if pending:
+        yield bytes(pending)
+
+
+def compress_block(block: bytes, dictionary: bytes, level: int) -> Tuple[bytes, BlockInfo]:
+    """Deflate one block as a byte-aligned piece of a larger raw deflate stream
+    
+    The block ends with a sync flush, so block outputs can simply be
+    concatenated; _FINAL_BLOCK terminates the stream.
+    """
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data, BlockInfo(len(block), len(data), zlib.crc32(block))
+
+
+def _dos_datetime(timestamp: Optional[float] = None):
+    """Get (dos_time, dos_date) for a timestamp"""
+    t = time.localtime(timestamp)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class ZipWriter:
+    """Minimal zip writer that can take data from a parallel deflater
+    
+    zipfile.ZipFile only compresses through a single zlib stream, so this
+    writes the local headers, data and central directory itself. The
+    output must be seekable; sizes and CRC are patched into each local
+    header once the entry is written. Deflated entries record a block map
+    in the central directory so a later save can reuse clean blocks.
+    
+    progress, if given, is called with the total uncompressed bytes written
+    so far after every block; raising from it aborts the write.
+    """
+    
+    def __init__(self, path: str, progress: Optional[Callable[[int], None]] = None):
+        self.fp = open(path, 'wb')
+        self._entries: List[tuple] = []
+        self._progress = progress
+        self._bytes_written = 0
+    
+    def __enter__(self) -> 'ZipWriter':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.fp.close()
+    
+    def write_entry(self, name: str, chunks: Iterable[bytes], level: int = DEFAULT_LEVEL,
+                    store: bool = False, workers: Optional[int] = None,
+                    block_size: int = DEFAULT_BLOCK_SIZE):
+        """Write one entry from a stream of byte chunks
+        
+        Args:
+            name: Entry name inside the archive
+            chunks: The uncompressed data, in any chunking
+            level: zlib compression level (0-9)
+            store: Write the data uncompressed (fast mode for scratch saves)
+            workers: Compression threads (default: CPU count)
+            block_size: Uncompressed bytes per independently compressed block
+        """
+        if store:
+            self._begin_entry(name, ZIP_STORED)
+            self._finish_entry(*self._write_stored(chunks))
+        else:
+            self.write_blocks(name, _chain_dictionaries(iter_blocks(chunks, block_size)), level, workers)
+    
+    def write_blocks(self, name: str, parts: Iterable[tuple], level: int = DEFAULT_LEVEL,
+                     workers: Optional[int] = None):
+        """Write a deflated entry from a mix of new and reused blocks
+        
+        Each part is either ('data', block, dictionary), compressed on the
+        thread pool with dictionary as its 32 KB history, or
+        ('copy', source_fp, offset, BlockInfo), whose compressed bytes are
+        copied unchanged from another archive.
+        """
+        self._begin_entry(name, ZIP_DEFLATED)
+        self._finish_entry(*self._write_deflated(parts, level, workers))
+    
+    def copy_entry(self, source_fp, info: EntryInfo):
+        """Copy an entry's compressed data byte for byte from another archive"""
+        self._begin_entry(info.name, info.method)
+        source_fp.seek(info.data_offset)
+        remaining = info.compress_size
+        while remaining:
+            data = source_fp.read(min(remaining, DEFAULT_BLOCK_SIZE))
+            if not data:
+                raise ValueError(f"Source archive is truncated in entry {info.name}")
+            self.fp.write(data)
+            remaining -= len(data)
+        self._advance(info.file_size)
+        self._finish_entry(info.crc, info.file_size, info.compress_size, info.blocks or [])
+    
+    def _advance(self, size: int):
+        """Count uncompressed bytes written and report them"""
+        self._bytes_written += size
+        if self._progress is not None:
+            self._progress(self._bytes_written)
+    
+    def _begin_entry(self, name: str, method: int):
+        """Write a placeholder local header; CRC and sizes are filled in afterwards"""
+        name_bytes = name.encode('utf-8')
+        dos_time, dos_date = _dos_datetime()
+        self._current = (name_bytes, method, self.fp.tell(), dos_time, dos_date)
+        self.fp.write(_LOCAL_HEADER.pack(0x04034b50, 20, 0, method, dos_time, dos_date,
+                                         0, 0, 0, len(name_bytes), 0))
+        self.fp.write(name_bytes)
+    
+    def _finish_entry(self, crc: int, file_size: int, compress_size: int, blocks: List[BlockInfo]):
+        """Patch the local header of the current entry and record it"""
+        name_bytes, method, header_offset, dos_time, dos_date = self._current
+        if file_size > ZIP32_LIMIT or compress_size > ZIP32_LIMIT or header_offset > ZIP32_LIMIT:
+            raise ValueError(f"Entry {name_bytes.decode('utf-8')} is too large for a zip32 archive")
+        
+        end = self.fp.tell()
+        self.fp.seek(header_offset + 14)
+        self.fp.write(struct.pack('<III', crc, compress_size, file_size))
+        self.fp.seek(end)
+        
+        self._entries.append((name_bytes, method, dos_time, dos_date, crc, compress_size,
+                              file_size, header_offset, _encode_block_map(blocks)))
+    
+    def _write_stored(self, chunks: Iterable[bytes]):
+        """Copy chunks uncompressed, returning (crc, size, size, no blocks)"""
+        crc = 0
+        size = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            self.fp.write(chunk)
+            self._advance(len(chunk))
+        return crc, size, size, []
+    
+    def _write_deflated(self, parts: Iterable[tuple], level: int, workers: Optional[int]):
+        """Deflate blocks on a thread pool (zlib releases the GIL) and write them in order"""
+        workers = workers or os.cpu_count() or 1
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        blocks = []
+        in_flight = deque()
+        
+        def drain(limit: int):
+            nonlocal crc, file_size, compress_size
+            while len(in_flight) > limit:
+                pending = in_flight.popleft()
+                data, block = pending.result() if isinstance(pending, Future) else pending
+                self.fp.write(data)
+                crc = crc32_combine(crc, block.crc, block.raw_size)
+                file_size += block.raw_size
+                compress_size += block.compress_size
+                blocks.append(block)
+                self._advance(block.raw_size)
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for part in parts:
+                if part[0] == 'copy':
+                    _, source_fp, offset, block = part
+                    source_fp.seek(offset)
+                    in_flight.append((source_fp.read(block.compress_size), block))
+                else:
+                    _, data, dictionary = part
+                    in_flight.append(pool.submit(compress_block, data, dictionary, level))
+                drain(workers * 2)
+            drain(0)
+        
+        self.fp.write(_FINAL_BLOCK)
+        return crc, file_size, compress_size + len(_FINAL_BLOCK), blocks
+    
+    def close(self):
+        """Write the central directory and close the file"""
+        if self.fp.closed:
+            return
+        
+        directory_offset = self.fp.tell()
+        for (name_bytes, method, dos_time, dos_date, crc, compress_size,
+             file_size, header_offset, extra) in self._entries:
+            self.fp.write(_CENTRAL_HEADER.pack(0x02014b50, 20, 20, 0, method, dos_time, dos_date,
+                                               crc, compress_size, file_size, len(name_bytes),
+                                               len(extra), 0, 0, 0, 0, header_offset))
+            self.fp.write(name_bytes)
+            self.fp.write(extra)
+        directory_size = self.fp.tell() - directory_offset
+        
+        self.fp.write(_END_RECORD.pack(0x06054b50, 0, 0, len(self._entries), len(self._entries),
+                                       directory_size, directory_offset, 0))
+        self.fp.close()
+
+
+def _chain_dictionaries(blocks: Iterable[bytes]) -> Iterator[tuple]:
+    """Turn plain blocks into ('data', block, dictionary) parts"""
+    dictionary = b''
+    for block in blocks:
+        yield 'data', block, dictionary
+        dictionary = block[-WINDOW_SIZE:]